@@ -0,0 +1 @@
+"""pixivにアクセスせずに、ブックマークの取得と整理の速さを測るベンチマーク"""
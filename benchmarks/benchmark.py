@@ -0,0 +1,164 @@
+"""`FakeAppPixivAPI`を相手に、ブックマークの取得と整理の速さを測るベンチマーク
+
+例: `python -m benchmarks.benchmark --bookmarks 10000 --latency 0.2 --concurrency 8`
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+from typing import Any, Dict
+
+from bookmark_classify import batch, bookmark_classify, consts, get_bookmarks, plan
+from bookmark_classify.rate_limiter import AdaptiveRateLimiter
+from bookmark_classify.retry_queue import RetryQueue
+from bookmark_classify.tag_rules import TagRules
+from bookmark_classify.verification import VerificationPolicy
+from bookmark_classify.web_backend import PixivWebBackend
+
+from .fake_api import FakeAppPixivAPI, SyntheticAccount
+from .fake_web import FakeWebServer
+
+parser = argparse.ArgumentParser(description="pixivにアクセスせずに、ブックマークの取得と整理の速さを測ります。")
+parser.add_argument("--bookmarks", type=int, default=1000, help="合成するブックマークの数。")
+parser.add_argument("--seed", type=int, default=0, help="乱数のシード。")
+parser.add_argument("--latency", type=float, default=0.05, help="1回のAPI呼び出しの遅延(秒)。")
+parser.add_argument("--jitter", type=float, default=0.2, help="遅延のばらつきの割合。")
+parser.add_argument("--limit-requests", type=int, default=None,
+                    help="--window秒間に許可するリクエストの数。 指定しない場合はレート制限しません。")
+parser.add_argument("--window", type=float, default=60, help="リクエストの数を数える期間(秒)。")
+parser.add_argument("--penalty", type=float, default=60, help="レート制限の状態が続く時間(秒)。")
+parser.add_argument("--silent-mode", choices=["none", "stale"], default="none",
+                    help="レート制限の状態で、ブックマークの詳細をどう返すか。")
+parser.add_argument("--rate", type=float, default=50, help="レートリミッターの初期の流量(リクエスト/秒)。")
+parser.add_argument("--max-rate", type=float, default=100, help="レートリミッターの流量の上限(リクエスト/秒)。")
+parser.add_argument("--concurrency", type=int, default=4, help="同時に処理するイラストの数。")
+parser.add_argument("--verify-mode", choices=["always", "sampled", "deferred"], default="always",
+                    help="書き込みの確認の方法。")
+parser.add_argument("--cooldown", type=float, default=60, help="レート制限が発生したAPIを止める時間(秒)。")
+parser.add_argument("--max-retries", type=int, default=5, help="やり直す回数の上限。")
+parser.add_argument("--web-batch", action="store_true",
+                    help="計画を立て、ローカルのWebのAPIの代わりに、同じ内容の編集をまとめて書き込みます。")
+parser.add_argument("--json", default=None, help="結果をJSONで書き込むファイルのパス。")
+
+
+def peak_rss_mb() -> float:
+    """これまでの最大のメモリ使用量(MB)を返します。"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト, macOSはバイト単位
+    if sys.platform == "darwin":
+        return maxrss / 1024 / 1024
+    return maxrss / 1024
+
+
+def count_classified(account: SyntheticAccount, tag_rules: TagRules) -> int:
+    """整理が済んでいるブックマークの数を数えます。"""
+    classified = 0
+    for bookmark in account.bookmarks.values():
+        if bookmark.unknown:
+            continue
+        illust_tags = tag_rules.filter_excluded(list(bookmark.illust_tags))
+        if bookmark_classify.merge_bookmark_tags(list(bookmark.tags), illust_tags) is None:
+            classified += 1
+    return classified
+
+
+async def run(args) -> Dict[str, Any]:
+    account = SyntheticAccount(args.bookmarks, seed=args.seed)
+    api = FakeAppPixivAPI(
+        account,
+        latency_seconds=args.latency,
+        jitter=args.jitter,
+        limit_requests=args.limit_requests,
+        window_seconds=args.window,
+        penalty_seconds=args.penalty,
+        silent_mode=args.silent_mode,
+        seed=args.seed)
+    rate_limiter = AdaptiveRateLimiter(
+        rate=args.rate, max_rate=args.max_rate, burst=args.concurrency)
+    retry_queue = RetryQueue(args.max_retries, args.cooldown)
+    tag_rules = TagRules(["users"], ["R-18"], [])
+
+    started = time.monotonic()
+    illusts = []
+    for restrict in (consts.RESTRICT_PUBLIC, consts.RESTRICT_PRIVATE):
+        illusts.extend(await get_bookmarks.get_all_bookmarks_illust(
+            api, api.user_id, restrict, rate_limiter=rate_limiter))
+    fetch_seconds = time.monotonic() - started
+    fetch_calls = sum(api.calls.values())
+
+    started = time.monotonic()
+    web_calls = {}
+    web_limited_seconds = 0.0
+    if args.web_batch:
+        server = FakeWebServer(
+            account,
+            latency_seconds=args.latency,
+            limit_requests=args.limit_requests,
+            window_seconds=args.window,
+            penalty_seconds=args.penalty)
+        web_backend = PixivWebBackend(server.session_id, base_url=await server.start())
+        try:
+            await batch.apply_plan_batched(
+                api,
+                web_backend,
+                api.user_id,
+                plan.plan_bookmarks(illusts, tag_rules, delete_if_unknown=True),
+                rate_limiter=rate_limiter,
+                retry_queue=retry_queue,
+                max_retries=args.max_retries)
+        finally:
+            await web_backend.close()
+            await server.close()
+        web_calls = {f"web_{endpoint}": count for endpoint, count in server.calls.items()}
+        web_limited_seconds = server.limited_seconds
+    else:
+        await bookmark_classify.bookmarks_classify(
+            api,
+            illusts,
+            tag_rules,
+            delete_if_unknown=True,
+            rate_limiter=rate_limiter,
+            verification=VerificationPolicy(args.verify_mode),
+            concurrency=args.concurrency,
+            retry_queue=retry_queue)
+    classify_seconds = time.monotonic() - started
+
+    illusts_per_hour = round(len(illusts) / classify_seconds * 3600) if classify_seconds else None
+    classify_calls = {endpoint: count for endpoint, count in api.calls.items()
+                      if endpoint != "user_bookmarks_illust"}
+    classify_calls.update(web_calls)
+    return {
+        "bookmarks": args.bookmarks,
+        "fetch_seconds": round(fetch_seconds, 3),
+        "fetch_calls": fetch_calls,
+        "classify_seconds": round(classify_seconds, 3),
+        "illusts_per_hour": illusts_per_hour,
+        "calls_per_illust": {endpoint: round(count / len(illusts), 3)
+                             for endpoint, count in sorted(classify_calls.items())},
+        "total_calls_per_illust": round(sum(classify_calls.values()) / len(illusts), 3),
+        "ratelimited_seconds": round(api.limited_seconds + web_limited_seconds, 3),
+        "ignored_writes": api.ignored_writes,
+        "dead_letters": len(retry_queue.dead_letters),
+        "rejections": len(retry_queue.rejections),
+        "classified": count_classified(account, tag_rules),
+        "remaining_bookmarks": len(account),
+        "final_rate": round(rate_limiter.rate, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "result": result}, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""pixivにアクセスせずに動作を確かめるための、AppPixivAPIの代わりになるモジュール"""
+
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Literal, NamedTuple, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from pixivpy_async.utils import JsonDict
+
+from bookmark_classify.consts import (LIMIT_UNKNOWN, RESTRICT_PRIVATE, RESTRICT_PUBLIC,
+                                      UNCATEGORIZED_TAG)
+from bookmark_classify.utils import Restrict
+
+BOOKMARKS_URL = "https://app-api.pixiv.net/v1/user/bookmarks/illust"
+PAGE_SIZE = 30
+
+SilentMode = Literal["none", "stale"]
+
+
+class SyntheticBookmark(NamedTuple):
+    """合成したアカウントの、1つのブックマーク。
+
+    Attributes:
+        illust_tags (Tuple[str, ...]): イラストのタグ名。
+        tags (Tuple[str, ...]): ブックマークのタグ名。
+        restrict (Restrict): ブックマークのプライバシー設定。
+        unknown (bool): 非公開もしくは削除済みのイラストか。
+    """
+    illust_tags: Tuple[str, ...]
+    tags: Tuple[str, ...]
+    restrict: Restrict
+    unknown: bool
+
+
+class SyntheticAccount():
+    """ブックマークを合成したアカウント。
+
+    イラストのタグは、`vocabulary_size`個の語彙からZipf分布に近い偏りで選ばれます。
+
+    Args:
+        bookmarks (int, optional): ブックマークの数。 デフォルトは`1000`です。
+        private_fraction (float, optional): 非公開ブックマークの割合。 デフォルトは`0.2`です。
+        tagged_fraction (float, optional): 既にブックマークにタグが付いている割合。 デフォルトは`0.3`です。
+        unknown_fraction (float, optional): 非公開もしくは削除済みのイラストの割合。 デフォルトは`0.02`です。
+        vocabulary_size (int, optional): タグの語彙の数。 デフォルトは`5000`です。
+        tags_per_illust (int, optional): イラスト1つあたりのタグの数の上限。 デフォルトは`10`です。
+        seed (int, optional): 乱数のシード。 デフォルトは`0`です。
+    """
+
+    def __init__(
+        self,
+        bookmarks: int = 1000,
+        private_fraction: float = 0.2,
+        tagged_fraction: float = 0.3,
+        unknown_fraction: float = 0.02,
+        vocabulary_size: int = 5000,
+        tags_per_illust: int = 10,
+        seed: int = 0
+    ) -> None:
+        rng = random.Random(seed)
+        vocabulary = [f"tag{i}" for i in range(vocabulary_size)] + ["R-18", "10000users入り"]
+        weights = [1 / (i + 1) for i in range(len(vocabulary))]
+
+        self.user_id = 1
+        self.bookmarks: Dict[int, SyntheticBookmark] = {}
+        for illust_id in range(1, bookmarks + 1):
+            illust_tags = tuple(dict.fromkeys(
+                rng.choices(vocabulary, weights, k=rng.randint(1, tags_per_illust))))
+            if rng.random() < tagged_fraction:
+                tags = illust_tags[:rng.randint(1, len(illust_tags))]
+            else:
+                tags = ()
+            restrict = RESTRICT_PRIVATE if rng.random() < private_fraction else RESTRICT_PUBLIC
+            unknown = rng.random() < unknown_fraction
+            self.bookmarks[illust_id] = SyntheticBookmark(illust_tags, tags, restrict, unknown)
+
+    def __len__(self) -> int:
+        return len(self.bookmarks)
+
+
+class FakeAppPixivAPI():
+    """`SyntheticAccount`を相手に、ブックマークに関するAppPixivAPIのメソッドを再現するクラス。
+
+    各メソッドの呼び出しには`latency_seconds`(±`jitter`の割合)の遅延が入ります。
+    `window_seconds`秒間に`limit_requests`回を超えてリクエストすると、`penalty_seconds`秒間レート制限の状態になります。
+    レート制限の状態では、実際のAPIと同じように例外を送出せず、ブックマークの追加/削除は反映されません。
+    ブックマークの詳細は、`silent_mode`が`"none"`の場合は`None`を、`"stale"`の場合は変更前の状態を返します。
+    一覧の取得はレート制限の対象外です。
+
+    Args:
+        account (SyntheticAccount): ブックマークを持つアカウント。
+        latency_seconds (float, optional): 1回の呼び出しの遅延。 秒単位で指定してください。 デフォルトは`0`です。
+        jitter (float, optional): 遅延のばらつきの割合。 デフォルトは`0`です。
+        limit_requests (int | None, optional): `window_seconds`秒間に許可するリクエストの数。
+        `None`の場合はレート制限しません。 デフォルトは`None`です。
+        window_seconds (float, optional): リクエストの数を数える期間。 秒単位で指定してください。 デフォルトは`60`です。
+        penalty_seconds (float, optional): レート制限の状態が続く時間。 秒単位で指定してください。 デフォルトは`60`です。
+        silent_mode (SilentMode, optional): レート制限の状態で、ブックマークの詳細をどう返すか。
+        デフォルトは`"none"`です。
+        seed (int, optional): 乱数のシード。 デフォルトは`0`です。
+    """
+
+    def __init__(
+        self,
+        account: SyntheticAccount,
+        latency_seconds: float = 0,
+        jitter: float = 0,
+        limit_requests: int | None = None,
+        window_seconds: float = 60,
+        penalty_seconds: float = 60,
+        silent_mode: SilentMode = "none",
+        seed: int = 0
+    ) -> None:
+        self.account = account
+        self.user_id = account.user_id
+        self.access_token: str | None = None
+        self.refresh_token: str | None = None
+        self.latency_seconds = latency_seconds
+        self.jitter = jitter
+        self.limit_requests = limit_requests
+        self.window_seconds = window_seconds
+        self.penalty_seconds = penalty_seconds
+        self.silent_mode = silent_mode
+
+        self.calls: Counter = Counter()
+        self.ignored_writes = 0
+        self.limited_seconds = 0.0
+
+        self._rng = random.Random(seed)
+        self._requests: Deque[float] = deque()
+        self._limited_until = 0.0
+        # 一覧はブックマークした順(IDの降順)に返す
+        self._ordered: Dict[Restrict, List[int]] = {RESTRICT_PUBLIC: [], RESTRICT_PRIVATE: []}
+        for illust_id in sorted(account.bookmarks, reverse=True):
+            self._ordered[account.bookmarks[illust_id].restrict].append(illust_id)
+
+    async def login(self, refresh_token: str | None = None, **kwargs) -> JsonDict:
+        self.calls["login"] += 1
+        self.access_token = f"access{self.calls['login']}"
+        self.refresh_token = refresh_token or self.refresh_token
+        return JsonDict(response=JsonDict(
+            access_token=self.access_token,
+            refresh_token=self.refresh_token,
+            expires_in=3600,
+            user=JsonDict(id=self.user_id)))
+
+    async def _call(self, endpoint: str, limited: bool = True) -> bool:
+        """遅延を入れ、レート制限の状態かを返します。"""
+        self.calls[endpoint] += 1
+        if 0 < self.latency_seconds:
+            delay = self.latency_seconds * (1 + self.jitter * (2 * self._rng.random() - 1))
+            await asyncio.sleep(max(delay, 0))
+
+        if (not limited) or (self.limit_requests is None):
+            return False
+
+        now = time.monotonic()
+        if now < self._limited_until:
+            return True
+
+        self._requests.append(now)
+        while self._requests[0] <= now - self.window_seconds:
+            self._requests.popleft()
+        if self.limit_requests < len(self._requests):
+            self._limited_until = now + self.penalty_seconds
+            self.limited_seconds += self.penalty_seconds
+            self._requests.clear()
+            return True
+        return False
+
+    def _illust(self, illust_id: int) -> JsonDict:
+        bookmark = self.account.bookmarks[illust_id]
+        if bookmark.unknown:
+            return JsonDict(
+                id=illust_id,
+                title="-----",
+                tags=[],
+                image_urls=JsonDict(square_medium=LIMIT_UNKNOWN))
+        return JsonDict(
+            id=illust_id,
+            title=f"illust{illust_id}",
+            tags=[JsonDict(name=tag, translated_name=None) for tag in bookmark.illust_tags],
+            image_urls=JsonDict(
+                square_medium=f"https://i.pximg.net/c/360x360_70/img-master/{illust_id}.jpg"))
+
+    def parse_qs(self, next_url: str) -> Dict[str, Any]:
+        return dict(parse_qsl(urlparse(next_url).query))
+
+    async def user_bookmarks_illust(
+        self,
+        user_id: int | str,
+        restrict: Restrict = RESTRICT_PUBLIC,
+        tag: str | None = None,
+        max_bookmark_id: int | str | None = None,
+        **kwargs
+    ) -> JsonDict:
+        await self._call("user_bookmarks_illust", limited=False)
+
+        bookmarks = self.account.bookmarks
+        ordered = self._ordered[restrict]
+        if tag == UNCATEGORIZED_TAG:
+            ordered = [illust_id for illust_id in ordered
+                       if (illust_id in bookmarks) and not bookmarks[illust_id].tags]
+        elif tag:
+            ordered = [illust_id for illust_id in ordered
+                       if (illust_id in bookmarks) and (tag in bookmarks[illust_id].tags)]
+
+        start = 0
+        if max_bookmark_id is not None:
+            max_bookmark_id = int(max_bookmark_id)
+            # IDの降順に並んでいるため、二分探索で開始位置を探す
+            low, high = 0, len(ordered)
+            while low < high:
+                middle = (low + high) // 2
+                if max_bookmark_id < ordered[middle]:
+                    low = middle + 1
+                else:
+                    high = middle
+            start = low
+
+        # 解除されたブックマークは飛ばす
+        page = []
+        end = start
+        while (end < len(ordered)) and (len(page) < PAGE_SIZE):
+            if ordered[end] in bookmarks:
+                page.append(ordered[end])
+            end += 1
+
+        next_url = None
+        if end < len(ordered):
+            query = {"user_id": user_id, "restrict": restrict, "max_bookmark_id": ordered[end]}
+            if tag:
+                query["tag"] = tag
+            next_url = f"{BOOKMARKS_URL}?{urlencode(query)}"
+
+        return JsonDict(illusts=[self._illust(illust_id) for illust_id in page], next_url=next_url)
+
+    async def illust_bookmark_detail(self, illust_id: int) -> JsonDict:
+        limited = await self._call("illust_bookmark_detail")
+        if limited and self.silent_mode == "none":
+            return JsonDict(bookmark_detail=None)
+
+        bookmark = self.account.bookmarks.get(illust_id)
+        if bookmark is None:
+            return JsonDict(bookmark_detail=JsonDict(
+                is_bookmarked=False, tags=[], restrict=RESTRICT_PUBLIC))
+        return JsonDict(bookmark_detail=JsonDict(
+            is_bookmarked=True,
+            tags=[JsonDict(name=tag, is_registered=True) for tag in bookmark.tags],
+            restrict=bookmark.restrict))
+
+    async def illust_bookmark_add(
+        self,
+        illust_id: int,
+        restrict: Restrict = RESTRICT_PUBLIC,
+        tags: List[str] | None = None
+    ) -> JsonDict:
+        if await self._call("illust_bookmark_add"):
+            self.ignored_writes += 1
+            return JsonDict()
+
+        # 実際のAPIと同じように、空白で区切られたタグは別のタグとして扱う
+        names = tuple(dict.fromkeys(name for tag in tags or [] for name in tag.split()))
+        before = self.account.bookmarks.get(illust_id)
+        if before is None:
+            return JsonDict()
+        self.account.bookmarks[illust_id] = before._replace(tags=names, restrict=restrict)
+        return JsonDict()
+
+    async def illust_bookmark_delete(self, illust_id: int) -> JsonDict:
+        if await self._call("illust_bookmark_delete"):
+            self.ignored_writes += 1
+            return JsonDict()
+
+        self.account.bookmarks.pop(illust_id, None)
+        return JsonDict()
@@ -0,0 +1,220 @@
+"""pixivにアクセスせずに動作を確かめるための、WebのAJAX APIの代わりになるローカルのサーバー"""
+
+import asyncio
+import secrets
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List
+
+from aiohttp import web
+
+from bookmark_classify.consts import RESTRICT_PRIVATE, RESTRICT_PUBLIC, UNCATEGORIZED_TAG
+from bookmark_classify.utils import Restrict
+
+from .fake_api import SyntheticAccount
+
+# ブックマークのIDは、イラストのIDにこの値を足したものにする
+BOOKMARK_ID_OFFSET = 1000000000
+
+
+class FakeWebServer():
+    """`SyntheticAccount`を相手に、ブックマークに関するWebのAJAX APIを再現するローカルのサーバー。
+
+    Cookie`PHPSESSID`が`session_id`と一致しないリクエストは、403を返します。
+    書き込みには、トップページに埋め込んだCSRFトークンが必要です。
+    `window_seconds`秒間に`limit_requests`回を超えてリクエストすると、`penalty_seconds`秒間は429を返します。
+    `blocked_illust_ids`のブックマークを含む書き込みは、ブロックしたユーザーのイラストと同じように、400を返して拒否します。
+    `rejected_tags`のタグを追加する書き込みは、使えない文字を含むタグと同じように、400を返して拒否します。
+
+    Args:
+        account (SyntheticAccount): ブックマークを持つアカウント。 `FakeAppPixivAPI`と共有できます。
+        session_id (str, optional): 受け付けるCookie`PHPSESSID`の値。 デフォルトは`"session"`です。
+        latency_seconds (float, optional): 1回のリクエストの遅延。 秒単位で指定してください。 デフォルトは`0`です。
+        limit_requests (int | None, optional): `window_seconds`秒間に許可するリクエストの数。
+        `None`の場合はレート制限しません。 デフォルトは`None`です。
+        window_seconds (float, optional): リクエストの数を数える期間。 秒単位で指定してください。 デフォルトは`60`です。
+        penalty_seconds (float, optional): レート制限の状態が続く時間。 秒単位で指定してください。 デフォルトは`60`です。
+        blocked_illust_ids (List[int] | None, optional): 書き込みを拒否するイラストのID。 デフォルトは`None`です。
+        rejected_tags (List[str] | None, optional): 追加を拒否するタグ名。 デフォルトは`None`です。
+    """
+
+    def __init__(
+        self,
+        account: SyntheticAccount,
+        session_id: str = "session",
+        latency_seconds: float = 0,
+        limit_requests: int | None = None,
+        window_seconds: float = 60,
+        penalty_seconds: float = 60,
+        blocked_illust_ids: List[int] | None = None,
+        rejected_tags: List[str] | None = None
+    ) -> None:
+        self.account = account
+        self.session_id = session_id
+        self.csrf_token = secrets.token_hex(16)
+        self.latency_seconds = latency_seconds
+        self.limit_requests = limit_requests
+        self.window_seconds = window_seconds
+        self.penalty_seconds = penalty_seconds
+        self.blocked_illust_ids = set(blocked_illust_ids or [])
+        self.rejected_tags = set(rejected_tags or [])
+
+        self.calls: Counter = Counter()
+        self.limited_seconds = 0.0
+
+        self._requests: Deque[float] = deque()
+        self._limited_until = 0.0
+        self._runner: web.AppRunner | None = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.add_routes([
+            web.get("/", self.top),
+            web.get("/ajax/user/{user_id}/illusts/bookmarks", self.bookmarks),
+            web.post("/ajax/illusts/bookmarks/add_tags", self.add_tags),
+            web.post("/ajax/illusts/bookmarks/remove_tags", self.remove_tags),
+            web.post("/ajax/illusts/bookmarks/edit_restrict", self.edit_restrict),
+            web.post("/ajax/illusts/bookmarks/remove", self.remove),
+        ])
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """サーバーを起動し、URLを返します。
+
+        Args:
+            host (str, optional): 待ち受けるアドレス。 デフォルトは`"127.0.0.1"`です。
+            port (int, optional): 待ち受けるポート。 `0`の場合は空いているポートを使います。 デフォルトは`0`です。
+
+        Returns:
+            str: サーバーのURL。 `PixivWebBackend`の`base_url`に指定してください。
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        """サーバーを止めます。"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def _error(status: int, message: str) -> web.Response:
+        return web.json_response({"error": True, "message": message, "body": []}, status=status)
+
+    @staticmethod
+    def _ok(body=None) -> web.Response:
+        return web.json_response({"error": False, "message": "", "body": body or []})
+
+    def _is_limited(self) -> bool:
+        if self.limit_requests is None:
+            return False
+
+        now = time.monotonic()
+        if now < self._limited_until:
+            return True
+
+        self._requests.append(now)
+        while self._requests[0] <= now - self.window_seconds:
+            self._requests.popleft()
+        if self.limit_requests < len(self._requests):
+            self._limited_until = now + self.penalty_seconds
+            self.limited_seconds += self.penalty_seconds
+            self._requests.clear()
+            return True
+        return False
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        """遅延、認証、レート制限を再現するミドルウェア。"""
+        self.calls[getattr(handler, "__name__", request.path)] += 1
+        if 0 < self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+
+        if request.cookies.get("PHPSESSID") != self.session_id:
+            return self._error(403, "ログインしてください")
+        if request.path == "/":
+            return await handler(request)
+        if self._is_limited():
+            return self._error(429, "Rate Limit")
+        if request.method == "GET":
+            return await handler(request)
+
+        if request.headers.get("x-csrf-token") != self.csrf_token:
+            return self._error(400, "不正なリクエストです")
+        payload = await request.json()
+        bookmark_ids = payload["bookmarkIds"]
+        if self.blocked_illust_ids.intersection(
+                int(bookmark_id) - BOOKMARK_ID_OFFSET for bookmark_id in bookmark_ids):
+            return self._error(400, "このブックマークは編集できません")
+        return await handler(request)
+
+    def _illust_ids(self, bookmark_ids: List[str]) -> List[int]:
+        illust_ids = [int(bookmark_id) - BOOKMARK_ID_OFFSET for bookmark_id in bookmark_ids]
+        return [illust_id for illust_id in illust_ids if illust_id in self.account.bookmarks]
+
+    async def top(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=f'<meta name="global-data" content=\'{{"token":"{self.csrf_token}"}}\'>',
+            content_type="text/html")
+
+    async def bookmarks(self, request: web.Request) -> web.Response:
+        restrict: Restrict = RESTRICT_PRIVATE if request.query.get("rest") == "hide" \
+            else RESTRICT_PUBLIC
+        tag = request.query.get("tag", "")
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", 48))
+
+        # ブックマークした順(IDの降順)に返す
+        illust_ids = []
+        for illust_id in sorted(self.account.bookmarks, reverse=True):
+            bookmark = self.account.bookmarks[illust_id]
+            if bookmark.restrict != restrict:
+                continue
+            if (tag == UNCATEGORIZED_TAG) and bookmark.tags:
+                continue
+            if tag and (tag != UNCATEGORIZED_TAG) and (tag not in bookmark.tags):
+                continue
+            illust_ids.append(illust_id)
+
+        works = [{"id": str(illust_id),
+                  "bookmarkData": {"id": str(illust_id + BOOKMARK_ID_OFFSET),
+                                   "private": restrict == RESTRICT_PRIVATE}}
+                 for illust_id in illust_ids[offset:offset + limit]]
+        return self._ok({"works": works, "total": len(illust_ids)})
+
+    async def add_tags(self, request: web.Request) -> web.Response:
+        payload: Dict = await request.json()
+        # 実際のAPIと同じように、空白で区切られたタグは別のタグとして扱う
+        tags = [name for tag in payload["tags"] for name in tag.split()]
+        if self.rejected_tags.intersection(tags):
+            return self._error(400, "タグに使用できない文字が含まれています")
+        for illust_id in self._illust_ids(payload["bookmarkIds"]):
+            bookmark = self.account.bookmarks[illust_id]
+            self.account.bookmarks[illust_id] = bookmark._replace(
+                tags=tuple(dict.fromkeys(bookmark.tags + tuple(tags))))
+        return self._ok()
+
+    async def remove_tags(self, request: web.Request) -> web.Response:
+        payload: Dict = await request.json()
+        tags = set(payload["removeTags"])
+        for illust_id in self._illust_ids(payload["bookmarkIds"]):
+            bookmark = self.account.bookmarks[illust_id]
+            self.account.bookmarks[illust_id] = bookmark._replace(
+                tags=tuple(tag for tag in bookmark.tags if tag not in tags))
+        return self._ok()
+
+    async def edit_restrict(self, request: web.Request) -> web.Response:
+        payload: Dict = await request.json()
+        for illust_id in self._illust_ids(payload["bookmarkIds"]):
+            bookmark = self.account.bookmarks[illust_id]
+            self.account.bookmarks[illust_id] = bookmark._replace(
+                restrict=payload["bookmarkRestrict"])
+        return self._ok()
+
+    async def remove(self, request: web.Request) -> web.Response:
+        payload: Dict = await request.json()
+        for illust_id in self._illust_ids(payload["bookmarkIds"]):
+            self.account.bookmarks.pop(illust_id)
+        return self._ok()
@@ -1,4 +1,10 @@
-from . import bookmark_classify, exceptions, get_bookmarks, utils
+from . import (backend, batch, bookmark_cache, bookmark_classify, bookmark_store, exceptions,
+               get_bookmarks, illust, journal, metrics, plan, profiling, purge, rate_limiter,
+               retry_queue, session, tag_frequency, tag_rules, timeouts, utils, verification,
+               watchdog, web_backend)
 
 
-__all__ = ["bookmark_classify", "exceptions", "get_bookmarks", "utils"]
+__all__ = ["backend", "batch", "bookmark_cache", "bookmark_classify", "bookmark_store",
+           "exceptions", "get_bookmarks", "illust", "journal", "metrics", "plan", "profiling",
+           "purge", "rate_limiter", "retry_queue", "session", "tag_frequency", "tag_rules",
+           "timeouts", "utils", "verification", "watchdog", "web_backend"]
@@ -0,0 +1,92 @@
+"""ブックマークを読み書きするバックエンドの、共通のインターフェースを定めるモジュール
+
+整理の処理は、`BookmarkBackend`のメソッドだけを使ってブックマークを読み書きします。
+AppPixivAPIはそのまま`BookmarkBackend`として使えるほか、
+`FakeAppPixivAPI`や、レートリミッターなどのラッパーも同じように扱えます。
+
+複数のブックマークをまとめて書き換えられるバックエンドは、`BatchBookmarkBackend`を実装します。
+"""
+
+from typing import Any, Dict, List, NamedTuple, Protocol
+
+from .utils import Restrict
+
+
+class BookmarkBackend(Protocol):
+    """イラスト1つずつのブックマークを読み書きするバックエンド。
+    メソッドと戻り値は、AppPixivAPIの同じ名前のメソッドに合わせています。
+    """
+
+    async def user_bookmarks_illust(
+        self,
+        user_id: int | str,
+        restrict: Restrict = "public",
+        tag: str | None = None,
+        **kwargs
+    ) -> Any:
+        """ユーザーのブックマークの一覧を1ページ取得します。 `illusts`と`next_url`を持つ辞書を返します。"""
+        ...
+
+    def parse_qs(self, next_url: str) -> Dict[str, Any]:
+        """`next_url`を、次のページを取得する`user_bookmarks_illust`の引数に変換します。"""
+        ...
+
+    async def illust_bookmark_detail(self, illust_id: int) -> Any:
+        """ブックマークの詳細を取得します。 `bookmark_detail`を持つ辞書を返します。"""
+        ...
+
+    async def illust_bookmark_add(
+        self,
+        illust_id: int,
+        restrict: Restrict = "public",
+        tags: List[str] | None = None
+    ) -> Any:
+        """ブックマークのタグとプライバシー設定を、`tags`と`restrict`に書き換えます。"""
+        ...
+
+    async def illust_bookmark_delete(self, illust_id: int) -> Any:
+        """ブックマークを解除します。"""
+        ...
+
+
+class BookmarkIdPage(NamedTuple):
+    """ブックマークの一覧の1ページ分の、イラストのIDとブックマークのID。
+
+    Attributes:
+        bookmark_ids (Dict[int, str]): イラストのIDとブックマークのIDの辞書。
+        next_offset (int | None): 次のページの位置。 最後のページの場合は`None`です。
+    """
+    bookmark_ids: Dict[int, str]
+    next_offset: int | None
+
+
+class BatchBookmarkBackend(Protocol):
+    """複数のブックマークを、1回のリクエストでまとめて書き換えるバックエンド。
+    ブックマークは、イラストのIDではなくブックマークのIDで指定します。
+    """
+
+    async def list_bookmark_ids(
+        self,
+        user_id: int | str,
+        restrict: Restrict = "public",
+        tag: str | None = None,
+        offset: int = 0
+    ) -> BookmarkIdPage:
+        """ユーザーのブックマークの一覧を、`offset`の位置から1ページ取得します。"""
+        ...
+
+    async def add_bookmark_tags(self, bookmark_ids: List[str], tags: List[str]) -> None:
+        """ブックマークに`tags`を追加します。 既に付いているタグは残ります。"""
+        ...
+
+    async def remove_bookmark_tags(self, bookmark_ids: List[str], tags: List[str]) -> None:
+        """ブックマークから`tags`を外します。"""
+        ...
+
+    async def edit_bookmark_restrict(self, bookmark_ids: List[str], restrict: Restrict) -> None:
+        """ブックマークのプライバシー設定を、`restrict`に変更します。"""
+        ...
+
+    async def remove_bookmarks(self, bookmark_ids: List[str]) -> None:
+        """ブックマークを解除します。"""
+        ...
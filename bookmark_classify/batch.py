@@ -0,0 +1,441 @@
+"""計画したブックマークの編集を、同じタグ、同じプライバシー設定ごとにまとめて書き込むモジュール
+
+`plan.apply_plan`は、計画をイラスト1つずつ`illust_bookmark_add`などで書き込み、書き込みごとに確認します。
+`apply_plan_batched`は、`backend.BatchBookmarkBackend`を使い、同じ内容の編集をまとめて1回のリクエストで書き込みます。
+"""
+
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+import aiohttp
+
+from .backend import BatchBookmarkBackend, BookmarkBackend
+from .bookmark_classify import (get_bookmark_tag_names, merge_bookmark_tags, normalize_tag_name,
+                                split_bookmark_tags)
+from .bookmark_store import BookmarkState, BookmarkStore
+from .consts import RESTRICT_PRIVATE, RESTRICT_PUBLIC, UNCATEGORIZED_TAG
+from .exceptions import BookmarkDetailRateLimited, RateLimited, TagRejected, WebAPIError
+from .journal import ProgressJournal
+from .metrics import RunMetrics
+from .plan import PlanEntry
+from .rate_limiter import RateLimiter
+from .retry_queue import RetryQueue
+from .tag_frequency import TagFrequencyIndex
+from .utils import BatchAction, PreferredTag, Restrict
+
+# 1回のリクエストで書き換えるブックマークの数の上限
+BATCH_SIZE = 100
+# まとめた編集を送る順番。 ブックマークのタグの数の上限を超えないように、外すタグを先に送る。
+# 後の編集が拒否されたブックマークは、送った編集を取り消して編集前のタグに戻す
+BATCH_ACTIONS: Tuple[BatchAction, ...] = ("remove", "remove_tags", "add_tags", "edit_restrict")
+
+
+class BatchEdit(NamedTuple):
+    """1回のリクエストで行う、まとめた編集。
+
+    Attributes:
+        action (BatchAction): 編集の種類。
+        tags (Tuple[str, ...]): 追加する、もしくは外すタグ名。 `"add_tags"`, `"remove_tags"`以外は空です。
+        restrict (Restrict | None): 変更後のプライバシー設定。 `"edit_restrict"`以外は`None`です。
+        illust_ids (List[int]): 編集するブックマークの、イラストのID。
+    """
+    action: BatchAction
+    tags: Tuple[str, ...]
+    restrict: Restrict | None
+    illust_ids: List[int]
+
+
+class BatchPlanner():
+    """計画したブックマークの編集を、同じ内容の編集ごとにまとめるクラス。
+
+    編集前と編集後の状態の差分から、追加するタグ、外すタグ、プライバシー設定の変更を求めます。
+    タグは、pixivの正規化(`bookmark_classify.normalize_tag_name`)を考慮して比べます。
+
+    イラストのタグの組み合わせはほとんど重ならないため、タグの組み合わせごとにまとめても、リクエストはあまり減りません。
+    そのため、複数のブックマークに追加する(外す)タグは、タグごとに1つのリクエストにまとめます。
+    同じブックマークの組に追加するタグ(シリーズ名と作品名など)は、1つのリクエストにまとめます。
+
+    1回のリクエストでは全てのブックマークに同じタグを追加するため、そのブックマークにしか追加しないタグは、
+    他のブックマークとまとめられず、ブックマークごとに1つのリクエストが必ず必要になります。
+    タグごとに分けてもリクエストが増えるだけのため、そのようなブックマークは、共通するタグも含めて1つのリクエストで送り、
+    共通するタグのリクエストは、残りのブックマークだけに送ります。
+    リクエストの数は、そのブックマークにしか付かないタグを持つブックマークの数と、残りのブックマークの組の数の合計になります。
+
+    Attributes:
+        targets (Dict[int, BookmarkState | None]): 編集後のブックマークの状態。 解除する場合は`None`です。
+    """
+
+    def __init__(self) -> None:
+        self.targets: Dict[int, BookmarkState | None] = {}
+        self._removed: List[int] = []
+        self._tags: Dict[BatchAction, Dict[int, Tuple[str, ...]]] = {
+            "remove_tags": {}, "add_tags": {}}
+        self._restricts: Dict[Restrict, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def remove(self, illust_id: int) -> None:
+        """ブックマークを解除します。
+
+        Args:
+            illust_id (int): イラストのID。
+        """
+        self.targets[illust_id] = None
+        self._removed.append(illust_id)
+
+    def edit(
+        self,
+        illust_id: int,
+        before_state: BookmarkState,
+        tags: List[str],
+        restrict: Restrict
+    ) -> bool:
+        """ブックマークのタグとプライバシー設定を、`tags`と`restrict`に書き換えます。
+
+        Args:
+            illust_id (int): イラストのID。
+            before_state (BookmarkState): 編集前のブックマークの状態。
+            tags (List[str]): 編集後のブックマークのタグ名のリスト。
+            restrict (Restrict): 編集後のブックマークのプライバシー設定。
+
+        Returns:
+            bool: 書き換える必要がある場合は`True`。 既に`tags`と`restrict`の状態の場合は`False`です。
+        """
+        before = {normalize_tag_name(tag) for tag in before_state.tags}
+        after_tags = split_bookmark_tags(tags)
+        after = {normalize_tag_name(tag) for tag in after_tags}
+
+        # 正規化すると同じになるタグは、1つだけ追加する
+        add_tags = tuple(sorted({normalize_tag_name(tag): tag for tag in after_tags
+                                 if normalize_tag_name(tag) not in before}.values()))
+        remove_tags = tuple(sorted(
+            {tag for tag in before_state.tags if normalize_tag_name(tag) not in after}))
+        if not add_tags and not remove_tags and (restrict == before_state.restrict):
+            return False
+
+        if remove_tags:
+            self._tags["remove_tags"][illust_id] = remove_tags
+        if add_tags:
+            self._tags["add_tags"][illust_id] = add_tags
+        if restrict != before_state.restrict:
+            self._restricts.setdefault(restrict, []).append(illust_id)
+
+        kept_tags = [tag for tag in before_state.tags if normalize_tag_name(tag) in after]
+        self.targets[illust_id] = BookmarkState(kept_tags + list(add_tags), restrict, time.time())
+        return True
+
+    @staticmethod
+    def _group_tags(
+        tag_sets: Dict[int, Tuple[str, ...]]
+    ) -> Dict[Tuple[str, ...], List[int]]:
+        """複数のブックマークに共通するタグはブックマークの組ごとに、残りのタグはブックマークごとにまとめます。"""
+        counts = Counter(tag for tags in tag_sets.values() for tag in tags)
+        # そのブックマークにしか付かないタグがあるブックマークは、共通するタグも同じリクエストで送る
+        solos: Dict[int, List[str]] = {}
+        for illust_id, tags in tag_sets.items():
+            if any(counts[tag] == 1 for tag in tags):
+                solos[illust_id] = list(tags)
+
+        shared: Dict[str, List[int]] = {}
+        for illust_id, tags in tag_sets.items():
+            if illust_id not in solos:
+                for tag in tags:
+                    shared.setdefault(tag, []).append(illust_id)
+
+        # 同じブックマークの組に追加するタグは、1つのリクエストにまとめる
+        tags_by_ids: Dict[Tuple[int, ...], List[str]] = {}
+        for tag, illust_ids in shared.items():
+            tags_by_ids.setdefault(tuple(illust_ids), []).append(tag)
+        groups = {tuple(tags): list(illust_ids) for illust_ids, tags in tags_by_ids.items()}
+        for illust_id, tags in solos.items():
+            groups.setdefault(tuple(tags), []).append(illust_id)
+        return groups
+
+    def batches(self, batch_size: int = BATCH_SIZE) -> List[BatchEdit]:
+        """まとめた編集を、送る順番に並べて返します。
+
+        Args:
+            batch_size (int, optional): 1回のリクエストで書き換えるブックマークの数の上限。
+            デフォルトは`BATCH_SIZE`です。
+
+        Returns:
+            List[BatchEdit]: まとめた編集のリスト。
+        """
+        groups: List[Tuple[BatchAction, Tuple[str, ...], Restrict | None, List[int]]] = []
+        for action in BATCH_ACTIONS:
+            match action:
+                case "remove":
+                    groups.append((action, (), None, self._removed))
+                case "remove_tags" | "add_tags":
+                    for tags, illust_ids in self._group_tags(self._tags[action]).items():
+                        groups.append((action, tags, None, illust_ids))
+                case "edit_restrict":
+                    for restrict, illust_ids in self._restricts.items():
+                        groups.append((action, (), restrict, illust_ids))
+
+        batch_size = max(batch_size, 1)
+        return [BatchEdit(action, tags, restrict, illust_ids[start:start + batch_size])
+                for action, tags, restrict, illust_ids in groups
+                for start in range(0, len(illust_ids), batch_size)]
+
+
+async def apply_plan_batched(
+    api: BookmarkBackend,
+    batch_backend: BatchBookmarkBackend,
+    user_id: int | str,
+    entries: Iterable[PlanEntry],
+    preferred_tags: PreferredTag = "bookmark",
+    on_success: Callable[[int, PlanEntry], Awaitable[None]] | None = None,
+    rate_limiter: RateLimiter | None = None,
+    bookmark_store: BookmarkStore | None = None,
+    journal: ProgressJournal | None = None,
+    retry_queue: RetryQueue | None = None,
+    metrics: RunMetrics | None = None,
+    tag_index: TagFrequencyIndex | None = None,
+    batch_size: int = BATCH_SIZE,
+    max_retries: int = 5,
+    backoff_seconds: float = 60
+) -> None:
+    """計画のうち、`"skip"`以外のものを、同じ内容の編集ごとにまとめて書き込みます。
+
+    最初に`batch_backend`で公開/非公開のブックマークの一覧を取得し、ブックマークのIDと現在のプライバシー設定を調べます。
+    編集前のタグは、`bookmark_store`に保存されている状態、`"未分類"`の一覧に含まれるか、の順に調べ、
+    どちらでも分からないブックマークだけを`api.illust_bookmark_detail`で取得します。
+    そのため、リクエスト数は、一覧のページ数、編集前の状態を取得したブックマークの数、まとめた編集の数の合計になります。
+
+    まとめた書き込みの成否はレスポンスで分かるため、ブックマークごとの確認は行いません。
+    書き込みが拒否された場合は、拒否されたブックマークを見つけるまで半分ずつに分けて送り直し、
+    見つけたブックマークは`retry_queue.rejections`に記録します。
+    拒否されたブックマークに既に送ったタグの編集は取り消し、編集前のタグに戻します。
+    レート制限や通信のエラーの場合は、`get_bookmarks.iter_bookmarks_pages`と同じように待ってからやり直します。
+
+    Args:
+        api (BookmarkBackend): 編集前の状態を取得するバックエンド。 AppPixivAPIのインスタンスなどです。
+        batch_backend (BatchBookmarkBackend): まとめて書き込むバックエンド。
+        user_id (int | str): ブックマークを編集するユーザーのID。
+        entries (Iterable[PlanEntry]): 実行する計画。
+        batch_size (int, optional): 1回のリクエストで書き換えるブックマークの数の上限。
+        デフォルトは`BATCH_SIZE`です。
+        max_retries (int, optional): 1つのリクエストをやり直す回数の上限。 デフォルトは`5`です。
+        backoff_seconds (float, optional): 最初にやり直すまでに待つ時間。 秒単位で指定してください。
+        デフォルトは`60`です。
+        それ以外の引数については、`plan.apply_plan`を参照してください。
+    """
+    if metrics is not None:
+        api = metrics.wrap(api)
+        batch_backend = metrics.wrap(batch_backend)
+    if rate_limiter is not None:
+        api = rate_limiter.wrap(api)
+        batch_backend = rate_limiter.wrap(batch_backend)
+
+    async def _call(function: Callable[..., Awaitable[Any]], *args) -> Any:
+        """レート制限や通信のエラーの場合に、待ってからやり直す関数。"""
+        for attempt in range(max_retries + 1):
+            try:
+                result = await function(*args)
+            except RateLimited as e:
+                if max_retries <= attempt:
+                    raise
+                if metrics is not None:
+                    metrics.on_ratelimited(e)
+                if rate_limiter is not None:
+                    # レートリミッターが止めている間は、次のリクエストの許可を待つ
+                    rate_limiter.on_ratelimited()
+                    continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if max_retries <= attempt:
+                    raise
+            else:
+                if rate_limiter is not None:
+                    rate_limiter.on_success()
+                return result
+
+            wait_seconds = backoff_seconds * 2 ** attempt
+            await asyncio.sleep(wait_seconds)
+            if metrics is not None:
+                metrics.on_sleep(wait_seconds)
+
+    async def _read_state(illust_id):
+        json_result = await api.illust_bookmark_detail(illust_id)
+        bookmark_detail = json_result.bookmark_detail
+        if bookmark_detail is None:
+            raise BookmarkDetailRateLimited(illust_id)
+        if bookmark_store is not None:
+            bookmark_store.put_detail(illust_id, bookmark_detail)
+        return BookmarkState(
+            get_bookmark_tag_names(bookmark_detail.tags), bookmark_detail.restrict, time.time())
+
+    async def _done(index, entry, outcome):
+        if journal is not None:
+            journal.record(entry.id, outcome, entry.fingerprint)
+        if metrics is not None:
+            metrics.on_success()
+        if on_success is not None:
+            await on_success(index, entry)
+
+    pending = []
+    for index, entry in enumerate(entries):
+        if entry.action == "skip":
+            continue
+        if (journal is not None) and journal.is_done(entry.id, entry.fingerprint):
+            if metrics is not None:
+                metrics.on_skipped()
+            continue
+        pending.append((index, entry))
+    if not pending:
+        return
+
+    async def _list_bookmark_ids(restrict, tag=None):
+        bookmark_ids = {}
+        offset = 0
+        while offset is not None:
+            page = await _call(batch_backend.list_bookmark_ids, user_id, restrict, tag, offset)
+            bookmark_ids.update(page.bookmark_ids)
+            offset = page.next_offset
+        return bookmark_ids
+
+    # ブックマークのIDと、現在のプライバシー設定
+    bookmark_ids: Dict[int, str] = {}
+    restricts: Dict[int, Restrict] = {}
+    for restrict in (RESTRICT_PUBLIC, RESTRICT_PRIVATE):
+        ids = await _list_bookmark_ids(restrict)
+        bookmark_ids.update(ids)
+        restricts.update(dict.fromkeys(ids, restrict))
+
+    states: Dict[int, BookmarkState] = {}
+    if bookmark_store is not None:
+        for _, entry in pending:
+            state = bookmark_store.get(entry.id)
+            if state is not None:
+                states[entry.id] = state
+    if any((entry.action != "delete") and (entry.id not in states) for _, entry in pending):
+        # 未分類の一覧に含まれるブックマークは、タグが付いていないことが分かる
+        fetched_at = time.time()
+        for restrict in (RESTRICT_PUBLIC, RESTRICT_PRIVATE):
+            for illust_id in await _list_bookmark_ids(restrict, UNCATEGORIZED_TAG):
+                states.setdefault(illust_id, BookmarkState([], restrict, fetched_at))
+
+    planner = BatchPlanner()
+    planned: Dict[int, Tuple[int, PlanEntry]] = {}
+    for index, entry in pending:
+        if entry.id not in bookmark_ids:
+            # 計画を立てた後に解除されたブックマークは、書き換えられない
+            await _done(index, entry, "delete" if entry.action == "delete" else "missing")
+            continue
+
+        if entry.action == "delete":
+            planner.remove(entry.id)
+            planned[entry.id] = (index, entry)
+            continue
+
+        state = states.get(entry.id)
+        if state is None:
+            state = await _call(_read_state, entry.id)
+        # 保存されている状態より後に変更されたプライバシー設定は、一覧の方を信頼する
+        state = state._replace(restrict=restricts[entry.id])
+
+        if entry.action == "add":
+            tags, restrict = entry.tags, entry.restrict
+        else:
+            tags = merge_bookmark_tags(state.tags, entry.tags, preferred_tags, tag_index)
+            if tag_index is not None:
+                tag_index.update(entry.id, entry.tags, state.tags if tags is None else tags)
+            restrict = RESTRICT_PRIVATE if entry.restrict == RESTRICT_PRIVATE else state.restrict
+            if tags is None:
+                # タグは揃っていても、プライバシー設定は書き換える必要がある場合がある
+                tags = list(state.tags)
+
+        if not planner.edit(entry.id, state, tags, restrict):
+            await _done(index, entry, entry.action)
+            continue
+        planned[entry.id] = (index, entry)
+
+    # まとめた編集のうち、まだ送っていないものの数
+    remaining = Counter()
+    batches = planner.batches(batch_size)
+    for batch in batches:
+        remaining.update(batch.illust_ids)
+    rejected: Set[int] = set()
+    # 送った編集のうち、ブックマークごとに追加した(外した)タグ
+    applied: Dict[int, Dict[BatchAction, List[str]]] = {}
+
+    async def _request(batch, illust_ids):
+        ids = [bookmark_ids[illust_id] for illust_id in illust_ids]
+        match batch.action:
+            case "remove":
+                await batch_backend.remove_bookmarks(ids)
+            case "remove_tags":
+                await batch_backend.remove_bookmark_tags(ids, list(batch.tags))
+            case "add_tags":
+                await batch_backend.add_bookmark_tags(ids, list(batch.tags))
+            case "edit_restrict":
+                await batch_backend.edit_bookmark_restrict(ids, batch.restrict)
+
+    async def _restore(illust_id):
+        """拒否されたブックマークに送ったタグの編集を取り消す関数。 タグの数の上限を超えないように、追加したタグを先に外す。"""
+        applied_tags = applied.pop(illust_id, {})
+        ids = [bookmark_ids[illust_id]]
+        try:
+            if applied_tags.get("add_tags"):
+                await _call(batch_backend.remove_bookmark_tags, ids, applied_tags["add_tags"])
+            if applied_tags.get("remove_tags"):
+                await _call(batch_backend.add_bookmark_tags, ids, applied_tags["remove_tags"])
+        except WebAPIError as e:
+            # 取り消しも拒否された場合は、拒否された記録から手で直してもらう
+            if e.status != 400:
+                raise
+
+    async def _send(batch, illust_ids):
+        """まとめた編集を送り、拒否された場合は半分ずつに分けて送り直す関数。"""
+        try:
+            await _call(_request, batch, illust_ids)
+        except WebAPIError as e:
+            # 認証のエラーなど、リクエストの内容によらないエラーは分けても変わらない
+            if e.status != 400:
+                raise
+            if 1 < len(illust_ids):
+                middle = len(illust_ids) // 2
+                await _send(batch, illust_ids[:middle])
+                await _send(batch, illust_ids[middle:])
+                return
+
+            illust_id = illust_ids[0]
+            rejected.add(illust_id)
+            index, entry = planned.pop(illust_id)
+            await _restore(illust_id)
+            if bookmark_store is not None:
+                bookmark_store.delete(illust_id)
+            if retry_queue is not None:
+                retry_queue.reject(entry, TagRejected(illust_id, list(batch.tags), e.message))
+            if journal is not None:
+                journal.record(illust_id, "rejected", entry.fingerprint)
+            if metrics is not None:
+                metrics.on_rejected()
+            return
+
+        for illust_id in illust_ids:
+            remaining[illust_id] -= 1
+            if batch.action in ("add_tags", "remove_tags"):
+                applied.setdefault(illust_id, {}).setdefault(batch.action, []).extend(batch.tags)
+            if 0 < remaining[illust_id]:
+                continue
+            applied.pop(illust_id, None)
+            index, entry = planned.pop(illust_id)
+            if bookmark_store is not None:
+                state = planner.targets[illust_id]
+                if state is None:
+                    bookmark_store.delete(illust_id)
+                else:
+                    bookmark_store.put(illust_id, state.tags, state.restrict)
+            await _done(index, entry, entry.action)
+
+    for batch in batches:
+        illust_ids = [illust_id for illust_id in batch.illust_ids if illust_id not in rejected]
+        if illust_ids:
+            await _send(batch, illust_ids)
+
+    if journal is not None:
+        journal.commit()
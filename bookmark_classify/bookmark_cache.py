@@ -0,0 +1,321 @@
+"""取得したブックマークの一覧を、ページ単位で追記できるSQLiteのキャッシュに保存するモジュール"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from .illust import Illust, IllustTag, ImageUrls, ListingContext, load_illusts
+from .utils import Restrict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class BookmarkCache():
+    """ブックマークしているイラストの一覧を、プライバシー設定ごとに取得した順番で保存するSQLiteのキャッシュ。
+
+    保存するのは`Illust`の項目(ID、タグ名、サムネイルのURL)だけです。
+    取得したページは`append`でそのまま追記でき、全てのページを取得したら`finish`で完了を記録します。
+    完了していない一覧は、途中で中断された取得として`is_complete`が`False`になります。
+    後から追加された新しいブックマークは、`prepend`で先頭に追加できます。
+
+    `append_page`で追記した場合は、次のページを取得するためのクエリも一緒に記録します。
+    取得が中断された場合は、`load_cursor`で読み込んだクエリから取得を再開できます。
+    記録したクエリは、ページの先頭の位置と一緒に残すため、`find_page_cursor`で任意のページを取得し直せます。
+
+    読み込みは`iter_illusts`で、任意の位置から`batch_size`件ずつ行うため、
+    一覧全体を読み込んでから処理を始める必要はなく、メモリ使用量も一覧の大きさに比例しません。
+
+    Args:
+        path (str | os.PathLike): データベースのパス。
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS illusts ("
+            "restrict TEXT NOT NULL, "
+            "position INTEGER NOT NULL, "
+            "illust_id INTEGER NOT NULL, "
+            "tags TEXT NOT NULL, "
+            "square_medium TEXT NOT NULL, "
+            "PRIMARY KEY (restrict, position))")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS illusts_illust_id ON illusts (restrict, illust_id)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fetches ("
+            "restrict TEXT PRIMARY KEY, "
+            "completed_at REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cursors ("
+            "restrict TEXT PRIMARY KEY, "
+            "next_qs TEXT NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS page_cursors ("
+            "restrict TEXT NOT NULL, "
+            "position INTEGER NOT NULL, "
+            "qs TEXT NOT NULL, "
+            "PRIMARY KEY (restrict, position))")
+        self._connection.commit()
+
+    def count(self, restrict: Restrict) -> int:
+        """保存されているイラストの数を返します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+
+        Returns:
+            int: イラストの数。
+        """
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM illusts WHERE restrict = ?", (restrict,)).fetchone()[0]
+
+    def contains(self, restrict: Restrict, illust_id: int) -> bool:
+        """イラストが保存されているかを返します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            illust_id (int): イラストのID。
+
+        Returns:
+            bool: 保存されているか。
+        """
+        return self.get_position(restrict, illust_id) is not None
+
+    def get_position(self, restrict: Restrict, illust_id: int) -> int | None:
+        """イラストが保存されている位置を返します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            illust_id (int): イラストのID。
+
+        Returns:
+            int | None: イラストの位置。 保存されていない場合は`None`です。
+        """
+        row = self._connection.execute(
+            "SELECT position FROM illusts WHERE restrict = ? AND illust_id = ?",
+            (restrict, illust_id)).fetchone()
+        return None if row is None else row[0]
+
+    def _bounds(self, restrict: Restrict) -> Tuple[int, int]:
+        """保存されている位置の最小値と最大値の組を返します。 保存されていない場合は`(0, -1)`です。"""
+        low, high = self._connection.execute(
+            "SELECT MIN(position), MAX(position) FROM illusts WHERE restrict = ?",
+            (restrict,)).fetchone()
+        if low is None:
+            return 0, -1
+        return low, high
+
+    def is_complete(self, restrict: Restrict) -> bool:
+        """全てのページの取得が完了した一覧が保存されているかを返します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+
+        Returns:
+            bool: 取得が完了しているか。
+        """
+        row = self._connection.execute(
+            "SELECT 1 FROM fetches WHERE restrict = ?", (restrict,)).fetchone()
+        return row is not None
+
+    def clear(self, restrict: Restrict) -> None:
+        """保存されている一覧を削除し、取得を始める前の状態にします。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+        """
+        self._connection.execute("DELETE FROM illusts WHERE restrict = ?", (restrict,))
+        self._connection.execute("DELETE FROM fetches WHERE restrict = ?", (restrict,))
+        self._connection.execute("DELETE FROM cursors WHERE restrict = ?", (restrict,))
+        self._connection.execute("DELETE FROM page_cursors WHERE restrict = ?", (restrict,))
+        self._connection.commit()
+
+    def append(self, restrict: Restrict, illusts: Iterable[Illust]) -> None:
+        """一覧の末尾にイラストを追記します。 取得したページごとに呼び出してください。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            illusts (Iterable[Illust]): 追記するイラストのイテラブル。
+        """
+        _, high = self._bounds(restrict)
+        self._insert(restrict, high + 1, illusts)
+        self._connection.commit()
+
+    def append_page(
+        self,
+        restrict: Restrict,
+        illusts: Iterable[Illust],
+        next_qs: Dict[str, Any] | None
+    ) -> None:
+        """取得した1ページを末尾に追記し、次のページを取得するためのクエリを記録します。
+        `next_qs`が`None`の場合は、最後のページとして取得の完了を記録します。
+        追記と記録は同時に行うため、途中で終了しても、追記したページと記録したクエリがずれることはありません。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            illusts (Iterable[Illust]): 追記するイラストのイテラブル。
+            next_qs (Dict[str, Any] | None): 次のページを取得するためのクエリ。
+        """
+        _, high = self._bounds(restrict)
+        illusts = list(illusts)
+        self._insert(restrict, high + 1, illusts)
+        if next_qs is None:
+            self._connection.execute("DELETE FROM cursors WHERE restrict = ?", (restrict,))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO fetches (restrict, completed_at) VALUES (?, ?)",
+                (restrict, time.time()))
+        else:
+            next_qs_json = json.dumps(next_qs, ensure_ascii=False)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cursors (restrict, next_qs) VALUES (?, ?)",
+                (restrict, next_qs_json))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO page_cursors (restrict, position, qs) VALUES (?, ?, ?)",
+                (restrict, high + 1 + len(illusts), next_qs_json))
+        self._connection.commit()
+
+    def load_cursor(self, restrict: Restrict) -> Dict[str, Any] | None:
+        """中断された取得の、次のページを取得するためのクエリを読み込みます。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+
+        Returns:
+            Dict[str, Any] | None: 次のページを取得するためのクエリ。 中断された取得がない場合は`None`です。
+        """
+        row = self._connection.execute(
+            "SELECT next_qs FROM cursors WHERE restrict = ?", (restrict,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def find_page_cursor(
+        self,
+        restrict: Restrict,
+        position: int
+    ) -> Tuple[int, Dict[str, Any] | None]:
+        """`position`のイラストを含むページを取得し直すための、ページの先頭の位置とクエリを返します。
+
+        一覧のクエリは、ブックマークのIDで次のページの先頭を指定するため、
+        取得した後にブックマークが解除されても、同じクエリのページは同じ位置から始まります。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            position (int): イラストの位置。
+
+        Returns:
+            Tuple[int, Dict[str, Any] | None]: ページの先頭の位置とクエリの組。
+            `position`より前にクエリが記録されていない場合は、一覧の先頭の位置と`None`です。
+        """
+        row = self._connection.execute(
+            "SELECT position, qs FROM page_cursors WHERE restrict = ? AND position <= ? "
+            "ORDER BY position DESC LIMIT 1", (restrict, position)).fetchone()
+        if row is None:
+            return self._bounds(restrict)[0], None
+        return row[0], json.loads(row[1])
+
+    def prepend(self, restrict: Restrict, illusts: List[Illust]) -> None:
+        """一覧の先頭にイラストを追加します。 既存のイラストの位置は変わりません。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            illusts (List[Illust]): 追加するイラストのリスト。 取得した順番(新しいブックマークから)で渡してください。
+        """
+        low, _ = self._bounds(restrict)
+        # 先頭の位置は負の数になることもある
+        self._insert(restrict, low - len(illusts), illusts)
+        self._connection.commit()
+
+    def _insert(self, restrict: Restrict, start: int, illusts: Iterable[Illust]) -> None:
+        """イラストを`start`の位置から挿入します。 コミットは呼び出し側で行います。"""
+        self._connection.executemany(
+            "INSERT INTO illusts (restrict, position, illust_id, tags, square_medium) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((restrict, start + i, illust.id,
+              json.dumps([tag.name for tag in illust.tags], ensure_ascii=False),
+              illust.image_urls.square_medium)
+             for i, illust in enumerate(illusts)))
+
+    def finish(self, restrict: Restrict) -> None:
+        """全てのページの取得が完了したことを記録します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+        """
+        self._connection.execute("DELETE FROM cursors WHERE restrict = ?", (restrict,))
+        self._connection.execute(
+            "INSERT OR REPLACE INTO fetches (restrict, completed_at) VALUES (?, ?)",
+            (restrict, time.time()))
+        self._connection.commit()
+
+    def iter_illusts(
+        self,
+        restrict: Restrict,
+        start: int = 0,
+        reverse: bool = False,
+        batch_size: int = 1000,
+        listing: ListingContext | None = None
+    ) -> Iterator[Illust]:
+        """保存されているイラストを、`batch_size`件ずつ読み込みながら返します。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            start (int, optional): 読み込みを始める位置。 返す順番で数えた、先頭からの件数です。 デフォルトは`0`です。
+            reverse (bool, optional): 取得した順番と逆に(古いブックマークから)返すか。 デフォルトは`False`です。
+            batch_size (int, optional): 1回に読み込む件数。 デフォルトは`1000`です。
+            listing (ListingContext | None, optional): 返すイラストに持たせる、取得した一覧の条件。
+            保存されている全てのイラストを、その条件で取得した直後の場合に指定してください。 デフォルトは`None`です。
+
+        Yields:
+            Illust: イラストのレコード。
+        """
+        if reverse:
+            query = ("SELECT position, illust_id, tags, square_medium FROM illusts "
+                     "WHERE restrict = ? AND position < ? ORDER BY position DESC LIMIT ?")
+            position = self._bounds(restrict)[1] + 1 - start
+        else:
+            query = ("SELECT position, illust_id, tags, square_medium FROM illusts "
+                     "WHERE restrict = ? AND position >= ? ORDER BY position LIMIT ?")
+            position = self._bounds(restrict)[0] + start
+
+        loads = json.loads if orjson is None else orjson.loads
+        while True:
+            # 読み込んだ分だけを取り出し、返している間はカーソルを開いたままにしない
+            rows = self._connection.execute(query, (restrict, position, batch_size)).fetchall()
+            for _, illust_id, tags, square_medium in rows:
+                yield Illust(
+                    illust_id,
+                    tuple(IllustTag.of(name) for name in loads(tags)),
+                    ImageUrls.of(square_medium),
+                    listing)
+            if len(rows) < batch_size:
+                break
+            position = rows[-1][0] if reverse else rows[-1][0] + 1
+
+    def import_json(self, restrict: Restrict, path: str | os.PathLike) -> int:
+        """以前の形式のJSONのキャッシュを読み込み、保存されている一覧と置き換えます。
+
+        Args:
+            restrict (Restrict): ブックマークのプライバシー設定。
+            path (str | os.PathLike): JSONのキャッシュのパス。
+
+        Returns:
+            int: 読み込んだイラストの数。
+        """
+        illusts = load_illusts(path)
+        self.clear(restrict)
+        self.append(restrict, illusts)
+        self.finish(restrict)
+        return len(illusts)
+
+    def close(self) -> None:
+        """データベースとの接続を閉じます。"""
+        self._connection.close()
@@ -1,158 +1,331 @@
 """ブックマークを整理するモジュール"""
 
 import asyncio
-from typing import Awaitable, Callable, List
-
-from pixivpy_async import AppPixivAPI
-
+import hashlib
+import json
+import unicodedata
+from typing import (Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Mapping,
+                    Set, Tuple)
+
+from .backend import BookmarkBackend
+from .bookmark_store import BookmarkState, BookmarkStore
 from .consts import RESTRICT_PRIVATE
-from .exceptions import (BookmarkAddRateLimited, BookmarkDeleteRateLimited,
-                         BookmarkDetailRateLimited, RateLimited)
+from .exceptions import (BookmarkAddFailed, BookmarkAddRateLimited, BookmarkDeleteRateLimited,
+                         BookmarkDetailRateLimited, CoolingDown, RateLimited, RequestTimedOut,
+                         TagRejected)
 from .get_bookmarks import is_limit_unknown
-from .utils import BookmarkDetail, BookmarkTag, Illust, IllustTag, PreferredTag
+from .illust import Illust, IllustTag
+from .journal import ProgressJournal
+from .metrics import RunMetrics
+from .rate_limiter import RateLimiter
+from .retry_queue import DeadLetter, RetryQueue
+from .tag_frequency import TagFrequencyIndex
+from .tag_rules import TagRules
+from .utils import BookmarkDetail, BookmarkTag, PreferredTag, Restrict, aiterate
+from .verification import PendingWrite, VerificationPolicy
 from .consts import LIMITS
 
 TAGS_LIMIT = 10
+# レート制限の場合に、APIがエラーのメッセージとして返す文字列
+RATELIMIT_MESSAGES = ("rate limit",)
+# タグの検証で書き込みを拒否した場合に、APIがエラーのメッセージとして返す文字列
+# 「タグの更新に失敗しました」のような一時的なエラーも拒否として扱わないように、検証のエラーに限って一致させる
+TAG_REJECTION_MESSAGES = (
+    "invalid tag",
+    "too many tags",
+    "tag is too long",
+    "タグに使用できない文字",
+    "タグの数が多すぎ",
+    "タグが長すぎ",
+)
 
 
-async def bookmark_classify_on_ratelimited(
-    index: int,
-    illust: Illust,
-    exception: RateLimited
-) -> None:
-    print("レート制限が発生したため、10分間sleepします...")
-    await asyncio.sleep(600)
-    return
+def get_tag_names(tags: List[IllustTag]) -> List[str]:
+    """`illust_detail.tags`を、タグ名のListに変換します。
 
+    Args:
+        tags (List[IllustTag]): IllustTagのリスト。
 
-def in_partial_match(tag: str, tags: List[str]) -> bool:
-    """`tag`と部分的に一致するアイテムが`tags`に含まれているかを調べます。
+    Returns:
+        List[str]: タグ名のリスト。
+    """
+    return list(map(lambda tag: tag.name, tags))
+
+
+def get_bookmark_tag_names(tags: List[BookmarkTag]) -> List[str]:
+    """`bookmark_detail.tags`を、ブックマークのタグだけに絞り込み、タグ名のListに変換します。
 
     Args:
-        tag (str): 評価するタグ。
-        tags (List[str]): タグのリスト。
+        tags (List[BookmarkTag]): BookmarkTagのリスト。
 
     Returns:
-        bool: `tag`と部分的に一致するアイテムが`tags`に含まれているか。
+        List[str]: タグ名のリスト。
     """
-    return len([t for t in tags if t in tag]) > 0
+    bookmark_tags = [tag for tag in tags if tag.is_registered]
+    return get_tag_names(bookmark_tags)
 
 
-def in_exact_match(tag: str, tags: List[str]) -> bool:
-    """`tag`と完全に一致するアイテムが`tags`に含まれているかを調べます。
+def normalize_tag_name(tag: str) -> str:
+    """pixivがタグを保存する際の正規化に合わせて、タグ名を比較用の文字列に変換します。
+    全角/半角などの互換文字(NFKC)、大文字/小文字、前後の空白の違いを無視します。
 
     Args:
-        tag (str): 評価するタグ。
-        tags (List[str]): タグのリスト。
+        tag (str): タグ名。
 
     Returns:
-        bool: `tag`と完全に一致するアイテムが`tags`に含まれているか。
+        str: 比較用のタグ名。
     """
-    return len([t for t in tags if t == tag]) > 0
+    return unicodedata.normalize("NFKC", tag).strip().casefold()
 
 
-def get_tag_names(tags: List[IllustTag]) -> List[str]:
-    """`illust_detail.tags`を、タグ名のListに変換します。
+def split_bookmark_tags(tags: Iterable[str]) -> List[str]:
+    """書き込むタグ名のリストを、pixivが保存するタグ名のリストに変換します。
+    タグは空白で区切って送るため、空白を含むタグは複数のタグとして保存されます。
 
     Args:
-        tags (List[IllustTag]): IllustTagのリスト。
+        tags (Iterable[str]): 書き込むタグ名のイテラブル。
 
     Returns:
-        List[str]: タグ名のリスト。
+        List[str]: 保存されるタグ名のリスト。
     """
-    return list(map(lambda tag: tag.name, tags))
+    return [name for tag in tags for name in unicodedata.normalize("NFKC", tag).split()]
 
 
-def get_bookmark_tag_names(tags: List[BookmarkTag]) -> List[str]:
-    """`bookmark_detail.tags`を、ブックマークのタグだけに絞り込み、タグ名のListに変換します。
+def get_missing_tags(tags: Iterable[str], bookmark_tags: Iterable[str]) -> List[str]:
+    """書き込んだタグのうち、正規化しても`bookmark_tags`に見つからないタグ名を返します。
 
     Args:
-        tags (List[BookmarkTag]): BookmarkTagのリスト。
+        tags (Iterable[str]): 書き込んだタグ名のイテラブル。
+        bookmark_tags (Iterable[str]): 保存されているブックマークのタグ名のイテラブル。
 
     Returns:
-        List[str]: タグ名のリスト。
+        List[str]: 保存されていないタグ名のリスト。
     """
-    bookmark_tags = [tag for tag in tags if tag.is_registered]
-    return get_tag_names(bookmark_tags)
+    saved = {normalize_tag_name(tag) for tag in bookmark_tags}
+    return [tag for tag in split_bookmark_tags(tags) if normalize_tag_name(tag) not in saved]
+
+
+def is_same_bookmark_tags(tags: Iterable[str], bookmark_tags: Iterable[str]) -> bool:
+    """書き込んだタグと保存されているブックマークのタグが、pixivの正規化の範囲で一致するかを調べます。
+
+    Args:
+        tags (Iterable[str]): 書き込んだタグ名のイテラブル。
+        bookmark_tags (Iterable[str]): 保存されているブックマークのタグ名のイテラブル。
+
+    Returns:
+        bool: 一致するか。
+    """
+    return ({normalize_tag_name(tag) for tag in split_bookmark_tags(tags)}
+            == {normalize_tag_name(tag) for tag in bookmark_tags})
+
+
+def get_api_error(json_result: Mapping[str, Any]) -> Mapping[str, Any] | None:
+    """APIのレスポンスから、エラーの内容を取り出します。
+    pixivpy_asyncはHTTPのステータスを返さないため、レスポンスの本文の`error`で判別します。
+
+    Args:
+        json_result (Mapping[str, Any]): APIのレスポンス。
+
+    Returns:
+        Mapping[str, Any] | None: エラーの内容。 エラーではない場合は`None`です。
+    """
+    if not isinstance(json_result, Mapping):
+        return None
+    return json_result.get("error") or None
+
+
+def get_error_message(error: Mapping[str, Any]) -> str:
+    """エラーの内容から、メッセージを取り出します。
+
+    Args:
+        error (Mapping[str, Any]): `get_api_error`で取り出したエラーの内容。
+
+    Returns:
+        str: エラーのメッセージ。
+    """
+    messages = [error.get(key) for key in ("message", "user_message", "reason")]
+    return " ".join(str(message) for message in messages if message) or str(dict(error))
+
+
+def is_ratelimit_error(error: Mapping[str, Any]) -> bool:
+    """エラーの内容が、レート制限によるものかを調べます。
+
+    Args:
+        error (Mapping[str, Any]): `get_api_error`で取り出したエラーの内容。
+
+    Returns:
+        bool: レート制限によるものか。
+    """
+    message = get_error_message(error).casefold()
+    return any(text in message for text in RATELIMIT_MESSAGES)
+
+
+def is_tag_rejection_error(error: Mapping[str, Any]) -> bool:
+    """エラーの内容が、タグの検証で書き込みを拒否されたことによるものかを調べます。
+    メッセージが既知の検証のエラー(`TAG_REJECTION_MESSAGES`)に一致しない場合は、タグに触れていても拒否とはみなしません。
+
+    Args:
+        error (Mapping[str, Any]): `get_api_error`で取り出したエラーの内容。
+
+    Returns:
+        bool: タグの検証によるものか。
+    """
+    message = get_error_message(error).casefold()
+    return any(text in message for text in TAG_REJECTION_MESSAGES)
 
 
 async def bookmark_delete(
-    api: AppPixivAPI,
-    illust_id: int
+    api: BookmarkBackend,
+    illust_id: int,
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None
 ) -> BookmarkDetail:
     """指定したイラストをブックマークから削除します。
 
     Args:
-        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
         illust_id (int): イラストのID。
+        bookmark_store (BookmarkStore | None, optional): ブックマークの状態を保存するストア。
+        削除に成功した場合、保存されている状態を削除します。 デフォルトは`None`です。
+        verification (VerificationPolicy | None, optional): 削除後の確認を行うかを決めるポリシー。
+        確認しない場合、削除は`verification.pending`に記録されます。 デフォルトは`None`(常に確認する)です。
 
     Raises:
+        BookmarkDetailRateLimited: ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。
         BookmarkDeleteRateLimited: ブックマークを削除するAPIで、レート制限が発生した場合に発生する例外。
 
     Returns:
-        BookmarkDetail: 削除後のブックマークの詳細情報。
+        BookmarkDetail: 削除後のブックマークの詳細情報。 確認しなかった場合は`None`です。
     """
+    checkpoint = verification.checkpoint() if verification is not None else None
     await api.illust_bookmark_delete(illust_id)
 
+    if bookmark_store is not None:
+        bookmark_store.delete(illust_id)
+
+    if (verification is not None) and not verification.should_verify():
+        verification.defer(PendingWrite(illust_id, None, None, checkpoint))
+        return
+
     json_result = await api.illust_bookmark_detail(illust_id)
     bookmark_detail = json_result.bookmark_detail
+    if bookmark_detail is None:
+        raise BookmarkDetailRateLimited(illust_id)
 
     if bookmark_detail.is_bookmarked:
         raise BookmarkDeleteRateLimited(illust_id)
 
+    if verification is not None:
+        verification.on_verified(checkpoint)
+
     return bookmark_detail
 
 
-async def bookmark_edit_if_needed(
-    api: AppPixivAPI,
+def should_delete_bookmark(
     illust: Illust,
-    exclude_tags: List[str] | None = None,
-    private_tags: List[str] | None = None,
-    preferred_tags: PreferredTag = "bookmark",
-) -> BookmarkDetail:
-    """ブックマークのタグ、プライバシーを編集します。
+    tag_rules: TagRules | None = None,
+    delete_if_unknown: bool = False
+) -> bool:
+    """イラストのブックマークを解除するべきかを調べます。
 
     Args:
-        api (AppPixivAPI): AppPixivAPIのインスタンス。
-        illust (Illust): ブックマークに追加するイラスト。
-        exclude_tags (List[str] | None, optional): 除外対象のタグのリスト。 指定したタグは、ブックマークのタグに追加されません。
-        部分一致で評価されます。 デフォルトは`None`です。
-        private_tags (List[str] | None, optional): 非公開対象のタグのリスト。
-        指定したタグがイラストに付いている場合、ブックマークが非公開になります。 完全一致で評価されます。 デフォルトは`None`です。
-        preferred_tags (PreferredTag, optional): イラストのタグとブックマークのタグを結合する際、どちらを優先して残すか。
-        優先しないタグは、切り捨てられる可能性があります。 デフォルトは`bookmark`です。
-
-    Raises:
-        BookmarkDetailRateLimited: ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。
-        BookmarkAddRateLimited: ブックマークを追加するAPIで、レート制限が発生した場合に発生する例外。
+        illust (Illust): 評価するイラスト。
+        tag_rules (TagRules | None, optional): タグの評価ルール。 デフォルトは`None`です。
+        delete_if_unknown (bool, optional): 非公開もしくは削除済みのイラストのブックマークを解除するか。
+        デフォルトは`False`です。
 
     Returns:
-        BookmarkDetail: 編集後のブックマークの詳細情報。
+        bool: 非公開/削除済みか、削除対象のタグが付いている場合は`True`。
     """
+    if delete_if_unknown and is_limit_unknown(illust):
+        return True
+    return (tag_rules is not None) and tag_rules.is_delete_target(get_tag_names(illust.tags))
 
-    # 閲覧制限がかかっている場合はスキップ
-    if illust.image_urls.square_medium in LIMITS:
-        return
 
-    json_result = await api.illust_bookmark_detail(illust.id)
-    before_bookmark_detail = json_result.bookmark_detail
+def decision_fingerprint(
+    illust: Illust,
+    tag_rules: TagRules | None = None,
+    preferred_tags: PreferredTag = "bookmark",
+    delete_if_unknown: bool = False
+) -> str:
+    """イラストに対する処理の判定(解除する/スキップする/どのタグを結合し、非公開にするか)の指紋を計算します。
+    ネットワークは使いません。
 
-    if before_bookmark_detail is None:
-        raise BookmarkDetailRateLimited(illust.id)
+    判定はイラストのタグ、閲覧制限の状態、設定から決まるため、設定を変更しても指紋が変わらないイラストは、
+    処理し直しても結果が変わりません。
 
-    raw_illust_tags = get_tag_names(illust.tags)
+    Args:
+        illust (Illust): 判定するイラスト。
+        tag_rules, preferred_tags, delete_if_unknownについては、`bookmarks_classify`を参照してください。
 
-    if exclude_tags:
-        illust_tags = [tag for tag in raw_illust_tags if not in_partial_match(tag, exclude_tags)]
+    Returns:
+        str: 判定の指紋。
+    """
+    if should_delete_bookmark(illust, tag_rules, delete_if_unknown):
+        decision = ["delete"]
+    elif illust.image_urls.square_medium in LIMITS:
+        decision = ["skip"]
     else:
-        illust_tags = raw_illust_tags
+        raw_illust_tags = get_tag_names(illust.tags)
+        if tag_rules is not None:
+            illust_tags = tag_rules.filter_excluded(raw_illust_tags)
+            private = tag_rules.is_private(raw_illust_tags)
+        else:
+            illust_tags = raw_illust_tags
+            private = False
+        decision = ["merge", sorted(illust_tags), private, preferred_tags]
+
+    encoded = json.dumps(decision, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
 
-    before_bookmark_tags = get_bookmark_tag_names(before_bookmark_detail.tags)
 
+def index_bookmark_tags(
+    tag_index: TagFrequencyIndex,
+    illusts: Iterable[Illust],
+    tag_rules: TagRules | None = None,
+    delete_if_unknown: bool = False
+) -> None:
+    """`illusts`を1回走査し、各ブックマークに付く予定のタグを`tag_index`に数えます。
+    解除されるイラストと、閲覧制限がかかっているイラストは数えません。
+
+    Args:
+        tag_index (TagFrequencyIndex): 数えるインデックス。
+        illusts (Iterable[Illust]): ブックマークしているイラストのイテラブル。
+        tag_rules, delete_if_unknownについては、`bookmarks_classify`を参照してください。
+    """
+    for illust in illusts:
+        if should_delete_bookmark(illust, tag_rules, delete_if_unknown):
+            continue
+        if illust.image_urls.square_medium in LIMITS:
+            continue
+        illust_tags = get_tag_names(illust.tags)
+        if tag_rules is not None:
+            illust_tags = tag_rules.filter_excluded(illust_tags)
+        tag_index.add(illust_tags)
+
+
+def merge_bookmark_tags(
+    before_bookmark_tags: List[str],
+    illust_tags: List[str],
+    preferred_tags: PreferredTag = "bookmark",
+    tag_index: TagFrequencyIndex | None = None
+) -> List[str] | None:
+    """ブックマークのタグとイラストのタグを結合し、ブックマークに付けるタグを決めます。
+
+    Args:
+        before_bookmark_tags (List[str]): 編集前のブックマークのタグ名のリスト。
+        illust_tags (List[str]): 除外対象を取り除いた、イラストのタグ名のリスト。
+        preferred_tags (PreferredTag, optional): どちらのタグを優先して残すか。 デフォルトは`bookmark`です。
+        tag_index (TagFrequencyIndex | None, optional): `preferred_tags`が`"frequency"`の場合に使う、
+        タグの出現数のインデックス。 `None`の場合は`"bookmark"`と同じです。 デフォルトは`None`です。
+
+    Returns:
+        List[str] | None: ブックマークに付けるタグ名のリスト。 編集する必要がない場合は`None`です。
+    """
     if 0 < len(before_bookmark_tags):
         # ブックマークのタグが、追加するタグをすべて含んでいる場合は終了
         if set(before_bookmark_tags).issuperset(set(illust_tags)):
-            return
+            return None
 
         tags = list(set(before_bookmark_tags).union(set(illust_tags)))
 
@@ -160,6 +333,10 @@ async def bookmark_edit_if_needed(
             match preferred_tags:
                 case "illust":
                     add_tags = illust_tags + before_bookmark_tags[:TAGS_LIMIT - len(illust_tags)]
+                case "frequency" if tag_index is not None:
+                    # 同じ数のタグは、ブックマークのタグを優先する
+                    candidates = list(dict.fromkeys(before_bookmark_tags + illust_tags))
+                    add_tags = tag_index.rank(candidates, TAGS_LIMIT)
                 case _:
                     add_tags = before_bookmark_tags + \
                         illust_tags[:TAGS_LIMIT - len(before_bookmark_tags)]
@@ -169,64 +346,585 @@ async def bookmark_edit_if_needed(
         add_tags = illust_tags
 
     # タグの文字数を20文字以内にする -> 重複を消す
-    add_tags = list(set(map(lambda tag: tag[:20], add_tags)))
+    return list(set(map(lambda tag: tag[:20], add_tags)))
 
-    # プライバシー
-    if (private_tags) and \
-       (len([tag for tag in raw_illust_tags if in_exact_match(tag, private_tags)]) > 0):
-        restrict = RESTRICT_PRIVATE
-    else:
-        restrict = before_bookmark_detail.restrict
 
-    await api.illust_bookmark_add(
-        illust.id,
+async def bookmark_add(
+    api: BookmarkBackend,
+    illust_id: int,
+    add_tags: List[str],
+    restrict: Restrict,
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    before_tags: List[str] | None = None
+) -> BookmarkDetail:
+    """ブックマークのタグ、プライバシーを書き込み、反映されたかを確認します。
+
+    書き込んだタグと反映されたタグは、pixivの正規化(空白での区切り、全角/半角、大文字/小文字)を考慮して比べます。
+    一致しない場合、タグが`before_tags`から変わっていなければ、書き込みが無視されたレート制限として扱います。
+    変わっている場合は、書き込みは反映されたものの一部のタグが保存されなかったとして扱います。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        illust_id (int): イラストのID。
+        add_tags (List[str]): ブックマークに付けるタグ名のリスト。
+        restrict (Restrict): ブックマークのプライバシー設定。
+        bookmark_store, verificationについては、`bookmark_edit_if_needed`を参照してください。
+        before_tags (List[str] | None, optional): 書き込む前のブックマークのタグ名のリスト。
+        `None`の場合、タグが一致しなければ常にレート制限として扱います。 デフォルトは`None`です。
+
+    Raises:
+        BookmarkDetailRateLimited: ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。
+        BookmarkAddRateLimited: ブックマークを追加するAPIで、レート制限が発生した場合に発生する例外。
+        BookmarkAddFailed: ブックマークを追加するAPIが、それ以外のやり直せるエラーを返した場合に発生する例外。
+        TagRejected: 書き込みがタグの検証で拒否された場合や、一部のタグが保存されなかった場合に発生する例外。
+
+    Returns:
+        BookmarkDetail: 編集後のブックマークの詳細情報。 確認しなかった場合は`None`です。
+    """
+    checkpoint = verification.checkpoint() if verification is not None else None
+    json_result = await api.illust_bookmark_add(
+        illust_id,
         restrict=restrict,
         tags=[" ".join(add_tags)]
     )
+    error = get_api_error(json_result)
+    if error is not None:
+        if is_ratelimit_error(error):
+            raise BookmarkAddRateLimited(illust_id)
+        if is_tag_rejection_error(error):
+            raise TagRejected(illust_id, [], get_error_message(error))
+        # 認証やサーバーのエラーは、やり直せば成功する可能性があるため諦めない
+        raise BookmarkAddFailed(illust_id, get_error_message(error))
+
+    if (verification is not None) and not verification.should_verify():
+        # 確認するまでは、保存されている状態を信頼しない
+        if bookmark_store is not None:
+            bookmark_store.delete(illust_id)
+        verification.defer(PendingWrite(illust_id, add_tags, restrict, checkpoint))
+        return
 
-    json_result = await api.illust_bookmark_detail(illust.id)
+    json_result = await api.illust_bookmark_detail(illust_id)
     after_bookmark_detail = json_result.bookmark_detail
     if after_bookmark_detail is None:
-        raise BookmarkDetailRateLimited(illust.id)
+        raise BookmarkDetailRateLimited(illust_id)
 
     after_bookmark_tags = get_bookmark_tag_names(
         after_bookmark_detail.tags)
 
-    if set(add_tags) != set(after_bookmark_tags):
-        raise BookmarkAddRateLimited(illust.id)
+    is_same = is_same_bookmark_tags(add_tags, after_bookmark_tags)
+    if not is_same:
+        if (before_tags is None) or is_same_bookmark_tags(before_tags, after_bookmark_tags):
+            # タグが変わっていないため、書き込みがレート制限で無視されたとみなす
+            raise BookmarkAddRateLimited(illust_id)
+
+    if bookmark_store is not None:
+        bookmark_store.put_detail(illust_id, after_bookmark_detail)
+
+    if verification is not None:
+        verification.on_verified(checkpoint)
+
+    if not is_same:
+        # 書き込みは反映されたため、やり直しても保存されないタグがある
+        raise TagRejected(illust_id, get_missing_tags(add_tags, after_bookmark_tags))
+
+    return after_bookmark_detail
+
+
+async def bookmark_merge_tags(
+    api: BookmarkBackend,
+    illust_id: int,
+    illust_tags: List[str],
+    private: bool = False,
+    preferred_tags: PreferredTag = "bookmark",
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    tag_index: TagFrequencyIndex | None = None,
+    before_state: BookmarkState | None = None
+) -> BookmarkDetail:
+    """編集前のブックマークの状態を取得し、`illust_tags`を結合して書き込みます。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        illust_id (int): イラストのID。
+        illust_tags (List[str]): 除外対象を取り除いた、イラストのタグ名のリスト。
+        private (bool, optional): ブックマークを非公開にするか。
+        `False`の場合は、編集前のプライバシー設定を引き継ぎます。 デフォルトは`False`です。
+        preferred_tags, bookmark_store, verification, tag_indexについては、
+        `bookmark_edit_if_needed`を参照してください。
+        before_state (BookmarkState | None, optional): 既に分かっている、編集前のブックマークの状態。
+        `bookmark_store`により新しい状態が保存されていなければ、この状態を使って`illust_bookmark_detail`を省略します。
+        デフォルトは`None`です。
+
+    Raises:
+        BookmarkDetailRateLimited: ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。
+        BookmarkAddRateLimited: ブックマークを追加するAPIで、レート制限が発生した場合に発生する例外。
+        TagRejected: 書き込みがレート制限以外の理由で拒否された場合や、一部のタグが保存されなかった場合に発生する例外。
+
+    Returns:
+        BookmarkDetail: 編集後のブックマークの詳細情報。 編集しなかった場合や、確認しなかった場合は`None`です。
+    """
+    if bookmark_store is not None:
+        stored_state = bookmark_store.get(illust_id)
+        # より後に確認された状態を使う
+        if (stored_state is not None) and (
+                (before_state is None) or (before_state.verified_at <= stored_state.verified_at)):
+            before_state = stored_state
+
+    if before_state is not None:
+        before_bookmark_tags = before_state.tags
+        before_restrict = before_state.restrict
+    else:
+        json_result = await api.illust_bookmark_detail(illust_id)
+        before_bookmark_detail = json_result.bookmark_detail
+
+        if before_bookmark_detail is None:
+            raise BookmarkDetailRateLimited(illust_id)
 
+        if bookmark_store is not None:
+            bookmark_store.put_detail(illust_id, before_bookmark_detail)
+
+        before_bookmark_tags = get_bookmark_tag_names(before_bookmark_detail.tags)
+        before_restrict = before_bookmark_detail.restrict
+
+    # プライバシー
+    restrict = RESTRICT_PRIVATE if private else before_restrict
+
+    add_tags = merge_bookmark_tags(before_bookmark_tags, illust_tags, preferred_tags, tag_index)
+    if add_tags is None:
+        if tag_index is not None:
+            tag_index.update(illust_id, illust_tags, before_bookmark_tags)
+        if restrict == before_restrict:
+            return
+        # タグは揃っているため、プライバシー設定だけを書き換える
+        add_tags = list(before_bookmark_tags)
+
+    after_bookmark_detail = await bookmark_add(
+        api, illust_id, add_tags, restrict, bookmark_store, verification, before_bookmark_tags)
+    if tag_index is not None:
+        tag_index.update(illust_id, illust_tags, add_tags)
     return after_bookmark_detail
 
 
+async def bookmark_edit_if_needed(
+    api: BookmarkBackend,
+    illust: Illust,
+    tag_rules: TagRules | None = None,
+    preferred_tags: PreferredTag = "bookmark",
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    tag_index: TagFrequencyIndex | None = None
+) -> BookmarkDetail:
+    """ブックマークのタグ、プライバシーを編集します。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        illust (Illust): ブックマークに追加するイラスト。
+        tag_rules (TagRules | None, optional): タグの評価ルール。
+        `exclude_tags`に一致するタグは、ブックマークのタグに追加されません。
+        `private_tags`に一致するタグがイラストに付いている場合、ブックマークが非公開になります。 デフォルトは`None`です。
+        preferred_tags (PreferredTag, optional): イラストのタグとブックマークのタグを結合する際、どちらを優先して残すか。
+        優先しないタグは、切り捨てられる可能性があります。
+        `"frequency"`の場合は、`tag_index`でより多くのブックマークに付いているタグを優先します。 デフォルトは`bookmark`です。
+        bookmark_store (BookmarkStore | None, optional): ブックマークの状態を保存するストア。
+        信頼できる状態が保存されている場合、編集前の`illust_bookmark_detail`を省略します。
+        取得したブックマークの詳細情報は、ストアに保存されます。 デフォルトは`None`です。
+        verification (VerificationPolicy | None, optional): 編集後の確認を行うかを決めるポリシー。
+        確認しない場合、編集は`verification.pending`に記録されます。 デフォルトは`None`(常に確認する)です。
+        tag_index (TagFrequencyIndex | None, optional): ブックマーク全体でのタグの出現数のインデックス。
+        `preferred_tags`が`"frequency"`の場合にタグの選択に使い、編集の結果で数え直します。 デフォルトは`None`です。
+
+    `illust.listing`の一覧の条件からブックマークの状態が分かる場合(`"未分類"`で絞り込んだ一覧など)は、
+    編集前の`illust_bookmark_detail`を省略します。 一覧の状態は最初の書き込みより前のものなので、
+    やり直す場合は`illust.listing`を`None`にして、APIで取得し直します。
+
+    Raises:
+        BookmarkDetailRateLimited: ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。
+        BookmarkAddRateLimited: ブックマークを追加するAPIで、レート制限が発生した場合に発生する例外。
+        TagRejected: 書き込みがレート制限以外の理由で拒否された場合や、一部のタグが保存されなかった場合に発生する例外。
+
+    Returns:
+        BookmarkDetail: 編集後のブックマークの詳細情報。 編集しなかった場合や、確認しなかった場合は`None`です。
+    """
+
+    # 閲覧制限がかかっている場合はスキップ
+    if illust.image_urls.square_medium in LIMITS:
+        return
+
+    raw_illust_tags = get_tag_names(illust.tags)
+
+    if tag_rules is not None:
+        illust_tags = tag_rules.filter_excluded(raw_illust_tags)
+        private = tag_rules.is_private(raw_illust_tags)
+    else:
+        illust_tags = raw_illust_tags
+        private = False
+
+    before_state = None
+    listing = illust.listing
+    if (listing is not None) and (listing.bookmark_tags is not None):
+        before_state = BookmarkState(listing.bookmark_tags, listing.restrict, listing.fetched_at)
+        illust.listing = None
+
+    return await bookmark_merge_tags(
+        api,
+        illust.id,
+        illust_tags,
+        private,
+        preferred_tags,
+        bookmark_store,
+        verification,
+        tag_index,
+        before_state
+    )
+
+
+async def verify_bookmark_write(
+    api: BookmarkBackend,
+    write: PendingWrite,
+    bookmark_store: BookmarkStore | None = None
+) -> bool:
+    """確認していない書き込みが、ブックマークに反映されているかを確認します。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        write (PendingWrite): 確認する書き込み。
+        bookmark_store (BookmarkStore | None, optional): ブックマークの状態を保存するストア。
+        反映されている場合、取得したブックマークの詳細情報を保存します。 デフォルトは`None`です。
+
+    Returns:
+        bool: 書き込みが反映されているか。
+    """
+    json_result = await api.illust_bookmark_detail(write.illust_id)
+    bookmark_detail = json_result.bookmark_detail
+    if bookmark_detail is None:
+        return False
+
+    if write.is_delete:
+        return not bookmark_detail.is_bookmarked
+
+    if not is_same_bookmark_tags(write.tags, get_bookmark_tag_names(bookmark_detail.tags)):
+        return False
+
+    if bookmark_store is not None:
+        bookmark_store.put_detail(write.illust_id, bookmark_detail)
+    return True
+
+
+async def process_bookmarks(
+    api: BookmarkBackend,
+    items: Iterable[Any] | AsyncIterable[Any],
+    process: Callable[[BookmarkBackend, Any, VerificationPolicy | None], Awaitable[str | None]],
+    interval_seconds: int = 5,
+    on_success: Callable[[int, Any], Awaitable[None]] | None = None,
+    on_ratelimited: Callable[[int, Any, RateLimited],
+                             Awaitable[None]] | None = None,
+    retry_if_ratelimited: bool = True,
+    rate_limiter: RateLimiter | None = None,
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    journal: ProgressJournal | None = None,
+    concurrency: int = 1,
+    retry_queue: RetryQueue | None = None,
+    metrics: RunMetrics | None = None,
+    fingerprint: Callable[[Any], str] | None = None
+) -> None:
+    """`items`の各アイテムに`process`を順に適用し、レート制限からのリトライ、書き込みの確認を管理します。
+    `bookmarks_classify`や`plan.apply_plan`の共通部分です。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        items (Iterable[Any] | AsyncIterable[Any]): 処理するアイテムのイテラブル。 各アイテムは`id`(イラストのID)を持つ必要があります。
+        process (Callable[[BookmarkBackend, Any, VerificationPolicy | None],
+        Awaitable[str | None]]): アイテム1つを処理する非同期関数。 引数はバックエンド、アイテム、書き込みの確認のポリシーです。
+        戻り値は、ジャーナルに記録する処理の結果です。
+        fingerprint (Callable[[Any], str] | None, optional): アイテムに対する処理の判定の指紋を計算する関数。
+        指定した場合、指紋をジャーナルに一緒に記録し、記録されている指紋と異なるアイテムは処理済みでも処理し直します。
+        デフォルトは`None`です。
+        それ以外の引数については、`bookmarks_classify`を参照してください。
+    """
+
+    if retry_queue is None:
+        retry_queue = RetryQueue()
+
+    if metrics is not None:
+        # レートリミッターの許可を待った時間を含めないように、最も内側で記録する
+        api = metrics.wrap(api)
+    if rate_limiter is not None:
+        api = rate_limiter.wrap(api)
+    # 止めているAPIの呼び出しは、レートリミッターの許可を待たずに失敗させる
+    api = retry_queue.wrap(api)
+
+    # 確認していない書き込みを、もう一度処理するためのインデックスとアイテム、処理の結果
+    unverified: Dict[int, Tuple[int, Any, str | None]] = {}
+    # レート制限を検出した回数。 並行して処理している場合に、検出より前に始めた書き込みを見分けるために使う
+    ratelimits = 0
+
+    async def _sleep(seconds):
+        await asyncio.sleep(seconds)
+        if metrics is not None:
+            metrics.on_sleep(seconds)
+
+    def _fingerprint(item):
+        return fingerprint(item) if fingerprint is not None else None
+
+    def _record(item, outcome):
+        if journal is not None:
+            journal.record(item.id, outcome or "done", _fingerprint(item))
+
+    def _is_pending(illust_id):
+        return any(write.illust_id == illust_id for write in verification.pending)
+
+    def _confirm_unverified():
+        """確認に成功したため、それまでの書き込みを処理済みとして記録する関数。"""
+        for illust_id in list(unverified):
+            # 並行して処理している場合、確認の後に書き込んだものは残す
+            if _is_pending(illust_id):
+                continue
+            _, item, outcome = unverified.pop(illust_id)
+            _record(item, outcome)
+
+    def _on_ratelimited(ratelimited):
+        """レート制限が発生したAPIを止める関数。"""
+        nonlocal ratelimits
+        ratelimits += 1
+        if metrics is not None:
+            metrics.on_ratelimited(ratelimited)
+        if verification is not None:
+            verification.on_failed()
+        if retry_queue.on_ratelimited(ratelimited.endpoint) and (rate_limiter is not None):
+            # 止めるのは`retry_queue`に任せ、レートリミッターは流量だけを下げる
+            rate_limiter.on_ratelimited(pause=False)
+
+    def _requeue_unverified():
+        """前回の確認以降の書き込みを、もう一度処理するためにキューに戻す関数。"""
+        for write in verification.drain():
+            if write.illust_id not in unverified:
+                continue
+            index, item, _ = unverified.pop(write.illust_id)
+            if retry_if_ratelimited:
+                # 確認に失敗した直後のため、もう一度処理する書き込みは直後に確認する
+                retry_queue.push(index, item, 0, write.exception(), verify=True)
+
+    def _give_up_unverified(error):
+        """確認できなかった書き込みを、`retry_queue.dead_letters`に記録して諦める関数。"""
+        for write in verification.drain():
+            if write.illust_id in unverified:
+                _, item, _ = unverified.pop(write.illust_id)
+                retry_queue.dead_letters.append(DeadLetter(
+                    item.id, error.endpoint, retry_queue.max_retries + 1, str(error)))
+
+    async def _flush_verification():
+        """溜まっている書き込みのうち、最後のものを確認する関数。
+        確認の直前に止められたか、期限までに確認できなかった場合は、その例外を返す。"""
+        if (verification is None) or not verification.pending:
+            return
+
+        await _sleep(retry_queue.cooldown_remaining(BookmarkDetailRateLimited.endpoint))
+        write = verification.pending[-1]
+        try:
+            verified = await verify_bookmark_write(api, write, bookmark_store)
+        except (CoolingDown, RequestTimedOut) as e:
+            # 次の機会に確認する
+            return e
+        finally:
+            if rate_limiter is None:
+                await _sleep(interval_seconds)
+
+        if verified:
+            verification.on_verified(write.checkpoint, write)
+            _confirm_unverified()
+            return
+
+        _on_ratelimited(write.exception())
+        if (on_ratelimited is not None) and (write.illust_id in unverified):
+            index, item, _ = unverified[write.illust_id]
+            await on_ratelimited(index, item, write.exception())
+        _requeue_unverified()
+
+    async def _process(index, item, policy, attempts=0, endpoint=None):
+        """アイテム1つを処理し、レート制限が発生した場合はキューに戻す関数。"""
+        started = ratelimits
+        requested = True
+        try:
+            outcome = await process(api, item, policy)
+        except CoolingDown as e:
+            # リクエストを送っていないため、失敗した回数には数えない
+            requested = False
+            retry_queue.push(index, item, attempts, e, policy is None)
+        except (RequestTimedOut, BookmarkAddFailed) as e:
+            # レート制限ではないため、APIを止めずにすぐにやり直す
+            # 書き込みが反映されたかは分からないため、やり直す場合は直後に確認する
+            retry_queue.push(index, item, attempts + 1, e, verify=True)
+        except RateLimited as e:
+            _on_ratelimited(e)
+            if on_ratelimited is not None:
+                await on_ratelimited(index, item, e)
+            if retry_if_ratelimited:
+                if (verification is not None) and verification.pending:
+                    _requeue_unverified()
+                # 回復したかを確かめるため、やり直す場合は直後に確認する
+                retry_queue.push(index, item, attempts + 1, e, verify=True)
+        except TagRejected as e:
+            # レート制限ではなくやり直しても結果は変わらないため、待たずに記録して次に進む
+            if rate_limiter is not None:
+                rate_limiter.on_success()
+            if endpoint is not None:
+                retry_queue.on_success(endpoint)
+            retry_queue.reject(item, e)
+            if verification is not None:
+                _confirm_unverified()
+            _record(item, "rejected")
+            if metrics is not None:
+                metrics.on_rejected()
+        else:
+            if rate_limiter is not None:
+                rate_limiter.on_success()
+            if endpoint is not None:
+                retry_queue.on_success(endpoint)
+            if (policy is not None) and _is_pending(item.id):
+                if started != ratelimits:
+                    # 書き込みの途中で他の処理がレート制限を検出したため、確認を省略せずにもう一度処理する
+                    write = next(write for write in policy.pending if write.illust_id == item.id)
+                    retry_queue.push(index, item, attempts, write.exception(), verify=True)
+                    return
+                # 確認するまでは、処理済みとして記録しない
+                unverified[item.id] = (index, item, outcome)
+            else:
+                if verification is not None:
+                    _confirm_unverified()
+                _record(item, outcome)
+            if metrics is not None:
+                metrics.on_success()
+            if on_success is not None:
+                await on_success(index, item)
+        finally:
+            if requested and (rate_limiter is None):
+                await _sleep(interval_seconds)
+
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    tasks: Set[asyncio.Task] = set()
+
+    async def _worker(*args):
+        """並行して処理する場合に、タスクとして実行する関数。"""
+        try:
+            await _process(*args)
+        finally:
+            semaphore.release()
+
+    def _reap(done):
+        """終了したタスクで発生した例外を、送出する関数。"""
+        for task in done:
+            tasks.discard(task)
+            task.result()
+
+    async def _submit(index, item, policy, attempts=0, endpoint=None):
+        if concurrency <= 1:
+            await _process(index, item, policy, attempts, endpoint)
+            return
+
+        await semaphore.acquire()
+        tasks.add(asyncio.create_task(_worker(index, item, policy, attempts, endpoint)))
+        _reap([task for task in tasks if task.done()])
+
+    async def _retry_ready():
+        """待ち時間が過ぎた処理を、やり直す関数。"""
+        for entry in retry_queue.pop_ready():
+            policy = None if entry.verify else verification
+            await _submit(entry.index, entry.item, policy, entry.attempts, entry.endpoint)
+
+    try:
+        index = 0
+        async for item in aiterate(items):
+            # 処理済みのアイテムは、APIを呼び出さずにスキップする
+            if (journal is not None) and journal.is_done(item.id, _fingerprint(item)):
+                if metrics is not None:
+                    metrics.on_skipped()
+                index += 1
+                continue
+
+            await _submit(index, item, verification)
+            index += 1
+            await _retry_ready()
+            if (verification is not None) and verification.should_flush():
+                await _flush_verification()
+
+        # 全てのアイテムを処理した後は、やり直す処理と確認していない書き込みがなくなるまで続ける
+        flush_failures = 0
+        while True:
+            while tasks or len(retry_queue):
+                await _retry_ready()
+                if tasks:
+                    done, _ = await asyncio.wait(
+                        tasks, timeout=retry_queue.wait_seconds(),
+                        return_when=asyncio.FIRST_COMPLETED)
+                    _reap(done)
+                elif len(retry_queue):
+                    await _sleep(retry_queue.wait_seconds())
+                if (verification is not None) and verification.should_flush():
+                    await _flush_verification()
+
+            if (verification is None) or not verification.pending:
+                break
+            # 同時に行われていた書き込みは確認した書き込みに含まれないため、全て確認するまで繰り返す
+            error = await _flush_verification()
+            if error is None:
+                flush_failures = 0
+                continue
+            flush_failures += 1
+            if retry_queue.max_retries < flush_failures:
+                # 確認できないまま繰り返し続けないように、確認していない書き込みを諦める
+                _give_up_unverified(error)
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if journal is not None:
+        journal.commit()
+
+
 async def bookmarks_classify(
-    api: AppPixivAPI,
-    illusts: List[Illust],
-    exclude_tags: List[str] | None = None,
-    private_tags: List[str] | None = None,
+    api: BookmarkBackend,
+    illusts: Iterable[Illust] | AsyncIterable[Illust],
+    tag_rules: TagRules | None = None,
     preferred_tags: PreferredTag = "bookmark",
-    delete_tags: List[str] | None = None,
     delete_if_unknown: bool = False,
     interval_seconds: int = 5,
     on_success: Callable[[int, Illust], Awaitable[None]] | None = None,
     # TODO: bookmark_add_tag_if_neededで、スキップした場合に例外を投げるようにしたとき用
     # on_skipped: Callable[[int, Illust], Awaitable[None]] | None = None,
     on_ratelimited: Callable[[int, Illust, RateLimited],
-                             Awaitable[None]] | None = bookmark_classify_on_ratelimited,
-    retry_if_ratelimited: bool = True
+                             Awaitable[None]] | None = None,
+    retry_if_ratelimited: bool = True,
+    rate_limiter: RateLimiter | None = None,
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    journal: ProgressJournal | None = None,
+    concurrency: int = 1,
+    retry_queue: RetryQueue | None = None,
+    metrics: RunMetrics | None = None,
+    tag_index: TagFrequencyIndex | None = None
 ) -> None:
     """illustsのブックマークタグに、イラストのタグを追加します。
     `delete_if_unknown`が`True`の場合、非公開もしくは削除済みのイラストはブックマークが解除されます。
-    `delete_tags`のいずれかがタグに含まれているイラストは、ブックマークが解除されます。
+    `tag_rules.delete_tags`のいずれかがタグに含まれているイラストは、ブックマークが解除されます。
 
     `interval_seconds`の値が小さい場合、pixivからアクセスを制限される可能性があります。
-    `on_ratelimited`には、5~10分間処理を止める関数を渡すことをおすすめします。
+    レート制限が発生したイラストは`retry_queue`に戻し、APIごとの待ち時間の後にやり直すため、
+    `on_ratelimited`で処理を止める必要はありません。
+    `api`の呼び出しが期限(`timeouts.RequestTimeouts`)を過ぎたイラストは、レート制限とは別に扱い、
+    `on_ratelimited`を呼び出さず、APIも止めずにやり直します。 書き込みが反映されたかは分からないため、直後に確認します。
+
+    `illusts`には、`get_bookmarks.iter_bookmarks_illust_pages`などの非同期イテラブルも渡せます。
+    その場合、ブックマークの取得と並行して、取得済みのイラストから順に処理されます。
 
     Args:
-        api, illusts, exclude_tags, private_tags, preferred_tagsについては、
-        `bookmark_add_tag_if_needed`を参照してください。
+        api, tag_rules, preferred_tags, bookmark_store, verification, tag_indexについては、
+        `bookmark_edit_if_needed`を参照してください。
+
+        illusts (Iterable[Illust] | AsyncIterable[Illust]): 処理するイラストのイテラブル。
 
-        delete_tags (List[str] | None, optional): 削除対象のタグ。 指定したタグがイラストに付いている場合、ブックマークが解除されます。
-        デフォルトはNoneです。
         delete_if_unknown (bool): 非公開もしくは削除済みのイラストのブックマークを解除するか。 デフォルトは`False`です。
         interval_seconds (int, optional): 取得する間隔。  秒単位で指定してください。  デフォルトは`5`です。
         on_success (Callable[[int, Illust], None] | None, optional): 各イラストへの処理が成功した場合に呼び出される非同期関数。
@@ -234,44 +932,63 @@ async def bookmarks_classify(
         on_ratelimited (Callable[[int, Illust, RateLimited], None] | None, optional):
         処理の最中に例外`RateLimited`が発生した場合に呼び出される非同期関数。
         引数はイラストのインデックス、処理に失敗したイラスト、例外情報です。
-        デフォルトは`bookmark_classify_on_ratelimited`(10分間処理を止める関数)です。
+        デフォルトは`None`です。
         retry_if_ratelimited (bool): 例外`RateLimited`が発生した場合、処理をリトライするか。 デフォルトは`True`です。
+        rate_limiter (RateLimiter | None, optional): APIへのリクエストを制御するレートリミッター。
+        指定した場合、`interval_seconds`は使われず、リクエスト毎に`rate_limiter`の許可を待ちます。
+        レート制限が発生した場合は、`rate_limiter`の流量を下げます。 デフォルトは`None`です。
+        journal (ProgressJournal | None, optional): 処理済みのイラストを記録するジャーナル。
+        記録されているイラストは、APIを呼び出さずにスキップします。
+        処理の判定の指紋(`decision_fingerprint`)も一緒に記録し、設定の変更で判定が変わったイラストだけは処理し直します。
+        デフォルトは`None`です。
+        concurrency (int, optional): 同時に処理するイラストの数。
+        2以上の場合、`on_success`はイラストの順番通りに呼ばれるとは限りません。
+        リクエストの間隔は`rate_limiter`でまとめて制御するため、`rate_limiter`と組み合わせて使ってください。
+        デフォルトは`1`です。
+        retry_queue (RetryQueue | None, optional): レート制限が発生したイラストを、やり直すためのキュー。
+        レート制限が発生したAPIだけを止め、他のAPIを使うイラストの処理は続けます。
+        やり直しの回数の上限に達したイラストは、`retry_queue.dead_letters`に記録されます。
+        タグが拒否されたなど、レート制限以外の理由で書き込めなかったイラストは、やり直さずに
+        `retry_queue.rejections`に記録されます。
+        `None`の場合は、デフォルトの設定の`RetryQueue`を使います。 デフォルトは`None`です。
+        metrics (RunMetrics | None, optional): APIの呼び出し、検出したレート制限、待機した時間、処理した件数を記録する集計。
+        デフォルトは`None`です。
+
+    `verification`で確認を省略した書き込みは、後の確認に失敗した場合や、レート制限が発生した場合に、
+    前回の確認以降のものをまとめてもう一度処理します。
     """
 
-    async def _bookmark_classify(index, illust):
-        """for文内で使う関数。"""
-        raw_illust_tags = get_tag_names(illust.tags)
-
-        # 非公開/削除済みか, 削除対象の場合はフラグをTrueに
-        if (delete_if_unknown and is_limit_unknown(illust)) or \
-           ((delete_tags) and
-           len([tag for tag in raw_illust_tags if in_exact_match(tag, delete_tags)]) > 0):
-            should_delete = True
-        else:
-            should_delete = False
-
-        try:
-            if should_delete:
-                await bookmark_delete(api, illust.id)
-            else:
-                await bookmark_edit_if_needed(
-                    api,
-                    illust,
-                    exclude_tags,
-                    private_tags,
-                    preferred_tags
-                )
-        except RateLimited as e:
-            if on_ratelimited is not None:
-                await on_ratelimited(index, illust, e)
-            if retry_if_ratelimited:
-                await _bookmark_classify(index, illust)
-        else:
-            if on_success is not None:
-                await on_success(index, illust)
-        finally:
-            await asyncio.sleep(interval_seconds)
-
-    for index, illust in enumerate(illusts):
-        await _bookmark_classify(index, illust)
-        continue
+    async def _bookmark_classify(api, illust, policy):
+        # 非公開/削除済みか, 削除対象の場合はブックマークを解除する
+        if should_delete_bookmark(illust, tag_rules, delete_if_unknown):
+            await bookmark_delete(api, illust.id, bookmark_store, policy)
+            return "deleted"
+
+        await bookmark_edit_if_needed(
+            api,
+            illust,
+            tag_rules,
+            preferred_tags,
+            bookmark_store,
+            policy,
+            tag_index
+        )
+        return "classified"
+
+    await process_bookmarks(
+        api,
+        illusts,
+        _bookmark_classify,
+        interval_seconds,
+        on_success,
+        on_ratelimited,
+        retry_if_ratelimited,
+        rate_limiter,
+        bookmark_store,
+        verification,
+        journal,
+        concurrency,
+        retry_queue,
+        metrics,
+        lambda illust: decision_fingerprint(illust, tag_rules, preferred_tags, delete_if_unknown)
+    )
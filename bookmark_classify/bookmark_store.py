@@ -0,0 +1,110 @@
+"""ブックマークの状態をローカルに保存するモジュール"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import List, NamedTuple
+
+from .utils import BookmarkDetail, Restrict
+
+
+class BookmarkState(NamedTuple):
+    """保存されたブックマークの状態。
+
+    Attributes:
+        tags (List[str]): ブックマークのタグ名のリスト。
+        restrict (Restrict): ブックマークのプライバシー設定。
+        verified_at (float): APIで状態を確認した時刻。 UNIX時間です。
+    """
+    tags: List[str]
+    restrict: Restrict
+    verified_at: float
+
+
+class BookmarkStore():
+    """イラストのIDをキーに、ブックマークのタグ、プライバシー設定、確認した時刻を保存するSQLiteのストア。
+
+    `ttl_seconds`以内に確認された状態は信頼できるものとして扱い、
+    ブックマークを編集する前の`illust_bookmark_detail`を省略するために使います。
+
+    Args:
+        path (str | os.PathLike): データベースのパス。
+        ttl_seconds (float, optional): 保存した状態を信頼する期間。 秒単位で指定してください。 デフォルトは`604800`(7日)です。
+    """
+
+    def __init__(self, path: str | os.PathLike, ttl_seconds: float = 604800) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bookmarks ("
+            "illust_id INTEGER PRIMARY KEY, "
+            "tags TEXT NOT NULL, "
+            "restrict TEXT NOT NULL, "
+            "verified_at REAL NOT NULL)")
+        self._connection.commit()
+
+    def get(self, illust_id: int) -> BookmarkState | None:
+        """`ttl_seconds`以内に確認された、ブックマークの状態を取得します。
+
+        Args:
+            illust_id (int): イラストのID。
+
+        Returns:
+            BookmarkState | None: ブックマークの状態。 保存されていない場合や、古い場合は`None`です。
+        """
+        row = self._connection.execute(
+            "SELECT tags, restrict, verified_at FROM bookmarks WHERE illust_id = ?",
+            (illust_id,)).fetchone()
+        if row is None:
+            return None
+
+        tags, restrict, verified_at = row
+        if self.ttl_seconds < time.time() - verified_at:
+            return None
+        return BookmarkState(json.loads(tags), restrict, verified_at)
+
+    def put(self, illust_id: int, tags: List[str], restrict: Restrict) -> None:
+        """ブックマークの状態を、現在の時刻で確認したものとして保存します。
+
+        Args:
+            illust_id (int): イラストのID。
+            tags (List[str]): ブックマークのタグ名のリスト。
+            restrict (Restrict): ブックマークのプライバシー設定。
+        """
+        self._connection.execute(
+            "INSERT OR REPLACE INTO bookmarks (illust_id, tags, restrict, verified_at) "
+            "VALUES (?, ?, ?, ?)",
+            (illust_id, json.dumps(tags, ensure_ascii=False), restrict, time.time()))
+        self._connection.commit()
+
+    def put_detail(self, illust_id: int, bookmark_detail: BookmarkDetail) -> None:
+        """`illust_bookmark_detail`で取得したブックマークの詳細情報を保存します。
+        ブックマークされていない場合は、保存されている状態を削除します。
+
+        Args:
+            illust_id (int): イラストのID。
+            bookmark_detail (BookmarkDetail): ブックマークの詳細情報。
+        """
+        if not bookmark_detail.is_bookmarked:
+            self.delete(illust_id)
+            return
+
+        tags = [tag.name for tag in bookmark_detail.tags if tag.is_registered]
+        self.put(illust_id, tags, bookmark_detail.restrict)
+
+    def delete(self, illust_id: int) -> None:
+        """保存されているブックマークの状態を削除します。
+
+        Args:
+            illust_id (int): イラストのID。
+        """
+        self._connection.execute("DELETE FROM bookmarks WHERE illust_id = ?", (illust_id,))
+        self._connection.commit()
+
+    def close(self) -> None:
+        """データベースとの接続を閉じます。"""
+        self._connection.close()
@@ -1,6 +1,9 @@
 RESTRICT_PUBLIC = "public"
 RESTRICT_PRIVATE = "private"
 
+# ブックマークの一覧を、ブックマークのタグが付いていないものに絞り込むためのタグ
+UNCATEGORIZED_TAG = "未分類"
+
 """
 閲覧制限がかかっているかどうかは、`illust.image_urls.square_medium`で判別できる。
 削除/非公開: `https://s.pximg.net/common/images/limit_unknown_360.png`
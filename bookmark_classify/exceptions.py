@@ -1,5 +1,8 @@
 """例外のモジュール"""
 
+import asyncio
+from typing import List
+
 
 class BookmarkClassifyException(Exception):
     """基本例外クラス。"""
@@ -7,7 +10,12 @@ class BookmarkClassifyException(Exception):
 
 
 class RateLimited(BookmarkClassifyException):
-    """pixivのAPIでレート制限が発生した場合に発生する例外。"""
+    """pixivのAPIでレート制限が発生した場合に発生する例外。
+
+    Attributes:
+        endpoint (str | None): レート制限が発生したAPIの名前。 分からない場合は`None`です。
+    """
+    endpoint: str | None = None
 
     def __init__(self, illust_id: int) -> None:
         self.illust_id = illust_id
@@ -18,6 +26,7 @@ class RateLimited(BookmarkClassifyException):
 
 class BookmarkDetailRateLimited(RateLimited):
     """ブックマークの詳細を取得するAPIで、レート制限が発生した場合に発生する例外。"""
+    endpoint = "illust_bookmark_detail"
 
     def __str__(self) -> str:
         return f"レート制限が発生したため、ブックマークを取得に失敗しました。 illust_id: {self.illust_id}"
@@ -25,6 +34,7 @@ class BookmarkDetailRateLimited(RateLimited):
 
 class BookmarkAddRateLimited(RateLimited):
     """ブックマークを追加するAPIで、レート制限が発生した場合に発生する例外。"""
+    endpoint = "illust_bookmark_add"
 
     def __str__(self) -> str:
         return f"レート制限が発生したため、ブックマークの追加に失敗しました。 illust_id: {self.illust_id}"
@@ -32,6 +42,135 @@ class BookmarkAddRateLimited(RateLimited):
 
 class BookmarkDeleteRateLimited(RateLimited):
     """ブックマークを削除するAPIで、レート制限が発生した場合に発生する例外。"""
+    endpoint = "illust_bookmark_delete"
 
     def __str__(self) -> str:
         return f"レート制限が発生したため、ブックマークの削除に失敗しました。 illust_id: {self.illust_id}"
+
+
+class BookmarkListRateLimited(RateLimited):
+    """ブックマークの一覧を取得するAPIで、レート制限が発生した場合に発生する例外。
+    一覧は特定のイラストに対するものではないため、`illust_id`は`None`です。"""
+    endpoint = "user_bookmarks_illust"
+
+    def __init__(self) -> None:
+        super().__init__(None)
+
+    def __str__(self) -> str:
+        return "レート制限が発生したため、ブックマークの一覧の取得に失敗しました。"
+
+
+class BatchRateLimited(RateLimited):
+    """複数のブックマークをまとめて書き換えるAPIで、レート制限が発生した場合に発生する例外。
+    特定のイラストに対するものではないため、`illust_id`は`None`です。"""
+
+    def __init__(self, endpoint: str) -> None:
+        super().__init__(None)
+        self.endpoint = endpoint
+
+    def __str__(self) -> str:
+        return f"レート制限が発生したため、{self.endpoint}に失敗しました。"
+
+
+class WebAPIError(BookmarkClassifyException):
+    """pixivのWebのAPIが、レート制限以外のエラーを返した場合に発生する例外。
+
+    Attributes:
+        endpoint (str): エラーが発生したAPIの名前。
+        status (int): HTTPのステータスコード。
+        message (str | None): pixivが返したエラーのメッセージ。 返されなかった場合は`None`です。
+    """
+
+    def __init__(self, endpoint: str, status: int, message: str | None = None) -> None:
+        self.endpoint = endpoint
+        self.status = status
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"{self.endpoint}でエラーが発生しました。 status: {self.status}, message: {self.message}"
+
+
+class TagRejected(BookmarkClassifyException):
+    """ブックマークへの書き込みが、レート制限以外の理由でpixivに拒否された場合に発生する例外。
+    書き込みは反映されたものの一部のタグが保存されなかった場合や、タグの検証のエラーが返された場合です。
+    レート制限とは異なり、やり直しても結果は変わりません。
+
+    Attributes:
+        illust_id (int): イラストのID。
+        tags (List[str]): 保存されなかったタグ名のリスト。 分からない場合は空です。
+        reason (str | None): pixivが返したエラーのメッセージ。 返されなかった場合は`None`です。
+    """
+
+    def __init__(self, illust_id: int, tags: List[str], reason: str | None = None) -> None:
+        self.illust_id = illust_id
+        self.tags = tags
+        self.reason = reason
+
+    def __str__(self) -> str:
+        if self.reason is not None:
+            return f"ブックマークの書き込みが拒否されました。 illust_id: {self.illust_id}, reason: {self.reason}"
+        return f"ブックマークのタグが保存されませんでした。 illust_id: {self.illust_id}, tags: {self.tags}"
+
+
+class BookmarkAddFailed(BookmarkClassifyException):
+    """ブックマークを追加するAPIが、レート制限でもタグの検証でもないエラーを返した場合に発生する例外。
+    認証のエラーやサーバーの一時的なエラーなど、やり直せば成功する可能性があるものとして扱います。
+
+    Attributes:
+        illust_id (int): イラストのID。
+        reason (str): pixivが返したエラーのメッセージ。
+    """
+    endpoint = "illust_bookmark_add"
+
+    def __init__(self, illust_id: int, reason: str) -> None:
+        self.illust_id = illust_id
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"ブックマークの追加に失敗しました。 illust_id: {self.illust_id}, reason: {self.reason}"
+
+
+class CoolingDown(RateLimited):
+    """レート制限のために止めているAPIを呼び出した場合に、リクエストを送らずに発生する例外。"""
+
+    def __init__(self, illust_id: int, endpoint: str) -> None:
+        super().__init__(illust_id)
+        self.endpoint = endpoint
+
+    def __str__(self) -> str:
+        return f"レート制限のため、{self.endpoint}を止めています。 illust_id: {self.illust_id}"
+
+
+class RequestTimedOut(BookmarkClassifyException, asyncio.TimeoutError):
+    """pixivのAPIへのリクエストが、期限までに終わらなかった場合に発生する例外。
+    レート制限とは異なり、APIを止めずにすぐにやり直します。
+    `asyncio.TimeoutError`のサブクラスでもあるため、通信のエラーとしてやり直す処理では、そのままやり直されます。
+
+    Attributes:
+        endpoint (str): 期限を過ぎたAPIの名前。
+        timeout_seconds (float | None): リクエストの期限。 期限を設けていないAPIが、
+        HTTPのセッションのタイムアウトで失敗した場合は`None`です。
+    """
+
+    def __init__(self, endpoint: str, timeout_seconds: float | None) -> None:
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+
+    def __str__(self) -> str:
+        if self.timeout_seconds is None:
+            return f"{self.endpoint}のリクエストがタイムアウトしました。"
+        return f"{self.endpoint}のリクエストが{self.timeout_seconds}秒以内に終わりませんでした。"
+
+
+class ProgressStalled(BookmarkClassifyException):
+    """APIのレスポンスが一定の時間届かず、処理が止まっていると判断した場合に発生する例外。
+
+    Attributes:
+        idle_seconds (float): 最後にレスポンスが届いてからの時間。
+    """
+
+    def __init__(self, idle_seconds: float) -> None:
+        self.idle_seconds = idle_seconds
+
+    def __str__(self) -> str:
+        return f"{self.idle_seconds:.0f}秒間APIのレスポンスが届かなかったため、処理を中断しました。"
@@ -1,11 +1,18 @@
 """ユーザーのブックマークを取得するモジュール"""
 
 import asyncio
-from typing import List
+import time
+from typing import Any, AsyncIterator, Dict, List, NamedTuple
 
-from pixivpy_async import AppPixivAPI
+import aiohttp
 
-from .utils import Illust, Restrict
+from .backend import BookmarkBackend
+from .bookmark_cache import BookmarkCache
+from .exceptions import BookmarkListRateLimited
+from .illust import Illust, ListingContext, to_illusts
+from .metrics import RunMetrics
+from .rate_limiter import RateLimiter
+from .utils import Restrict
 from .consts import LIMIT_UNKNOWN, LIMIT_AGE
 
 """
@@ -25,45 +32,258 @@ def is_limit_age(illust: Illust):
     return illust.image_urls.square_medium in LIMIT_AGE
 
 
+class BookmarkPage(NamedTuple):
+    """取得した1ページ分のブックマーク。
+
+    Attributes:
+        illusts (List[Illust]): ブックマークしているイラストの一覧。
+        next_qs (Dict[str, Any] | None): 次のページを取得するためのクエリ。 最後のページの場合は`None`です。
+    """
+    illusts: List[Illust]
+    next_qs: Dict[str, Any] | None
+
+
+async def _request_page(
+    api: BookmarkBackend,
+    qs: Dict[str, Any],
+    rate_limiter: RateLimiter | None,
+    metrics: RunMetrics | None,
+    max_retries: int,
+    backoff_seconds: float
+) -> Any:
+    """1ページを取得します。 レート制限や通信のエラー、期限切れ(`exceptions.RequestTimedOut`)の場合は、
+    待ってからやり直します。"""
+    for attempt in range(max_retries + 1):
+        try:
+            json_result = await api.user_bookmarks_illust(**qs)
+            # レート制限の場合は、例外ではなく`error`だけを含むレスポンスが返る
+            if json_result.get("illusts") is None:
+                raise BookmarkListRateLimited()
+            return json_result
+        except BookmarkListRateLimited:
+            if max_retries <= attempt:
+                raise
+            if rate_limiter is not None:
+                # レートリミッターが止めている間は、次のリクエストの許可を待つ
+                rate_limiter.on_ratelimited()
+                continue
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if max_retries <= attempt:
+                raise
+
+        wait_seconds = backoff_seconds * 2 ** attempt
+        await asyncio.sleep(wait_seconds)
+        if metrics is not None:
+            metrics.on_sleep(wait_seconds)
+
+
+async def iter_bookmarks_pages(
+    api: BookmarkBackend,
+    user_id: int | str,
+    restrict: Restrict = "public",
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None,
+    start_qs: Dict[str, Any] | None = None,
+    max_retries: int = 5,
+    backoff_seconds: float = 60
+) -> AsyncIterator[BookmarkPage]:
+    """指定されたユーザーのブックマークを、次のページを取得するためのクエリと一緒にページ単位で取得する
+    非同期ジェネレーターです。 クエリを保存しておくと、中断した取得を`start_qs`で再開できます。
+
+    各イラストには、取得した一覧の条件(`illust.listing`)を持たせます。
+
+    レート制限が発生した場合は、`rate_limiter`に通知して許可を待ってから、
+    `rate_limiter`がない場合は`backoff_seconds`秒から倍々に待ってから、同じページを取得し直します。
+    通信のエラーの場合も、同じように待ってから取得し直します。
+
+    Args:
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metricsについては、
+        `get_all_bookmarks_illust`を参照してください。
+        start_qs (Dict[str, Any] | None, optional): 取得を始めるページのクエリ。
+        `None`の場合は最初のページから取得します。 デフォルトは`None`です。
+        max_retries (int, optional): 1つのページを取得し直す回数の上限。 デフォルトは`5`です。
+        backoff_seconds (float, optional): 最初に取得し直すまでに待つ時間。 秒単位で指定してください。
+        デフォルトは`60`です。
+
+    Raises:
+        BookmarkListRateLimited: 取得し直す回数の上限に達しても、レート制限が続いた場合に発生する例外。
+
+    Yields:
+        BookmarkPage: 1ページ分のブックマーク。
+    """
+    if metrics is not None:
+        api = metrics.wrap(api)
+    if rate_limiter is not None:
+        api = rate_limiter.wrap(api)
+
+    qs = start_qs
+    if qs is None:
+        qs = {"user_id": user_id, "restrict": restrict, "tag": tag}
+
+    while True:
+        json_result = await _request_page(
+            api, qs, rate_limiter, metrics, max_retries, backoff_seconds)
+        if rate_limiter is not None:
+            rate_limiter.on_success()
+
+        next_url = json_result.next_url
+        next_qs = None if next_url is None else api.parse_qs(next_url)
+        # レスポンス全体は保持せず、整理に使う項目だけのレコードにする
+        # 一覧の条件から分かるブックマークの状態を使えるように、取得した条件も一緒に持たせる
+        listing = ListingContext(restrict, tag, time.time())
+        yield BookmarkPage(to_illusts(json_result.illusts, listing), next_qs)
+
+        if next_qs is None:
+            break
+        qs = next_qs
+
+        if rate_limiter is None:
+            await asyncio.sleep(interval_seconds)
+            if metrics is not None:
+                metrics.on_sleep(interval_seconds)
+
+
+async def iter_bookmarks_illust_pages(
+    api: BookmarkBackend,
+    user_id: int | str,
+    restrict: Restrict = "public",
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None
+) -> AsyncIterator[List[Illust]]:
+    """指定されたユーザーのブックマークを、ページ単位で取得する非同期ジェネレーターです。
+    ページは取得した順にyieldされるため、全てのページの取得を待たずに処理を始められます。
+    `interval_seconds`の値が小さい場合、pixivからアクセスを制限される可能性があります。
+
+    Args:
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metricsについては、
+        `get_all_bookmarks_illust`を参照してください。
+
+    Yields:
+        List[Illust]: 1ページ分のブックマークしているイラストの一覧。
+    """
+    async for page in iter_bookmarks_pages(
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metrics
+    ):
+        yield page.illusts
+
+
+async def fetch_bookmarks_to_cache(
+    api: BookmarkBackend,
+    user_id: int | str,
+    bookmark_cache: BookmarkCache,
+    restrict: Restrict = "public",
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None
+) -> AsyncIterator[List[Illust]]:
+    """指定されたユーザーのブックマークを全て取得し、ページごとにキャッシュに追記する非同期ジェネレーターです。
+    ページと次のページを取得するためのクエリは一緒に記録されるため、途中で中断した場合は、
+    次回の呼び出しで中断したページから取得を再開します。 中断した取得がない場合は、キャッシュを空にしてから取得します。
+
+    Args:
+        bookmark_cache (BookmarkCache): 取得したブックマークを追記するキャッシュ。
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metricsについては、
+        `get_all_bookmarks_illust`を参照してください。
+
+    Yields:
+        List[Illust]: 今回取得した、1ページ分のブックマークしているイラストの一覧。
+        再開した場合、中断する前に取得したページは含まれません。
+    """
+    start_qs = bookmark_cache.load_cursor(restrict)
+    if start_qs is None:
+        bookmark_cache.clear(restrict)
+
+    async for page in iter_bookmarks_pages(
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metrics, start_qs
+    ):
+        bookmark_cache.append_page(restrict, page.illusts, page.next_qs)
+        yield page.illusts
+
+
 async def get_all_bookmarks_illust(
-    api: AppPixivAPI,
+    api: BookmarkBackend,
     user_id: int | str,
     restrict: Restrict = "public",
     tag: str | None = None,
-    interval_seconds: int = 5
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None
 ) -> List[Illust]:
     """指定されたユーザーのブックマークを全て取得します。
     `interval_seconds`の値が小さい場合、pixivからアクセスを制限される可能性があります。
+    レート制限や通信のエラーは、`iter_bookmarks_pages`と同じように待ってから取得し直します。
+    中断した場合に途中から再開するには、`fetch_bookmarks_to_cache`を使ってください。
 
     Args:
-        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
         user_id (int | str): ブックマークを取得するユーザーのID。
         restrict (Restrict): 取得するブックマークのプライバシー設定。 デフォルトは`"public"`です。
         tag (str | None): 絞り込むタグ。 指定したタグが付いたブックマークのみを取得できます。 デフォルトは`None`です。
         Interval_seconds (int, optional): 取得する間隔。 秒単位で指定してください。 デフォルトは`5`です。
+        rate_limiter (RateLimiter | None, optional): リクエストを制御するレートリミッター。
+        指定した場合、`interval_seconds`は使われません。 デフォルトは`None`です。
+        metrics (RunMetrics | None, optional): APIの呼び出しと待機した時間を記録する集計。 デフォルトは`None`です。
 
     Returns:
         List[Illust]: ブックマークしているイラストの一覧。
     """
     bookmark_illusts = []
-    next_qs = None
 
-    while True:
-        if next_qs is not None:
-            json_result = await api.user_bookmarks_illust(**next_qs)
-        else:
-            json_result = await api.user_bookmarks_illust(user_id, restrict=restrict, tag=tag)
-        illusts = json_result.illusts
+    async for illusts in iter_bookmarks_illust_pages(
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metrics
+    ):
         bookmark_illusts.extend(illusts)
 
-        next_url = json_result.next_url
-        if next_url is None:
-            break
-        next_qs = api.parse_qs(next_url)
+    return bookmark_illusts
 
-        await asyncio.sleep(interval_seconds)
 
-    return bookmark_illusts
+async def sync_bookmarks(
+    api: BookmarkBackend,
+    user_id: int | str,
+    bookmark_cache: BookmarkCache,
+    restrict: Restrict = "public",
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None
+) -> List[Illust]:
+    """キャッシュを取得してから追加された新しいブックマークだけを取得し、キャッシュの先頭に追加します。
+    ブックマークは新しいものから返されるため、キャッシュにあるイラストが見つかった時点で取得をやめます。
+    `bookmark_cache`には、全てのページの取得が完了した一覧が保存されている必要があります。
+
+    途中で中断された場合はキャッシュに何も追加しないため、次回は最初から取得し直します。
+
+    Args:
+        bookmark_cache (BookmarkCache): 取得済みのブックマークのキャッシュ。
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metricsについては、
+        `get_all_bookmarks_illust`を参照してください。
+
+    Returns:
+        List[Illust]: 新しいブックマークのイラストの一覧。 新しいものから並んでいます。
+    """
+    new_illusts = []
+    pages = iter_bookmarks_illust_pages(
+        api, user_id, restrict, tag, interval_seconds, rate_limiter, metrics)
+    try:
+        async for illusts in pages:
+            known = False
+            for illust in illusts:
+                if bookmark_cache.contains(restrict, illust.id):
+                    known = True
+                    break
+                new_illusts.append(illust)
+            if known:
+                break
+    finally:
+        await pages.aclose()
+
+    bookmark_cache.prepend(restrict, new_illusts)
+    return new_illusts
 
 
 def get_unknown_bookmarks_illust(
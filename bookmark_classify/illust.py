@@ -0,0 +1,202 @@
+"""ブックマークの整理に必要な項目だけを持つ、イラストのレコードとその読み書きを行うモジュール
+
+APIのレスポンスやキャッシュには、ユーザー、キャプション、画像のURLなど多くの項目が含まれますが、
+整理に使うのは`id`, `tags[].name`, `image_urls.square_medium`だけです。
+レスポンス全体を`JsonDict`として持ち続けると、ブックマーク1件あたり数KBのメモリを使うため、
+読み込んだ時点でこれらの項目だけのレコードに変換します。
+
+orjsonがインストールされている場合は、JSONのキャッシュの読み込みにorjsonを使います。
+"""
+
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Tuple
+
+from .consts import LIMITS, UNCATEGORIZED_TAG
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class IllustTag():
+    """イラストのタグ。 同じ名前のタグは、`of`で1つのインスタンスを共有します。
+
+    Args:
+        name (str): タグ名。
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"IllustTag({self.name!r})"
+
+    @staticmethod
+    def of(name: str) -> "IllustTag":
+        """`name`のタグを、共有のインスタンスとして返します。
+
+        Args:
+            name (str): タグ名。
+
+        Returns:
+            IllustTag: タグ。
+        """
+        tag = _TAGS.get(name)
+        if tag is None:
+            tag = _TAGS[name] = IllustTag(sys.intern(name))
+        return tag
+
+
+class ImageUrls():
+    """イラストの画像のURL。 閲覧制限の判別に使う`square_medium`だけを持ちます。
+
+    Args:
+        square_medium (str): 正方形のサムネイルのURL。
+    """
+    __slots__ = ("square_medium",)
+
+    def __init__(self, square_medium: str) -> None:
+        self.square_medium = square_medium
+
+    def __repr__(self) -> str:
+        return f"ImageUrls({self.square_medium!r})"
+
+    @staticmethod
+    def of(square_medium: str) -> "ImageUrls":
+        """`square_medium`のURLを返します。 閲覧制限の画像のURLは、共有のインスタンスを返します。
+
+        Args:
+            square_medium (str): 正方形のサムネイルのURL。
+
+        Returns:
+            ImageUrls: 画像のURL。
+        """
+        shared = _LIMIT_IMAGE_URLS.get(square_medium)
+        if shared is not None:
+            return shared
+        return ImageUrls(square_medium)
+
+
+class ListingContext(NamedTuple):
+    """イラストを取得したブックマークの一覧の条件。
+    条件によっては、一覧に含まれているだけでブックマークの状態が分かります。
+
+    Attributes:
+        restrict (str): 一覧のプライバシー設定。 `"public"`もしくは`"private"`です。
+        tag (str | None): 一覧を絞り込んだタグ。 絞り込んでいない場合は`None`です。
+        fetched_at (float): 一覧を取得した時刻。 UNIX時間です。
+    """
+    restrict: str
+    tag: str | None
+    fetched_at: float
+
+    @property
+    def bookmark_tags(self) -> List[str] | None:
+        """一覧の条件から分かる、ブックマークのタグ名のリスト。 分からない場合は`None`です。"""
+        if self.tag == UNCATEGORIZED_TAG:
+            return []
+        return None
+
+
+class Illust():
+    """ブックマークの整理に必要な項目だけを持つ、イラストのレコード。
+    `illust.id`, `illust.tags[0].name`, `illust.image_urls.square_medium`のように、
+    APIのレスポンスと同じ名前で読み出せます。
+
+    Args:
+        id (int): イラストのID。
+        tags (Tuple[IllustTag, ...]): イラストのタグのタプル。
+        image_urls (ImageUrls): イラストの画像のURL。
+        listing (ListingContext | None, optional): イラストを取得したブックマークの一覧の条件。
+        一覧を取得した直後ではなく、状態が変わっている可能性がある場合は`None`です。 デフォルトは`None`です。
+    """
+    __slots__ = ("id", "tags", "image_urls", "listing")
+
+    def __init__(
+        self,
+        id: int,
+        tags: Tuple[IllustTag, ...],
+        image_urls: ImageUrls,
+        listing: ListingContext | None = None
+    ) -> None:
+        self.id = id
+        self.tags = tags
+        self.image_urls = image_urls
+        self.listing = listing
+
+    def __repr__(self) -> str:
+        return f"Illust(id={self.id!r}, tags={[tag.name for tag in self.tags]!r})"
+
+    @staticmethod
+    def from_json(data: Mapping[str, Any], listing: ListingContext | None = None) -> "Illust":
+        """APIのレスポンスやキャッシュの、1件のイラストの辞書から必要な項目だけを取り出します。
+
+        Args:
+            data (Mapping[str, Any]): イラストの辞書。 `JsonDict`も渡せます。
+            listing (ListingContext | None, optional): イラストを取得したブックマークの一覧の条件。
+            デフォルトは`None`です。
+
+        Returns:
+            Illust: イラストのレコード。
+        """
+        return Illust(
+            data["id"],
+            tuple(IllustTag.of(tag["name"]) for tag in data["tags"]),
+            ImageUrls.of(data["image_urls"]["square_medium"]),
+            listing)
+
+    def to_json(self) -> Dict[str, Any]:
+        """`from_json`で読み込める辞書に変換します。
+
+        Returns:
+            Dict[str, Any]: イラストの辞書。
+        """
+        return {
+            "id": self.id,
+            "tags": [{"name": tag.name} for tag in self.tags],
+            "image_urls": {"square_medium": self.image_urls.square_medium},
+        }
+
+
+_TAGS: Dict[str, IllustTag] = {}
+_LIMIT_IMAGE_URLS: Dict[str, ImageUrls] = {url: ImageUrls(url) for url in LIMITS}
+
+
+def to_illusts(
+    items: Iterable[Mapping[str, Any]],
+    listing: ListingContext | None = None
+) -> List[Illust]:
+    """APIのレスポンスのイラストの一覧を、レコードのリストに変換します。
+
+    Args:
+        items (Iterable[Mapping[str, Any]]): イラストの辞書のイテラブル。
+        listing (ListingContext | None, optional): イラストを取得したブックマークの一覧の条件。
+        デフォルトは`None`です。
+
+    Returns:
+        List[Illust]: イラストのレコードのリスト。
+    """
+    return [Illust.from_json(item, listing) for item in items]
+
+
+def load_illusts(path: str | os.PathLike) -> List[Illust]:
+    """JSONのキャッシュファイルから、イラストのレコードのリストを読み込みます。
+    レスポンス全体を保存した、以前の形式のキャッシュも読み込めます。
+
+    Args:
+        path (str | os.PathLike): キャッシュファイルのパス。
+
+    Returns:
+        List[Illust]: イラストのレコードのリスト。
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            items = orjson.loads(f.read())
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    return to_illusts(items)
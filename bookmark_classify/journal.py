@@ -0,0 +1,134 @@
+"""処理済みのイラストを記録する、追記専用のジャーナルのモジュール"""
+
+import json
+import os
+import time
+from typing import Dict, List
+
+
+class ProgressJournal():
+    """処理済みのイラストのIDと結果を、1行1件のJSONで追記するジャーナル。
+
+    記録は`commit_every`件毎、もしくは前回の書き込みから`commit_seconds`秒経過した時点でまとめて書き込み、
+    fsyncします。 強制終了された場合でも、失われるのは最後にまとめて書き込んだ後の記録だけです。
+    再開時は、インデックスではなくIDの集合で処理済みかを判定するため、キャッシュを取得し直しても影響を受けません。
+
+    記録する際に、処理の判定の指紋(`bookmark_classify.decision_fingerprint`)を一緒に記録しておくと、
+    設定を変更した後の実行では、指紋が変わったイラストだけを処理済みでないものとして扱えます(`is_done`)。
+
+    Args:
+        path (str | os.PathLike): ジャーナルのパス。
+        commit_every (int, optional): まとめて書き込む件数。 デフォルトは`30`です。
+        commit_seconds (float, optional): まとめて書き込む間隔。 秒単位で指定してください。 デフォルトは`10`です。
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        commit_every: int = 30,
+        commit_seconds: float = 10
+    ) -> None:
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+        self.outcomes: Dict[int, str] = {}
+        self.fingerprints: Dict[int, str] = {}
+        self._buffer: List[str] = []
+        self._committed_at = time.monotonic()
+
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 書き込みの途中で終了した行は無視する
+                        continue
+                    self.outcomes[record["id"]] = record["outcome"]
+                    fingerprint = record.get("fingerprint")
+                    if fingerprint is not None:
+                        self.fingerprints[record["id"]] = fingerprint
+                    else:
+                        self.fingerprints.pop(record["id"], None)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, illust_id: int) -> bool:
+        return illust_id in self.outcomes
+
+    def __len__(self) -> int:
+        return len(self.outcomes)
+
+    def is_done(self, illust_id: int, fingerprint: str | None = None) -> bool:
+        """イラストが処理済みかを調べます。
+
+        Args:
+            illust_id (int): イラストのID。
+            fingerprint (str | None, optional): 今回の処理の判定の指紋。
+            指定した場合、記録されている指紋と異なるイラストは処理済みでないものとして扱います。
+            指紋を記録していないイラストは、指紋に関わらず処理済みとして扱います。 デフォルトは`None`です。
+
+        Returns:
+            bool: 処理済みか。
+        """
+        if illust_id not in self.outcomes:
+            return False
+        if fingerprint is None:
+            return True
+        recorded = self.fingerprints.get(illust_id)
+        return (recorded is None) or (recorded == fingerprint)
+
+    def record(
+        self,
+        illust_id: int,
+        outcome: str = "done",
+        fingerprint: str | None = None
+    ) -> None:
+        """イラストを処理済みとして記録します。
+
+        Args:
+            illust_id (int): イラストのID。
+            outcome (str, optional): 処理の結果。 デフォルトは`"done"`です。
+            fingerprint (str | None, optional): 処理の判定の指紋。 デフォルトは`None`です。
+        """
+        self.outcomes[illust_id] = outcome
+        record = {"id": illust_id, "outcome": outcome}
+        if fingerprint is not None:
+            self.fingerprints[illust_id] = fingerprint
+            record["fingerprint"] = fingerprint
+        else:
+            self.fingerprints.pop(illust_id, None)
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+
+        if (self.commit_every <= len(self._buffer)) or \
+           (self.commit_seconds <= time.monotonic() - self._committed_at):
+            self.commit()
+
+    def commit(self) -> None:
+        """溜まっている記録を書き込み、fsyncします。"""
+        self._committed_at = time.monotonic()
+        if not self._buffer:
+            return
+
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+
+    def reset(self) -> None:
+        """全ての記録を削除します。"""
+        self._buffer.clear()
+        self.outcomes.clear()
+        self.fingerprints.clear()
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """溜まっている記録を書き込み、ファイルを閉じます。"""
+        self.commit()
+        self._file.close()
@@ -0,0 +1,357 @@
+"""APIの呼び出し回数や所要時間などを集計し、ファイルに書き出すモジュール"""
+
+import asyncio
+import bisect
+import json
+import math
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from pixivpy_async import AppPixivAPI
+
+from .exceptions import RateLimited
+from .rate_limiter import THROTTLED_ENDPOINTS, RateLimiter
+
+# レイテンシのヒストグラムの区切り(秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_PREFIX = "bookmark_classify"
+
+
+class Histogram():
+    """値の分布を、`buckets`で区切った件数として集計するヒストグラム。
+
+    Args:
+        buckets (Tuple[float, ...], optional): 区切りの上限の昇順のタプル。 デフォルトは`LATENCY_BUCKETS`です。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # 最後の要素は、全ての区切りを超えた値の件数
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """値を1つ記録します。
+
+        Args:
+            value (float): 記録する値。
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """区切りの上限と、その値以下の件数の組のリストを返します。
+
+        Returns:
+            List[Tuple[float, int]]: 区切りの上限と累積の件数の組のリスト。 最後の上限は`math.inf`です。
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class RunMetrics():
+    """1回の実行について、APIごとの呼び出し回数とレイテンシ、検出したレート制限、待機と処理の時間、
+    処理速度と残り時間の見込みを集計するクラス。
+
+    `wrap`で包んだAPIの呼び出しを記録し、期限を過ぎた呼び出しはレート制限とは別に数えます。 処理の結果は`on_success`, `on_ratelimited`で通知してください。
+    `json_path`, `prometheus_path`を指定した場合、`write_every_seconds`毎にそれぞれの形式で書き出します。
+
+    Args:
+        total (int | None, optional): 処理するアイテムの総数。 分かっている場合、残り時間の見込みに使います。
+        デフォルトは`None`です。
+        rate_limiter (RateLimiter | None, optional): 許可を待った時間を、待機した時間に含めるレートリミッター。
+        デフォルトは`None`です。
+        json_path (str | os.PathLike | None, optional): JSONで書き出すファイルのパス。 デフォルトは`None`です。
+        prometheus_path (str | os.PathLike | None, optional): Prometheusのテキスト形式で書き出すファイルのパス。
+        デフォルトは`None`です。
+        write_every_seconds (float, optional): 書き出す間隔。 秒単位で指定してください。 デフォルトは`60`です。
+    """
+
+    def __init__(
+        self,
+        total: int | None = None,
+        rate_limiter: RateLimiter | None = None,
+        json_path: str | os.PathLike | None = None,
+        prometheus_path: str | os.PathLike | None = None,
+        write_every_seconds: float = 60
+    ) -> None:
+        self.total = total
+        self.rate_limiter = rate_limiter
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.write_every_seconds = write_every_seconds
+
+        self.latencies: Dict[str, Histogram] = {}
+        self.errors: Counter = Counter()
+        self.timeouts: Counter = Counter()
+        self.verification_failures: Counter = Counter()
+        self.processed = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.slept_seconds = 0.0
+
+        self._started = time.monotonic()
+        self._written_at = self._started
+
+    @property
+    def elapsed_seconds(self) -> float:
+        """集計を始めてからの経過時間。"""
+        return time.monotonic() - self._started
+
+    @property
+    def sleep_seconds(self) -> float:
+        """待機した時間の合計。 並行して待機した時間は、それぞれ数えます。"""
+        waited = 0.0 if self.rate_limiter is None else self.rate_limiter.waited_seconds
+        return self.slept_seconds + waited
+
+    @property
+    def api_seconds(self) -> float:
+        """APIの呼び出しにかかった時間の合計。 並行して呼び出した時間は、それぞれ数えます。"""
+        return sum(histogram.sum for histogram in self.latencies.values())
+
+    @property
+    def throughput(self) -> float:
+        """1時間あたりに処理したアイテムの数。"""
+        elapsed = self.elapsed_seconds
+        if elapsed <= 0:
+            return 0.0
+        return self.processed / elapsed * 3600
+
+    @property
+    def eta_seconds(self) -> float | None:
+        """残りのアイテムを処理するまでの時間の見込み。 総数が分からない場合や、まだ処理していない場合は`None`です。"""
+        if (self.total is None) or (self.processed == 0):
+            return None
+        remaining = max(self.total - self.processed - self.skipped - self.rejected, 0)
+        return remaining / self.throughput * 3600
+
+    def observe_call(self, endpoint: str, seconds: float, error: bool = False) -> None:
+        """APIの呼び出しを1回記録します。
+
+        Args:
+            endpoint (str): APIの名前。
+            seconds (float): 呼び出しにかかった時間。
+            error (bool, optional): 例外が発生したか。 デフォルトは`False`です。
+        """
+        histogram = self.latencies.get(endpoint)
+        if histogram is None:
+            histogram = self.latencies[endpoint] = Histogram()
+        histogram.observe(seconds)
+        if error:
+            self.errors[endpoint] += 1
+
+    def on_timeout(self, endpoint: str) -> None:
+        """APIの呼び出しが、期限までに終わらなかったことを通知します。 レート制限とは別に数えます。
+
+        Args:
+            endpoint (str): APIの名前。
+        """
+        self.timeouts[endpoint] += 1
+        self.write_if_needed()
+
+    def on_sleep(self, seconds: float) -> None:
+        """待機した時間を記録します。
+
+        Args:
+            seconds (float): 待機した時間。
+        """
+        self.slept_seconds += max(seconds, 0.0)
+
+    def on_success(self) -> None:
+        """アイテムを1つ処理したことを通知します。"""
+        self.processed += 1
+        self.write_if_needed()
+
+    def on_skipped(self) -> None:
+        """処理済みのアイテムを、スキップしたことを通知します。"""
+        self.skipped += 1
+
+    def on_rejected(self) -> None:
+        """アイテムへの書き込みが拒否され、やり直さずに諦めたことを通知します。"""
+        self.rejected += 1
+        self.write_if_needed()
+
+    def on_ratelimited(self, ratelimited: RateLimited) -> None:
+        """書き込みの確認などで、レート制限を検出したことを通知します。
+
+        Args:
+            ratelimited (RateLimited): 検出したレート制限の例外。
+        """
+        self.verification_failures[type(ratelimited).__name__] += 1
+        self.write_if_needed()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """現在の集計結果を、JSONに変換できる辞書として返します。
+
+        Returns:
+            Dict[str, Any]: 集計結果。
+        """
+        return {
+            "elapsed_seconds": self.elapsed_seconds,
+            "sleep_seconds": self.sleep_seconds,
+            "api_seconds": self.api_seconds,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "rejected": self.rejected,
+            "total": self.total,
+            "throughput_per_hour": self.throughput,
+            "eta_seconds": self.eta_seconds,
+            "endpoints": {
+                endpoint: {
+                    "calls": histogram.count,
+                    "errors": self.errors[endpoint],
+                    "timeouts": self.timeouts[endpoint],
+                    "latency_seconds_sum": histogram.sum,
+                    "latency_buckets": {
+                        str(bound): count for bound, count in histogram.cumulative()
+                    }
+                }
+                for endpoint, histogram in sorted(self.latencies.items())
+            },
+            "verification_failures": dict(self.verification_failures),
+        }
+
+    def to_prometheus(self) -> str:
+        """現在の集計結果を、Prometheusのテキスト形式で返します。
+
+        Returns:
+            str: Prometheusのテキスト形式の集計結果。
+        """
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_api_latency_seconds Latency of pixiv API calls.",
+            f"# TYPE {p}_api_latency_seconds histogram",
+        ]
+        for endpoint, histogram in sorted(self.latencies.items()):
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(
+                    f'{p}_api_latency_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {count}')
+            lines.append(f'{p}_api_latency_seconds_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+            lines.append(
+                f'{p}_api_latency_seconds_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+        lines += [
+            f"# HELP {p}_api_errors_total pixiv API calls that raised an exception.",
+            f"# TYPE {p}_api_errors_total counter",
+        ]
+        for endpoint in sorted(self.latencies):
+            lines.append(f'{p}_api_errors_total{{endpoint="{endpoint}"}} {self.errors[endpoint]}')
+
+        lines += [
+            f"# HELP {p}_api_timeouts_total pixiv API calls that did not finish in time.",
+            f"# TYPE {p}_api_timeouts_total counter",
+        ]
+        for endpoint in sorted(self.latencies):
+            lines.append(
+                f'{p}_api_timeouts_total{{endpoint="{endpoint}"}} {self.timeouts[endpoint]}')
+
+        lines += [
+            f"# HELP {p}_verification_failures_total Detected rate limits by exception type.",
+            f"# TYPE {p}_verification_failures_total counter",
+        ]
+        for name, count in sorted(self.verification_failures.items()):
+            lines.append(f'{p}_verification_failures_total{{type="{name}"}} {count}')
+
+        counters = (
+            ("processed_total", "Processed items.", self.processed),
+            ("skipped_total", "Items skipped as already processed.", self.skipped),
+            ("rejected_total", "Items whose writes were rejected by pixiv.", self.rejected),
+            ("sleep_seconds_total", "Time spent waiting for the rate limit.", self.sleep_seconds),
+            ("api_seconds_total", "Time spent in pixiv API calls.", self.api_seconds),
+        )
+        for name, help_text, value in counters:
+            lines += [
+                f"# HELP {p}_{name} {help_text}",
+                f"# TYPE {p}_{name} counter",
+                f"{p}_{name} {value}",
+            ]
+
+        gauges = [
+            ("elapsed_seconds", "Time since the run started.", self.elapsed_seconds),
+            ("throughput_per_hour", "Processed items per hour.", self.throughput),
+        ]
+        if self.total is not None:
+            gauges.append(("total", "Items to process.", self.total))
+        if self.eta_seconds is not None:
+            gauges.append(("eta_seconds", "Estimated time to process the rest.", self.eta_seconds))
+        for name, help_text, value in gauges:
+            lines += [
+                f"# HELP {p}_{name} {help_text}",
+                f"# TYPE {p}_{name} gauge",
+                f"{p}_{name} {value}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """集計結果を、`json_path`と`prometheus_path`に書き出します。 指定されていないものは書き出しません。"""
+        self._written_at = time.monotonic()
+        if self.json_path is not None:
+            _replace_text(self.json_path, json.dumps(self.snapshot(), ensure_ascii=False, indent=4))
+        if self.prometheus_path is not None:
+            _replace_text(self.prometheus_path, self.to_prometheus())
+
+    def write_if_needed(self) -> None:
+        """前回の書き出しから`write_every_seconds`秒経過している場合に、集計結果を書き出します。"""
+        if self.write_every_seconds <= time.monotonic() - self._written_at:
+            self.write()
+
+    def wrap(self, api: AppPixivAPI) -> "MeteredAPI":
+        """`api`の呼び出しを記録するラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            MeteredAPI: `api`のラッパー。
+        """
+        return MeteredAPI(api, self)
+
+
+class MeteredAPI():
+    """`THROTTLED_ENDPOINTS`の呼び出し回数と所要時間を、`RunMetrics`に記録するAppPixivAPIのラッパー。
+    それ以外の属性は、そのまま`api`のものを返します。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        metrics (RunMetrics): 記録先。
+    """
+
+    def __init__(self, api: AppPixivAPI, metrics: RunMetrics) -> None:
+        self._api = api
+        self.metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in THROTTLED_ENDPOINTS:
+            return attr
+
+        async def _metered(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                result = await attr(*args, **kwargs)
+            except Exception as e:
+                self.metrics.observe_call(name, time.monotonic() - started, error=True)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.metrics.on_timeout(name)
+                raise
+            self.metrics.observe_call(name, time.monotonic() - started)
+            return result
+
+        return _metered
+
+
+def _replace_text(path: str | os.PathLike, text: str) -> None:
+    """読み込み中に書きかけの内容が見えないように、一時ファイルに書いてから置き換えます。"""
+    tmp_path = f"{os.fspath(path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,298 @@
+"""ブックマークの整理を、ネットワークを使わずに計画し、後から実行するモジュール"""
+
+import json
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple
+
+from .backend import BookmarkBackend
+from .bookmark_classify import (bookmark_add, bookmark_delete, bookmark_merge_tags,
+                                decision_fingerprint, get_tag_names, merge_bookmark_tags,
+                                process_bookmarks, should_delete_bookmark)
+from .bookmark_store import BookmarkStore
+from .consts import LIMITS, RESTRICT_PRIVATE
+from .exceptions import RateLimited
+from .illust import Illust
+from .journal import ProgressJournal
+from .metrics import RunMetrics
+from .rate_limiter import RateLimiter
+from .retry_queue import RetryQueue
+from .tag_frequency import TagFrequencyIndex
+from .tag_rules import TagRules
+from .utils import PlanAction, PreferredTag, Restrict
+from .verification import VerificationPolicy
+
+
+class PlanEntry(NamedTuple):
+    """1つのイラストに対する計画。
+
+    `action`ごとの意味は次の通りです。
+
+    - `"delete"`: ブックマークを解除します。
+    - `"add"`: 編集前の状態が分かっているため、`tags`と`restrict`をそのまま書き込みます。
+    - `"merge"`: 編集前の状態を取得してから、`tags`(除外対象を取り除いたイラストのタグ)を結合して書き込みます。
+      `restrict`が`None`の場合は、編集前のプライバシー設定を引き継ぎます。
+    - `"skip"`: 何もしません。
+
+    Attributes:
+        id (int): イラストのID。
+        action (PlanAction): 行う処理。
+        tags (List[str]): 書き込むタグ名のリスト。
+        restrict (Restrict | None): 書き込むプライバシー設定。
+        fingerprint (str | None): 計画を立てた時点の、処理の判定の指紋(`decision_fingerprint`)。
+        ジャーナルに一緒に記録し、`bookmarks_classify`で同じ判定のまま処理済みのイラストは実行しません。
+        指紋がない古い計画の場合は`None`です。
+    """
+    id: int
+    action: PlanAction
+    tags: List[str]
+    restrict: Restrict | None
+    fingerprint: str | None = None
+
+
+def plan_bookmark(
+    illust: Illust,
+    tag_rules: TagRules | None = None,
+    preferred_tags: PreferredTag = "bookmark",
+    delete_if_unknown: bool = False,
+    bookmark_store: BookmarkStore | None = None,
+    tag_index: TagFrequencyIndex | None = None
+) -> PlanEntry:
+    """1つのイラストに対する計画を立てます。 ネットワークは使いません。
+
+    Args:
+        illust (Illust): 計画を立てるイラスト。
+        tag_rules, preferred_tags, delete_if_unknownについては、
+        `bookmark_classify.bookmarks_classify`を参照してください。
+        bookmark_store (BookmarkStore | None, optional): ブックマークの状態を保存するストア。
+        信頼できる状態が保存されている場合、その状態を元に書き込むタグまで決めます。 デフォルトは`None`です。
+        tag_index (TagFrequencyIndex | None, optional): タグの出現数のインデックス。
+        書き込むタグまで決めた場合は、計画通りに反映されたものとして数え直します。
+        詳しくは`bookmark_classify.bookmark_edit_if_needed`を参照してください。 デフォルトは`None`です。
+
+    Returns:
+        PlanEntry: イラストに対する計画。
+    """
+    fingerprint = decision_fingerprint(illust, tag_rules, preferred_tags, delete_if_unknown)
+    if should_delete_bookmark(illust, tag_rules, delete_if_unknown):
+        return PlanEntry(illust.id, "delete", [], None, fingerprint)
+
+    # 閲覧制限がかかっている場合はスキップ
+    if illust.image_urls.square_medium in LIMITS:
+        return PlanEntry(illust.id, "skip", [], None, fingerprint)
+
+    raw_illust_tags = get_tag_names(illust.tags)
+    if tag_rules is not None:
+        illust_tags = tag_rules.filter_excluded(raw_illust_tags)
+        restrict = RESTRICT_PRIVATE if tag_rules.is_private(raw_illust_tags) else None
+    else:
+        illust_tags = raw_illust_tags
+        restrict = None
+
+    if bookmark_store is not None:
+        state = bookmark_store.get(illust.id)
+    else:
+        state = None
+
+    if state is None:
+        return PlanEntry(illust.id, "merge", illust_tags, restrict, fingerprint)
+
+    add_tags = merge_bookmark_tags(state.tags, illust_tags, preferred_tags, tag_index)
+    if tag_index is not None:
+        tag_index.update(illust.id, illust_tags, state.tags if add_tags is None else add_tags)
+    if add_tags is None:
+        if restrict in (None, state.restrict):
+            return PlanEntry(illust.id, "skip", [], None, fingerprint)
+        # タグは揃っているため、プライバシー設定だけを書き換える
+        add_tags = list(state.tags)
+    return PlanEntry(illust.id, "add", add_tags, restrict or state.restrict, fingerprint)
+
+
+def plan_bookmarks(
+    illusts: Iterable[Illust],
+    tag_rules: TagRules | None = None,
+    preferred_tags: PreferredTag = "bookmark",
+    delete_if_unknown: bool = False,
+    bookmark_store: BookmarkStore | None = None,
+    tag_index: TagFrequencyIndex | None = None
+) -> List[PlanEntry]:
+    """`illusts`の全てのイラストに対する計画を立てます。 ネットワークは使いません。
+
+    Args:
+        illusts (Iterable[Illust]): 計画を立てるイラストのイテラブル。
+        それ以外の引数については、`plan_bookmark`を参照してください。
+
+    Returns:
+        List[PlanEntry]: 各イラストに対する計画。
+    """
+    return [
+        plan_bookmark(
+            illust, tag_rules, preferred_tags, delete_if_unknown, bookmark_store, tag_index)
+        for illust in illusts
+    ]
+
+
+def summarize_plan(
+    entries: Iterable[PlanEntry],
+    verify_ratio: float = 1.0,
+    journal: ProgressJournal | None = None
+) -> Dict[str, int]:
+    """計画の件数と、実行に必要なリクエスト数の見込みを集計します。
+
+    Args:
+        entries (Iterable[PlanEntry]): 計画。
+        verify_ratio (float, optional): 書き込みのうち、確認のリクエストが発生する割合。 デフォルトは`1.0`です。
+        journal (ProgressJournal | None, optional): 進捗のジャーナル。
+        指定した場合、同じ判定のまま処理済みの計画は`done`に数え、リクエスト数の見込みから除きます。
+        デフォルトは`None`です。
+
+    Returns:
+        Dict[str, int]: `action`ごとの件数、処理済みの件数(`done`)と、リクエスト数の見込み(`requests`)。
+    """
+    summary = {"delete": 0, "add": 0, "merge": 0, "skip": 0, "done": 0}
+    for entry in entries:
+        if (entry.action != "skip") and (journal is not None) and \
+                journal.is_done(entry.id, entry.fingerprint):
+            summary["done"] += 1
+            continue
+        summary[entry.action] += 1
+
+    writes = summary["delete"] + summary["add"] + summary["merge"]
+    # "merge"は、編集前の状態を取得するリクエストが1回多い
+    summary["requests"] = round(writes * (1 + verify_ratio) + summary["merge"])
+    return summary
+
+
+def save_plan(
+    path: str | os.PathLike,
+    entries: List[PlanEntry],
+    summary: Dict[str, int] | None = None
+) -> None:
+    """計画をファイルに書き込みます。 `"skip"`の計画は件数のみ記録されます。
+
+    Args:
+        path (str | os.PathLike): 書き込むファイルのパス。
+        entries (List[PlanEntry]): 計画。
+        summary (Dict[str, int] | None, optional): 計画の集計。 `None`の場合は`summarize_plan`で集計します。
+    """
+    if summary is None:
+        summary = summarize_plan(entries)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "summary": summary,
+            "entries": [list(entry) for entry in entries if entry.action != "skip"]
+        }, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_plan(path: str | os.PathLike) -> List[PlanEntry]:
+    """ファイルから計画を読み込みます。
+
+    Args:
+        path (str | os.PathLike): 読み込むファイルのパス。
+
+    Returns:
+        List[PlanEntry]: 計画。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    return [PlanEntry(*entry) for entry in plan["entries"]]
+
+
+async def apply_plan_entry(
+    api: BookmarkBackend,
+    entry: PlanEntry,
+    preferred_tags: PreferredTag = "bookmark",
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    tag_index: TagFrequencyIndex | None = None
+) -> PlanAction:
+    """1つの計画を実行します。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        entry (PlanEntry): 実行する計画。
+        preferred_tags, bookmark_store, verification, tag_indexについては、
+        `bookmark_classify.bookmark_edit_if_needed`を参照してください。
+
+    Raises:
+        RateLimited: いずれかのAPIで、レート制限が発生した場合に発生する例外。
+        TagRejected: 書き込みがレート制限以外の理由で拒否された場合に発生する例外。
+
+    Returns:
+        PlanAction: 実行した計画の`action`。
+    """
+    match entry.action:
+        case "delete":
+            await bookmark_delete(api, entry.id, bookmark_store, verification)
+        case "add":
+            # 書き込みが無視されたか、タグが拒否されたかを見分けるために、編集前のタグと比べる
+            before_state = bookmark_store.get(entry.id) if bookmark_store is not None else None
+            await bookmark_add(
+                api, entry.id, entry.tags, entry.restrict, bookmark_store, verification,
+                None if before_state is None else before_state.tags)
+        case "merge":
+            await bookmark_merge_tags(
+                api,
+                entry.id,
+                entry.tags,
+                entry.restrict == RESTRICT_PRIVATE,
+                preferred_tags,
+                bookmark_store,
+                verification,
+                tag_index
+            )
+    return entry.action
+
+
+async def apply_plan(
+    api: BookmarkBackend,
+    entries: Iterable[PlanEntry],
+    preferred_tags: PreferredTag = "bookmark",
+    interval_seconds: int = 5,
+    on_success: Callable[[int, PlanEntry], Awaitable[None]] | None = None,
+    on_ratelimited: Callable[[int, PlanEntry, RateLimited],
+                             Awaitable[None]] | None = None,
+    retry_if_ratelimited: bool = True,
+    rate_limiter: RateLimiter | None = None,
+    bookmark_store: BookmarkStore | None = None,
+    verification: VerificationPolicy | None = None,
+    journal: ProgressJournal | None = None,
+    concurrency: int = 1,
+    retry_queue: RetryQueue | None = None,
+    metrics: RunMetrics | None = None,
+    tag_index: TagFrequencyIndex | None = None
+) -> None:
+    """計画のうち、`"skip"`以外のものを順に実行します。
+
+    Args:
+        api (BookmarkBackend): ブックマークを読み書きするバックエンド。 AppPixivAPIのインスタンスなどです。
+        entries (Iterable[PlanEntry]): 実行する計画。
+        それ以外の引数については、`bookmark_classify.bookmarks_classify`を参照してください。
+        `on_success`, `on_ratelimited`には、イラストの代わりに計画が渡されます。
+        ジャーナルには計画の`fingerprint`を一緒に記録するため、同じ判定のまま処理済みのイラストだけをスキップします。
+    """
+
+    async def _apply(api, entry, policy):
+        return await apply_plan_entry(
+            api, entry, preferred_tags, bookmark_store, policy, tag_index)
+
+    def _fingerprint(entry):
+        return entry.fingerprint
+
+    await process_bookmarks(
+        api,
+        (entry for entry in entries if entry.action != "skip"),
+        _apply,
+        interval_seconds,
+        on_success,
+        on_ratelimited,
+        retry_if_ratelimited,
+        rate_limiter,
+        bookmark_store,
+        verification,
+        journal,
+        concurrency,
+        retry_queue,
+        metrics,
+        _fingerprint
+    )
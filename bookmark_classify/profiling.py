@@ -0,0 +1,185 @@
+"""処理をフェーズに分けて、所要時間、CPU時間、メモリ使用量を計測するモジュール"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pathlib
+import pstats
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+
+class PhaseStats(NamedTuple):
+    """1つのフェーズの計測結果。 同じフェーズに複数回入った場合は、合計です。
+
+    Attributes:
+        count (int): フェーズに入った回数。
+        wall_seconds (float): 経過時間の合計。
+        cpu_seconds (float): プロセスのCPU時間の合計。
+        peak_memory_bytes (int): tracemallocで計測した、Pythonが確保したメモリの最大値。
+    """
+    count: int
+    wall_seconds: float
+    cpu_seconds: float
+    peak_memory_bytes: int
+
+
+class _ProfileSnapshot():
+    """cProfileの統計の差分を、`pstats.Stats`に読み込ませるためのクラス。"""
+
+    def __init__(self, stats: Dict[Any, Tuple]) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def _subtract(after: Tuple, before: Tuple | None) -> Tuple:
+    if before is None:
+        return after
+    return tuple(a - b for a, b in zip(after, before))
+
+
+def _diff_profile_stats(after: Dict[Any, Tuple], before: Dict[Any, Tuple]) -> Dict[Any, Tuple]:
+    """cProfileの統計(`Profile.stats`)の、`before`から`after`までに増えた分を求めます。"""
+    diff = {}
+    for func, (cc, nc, tt, ct, callers) in after.items():
+        if func in before:
+            before_cc, before_nc, before_tt, before_ct, before_callers = before[func]
+            if (cc, nc, tt, ct) == (before_cc, before_nc, before_tt, before_ct):
+                continue
+            cc, nc, tt, ct = _subtract((cc, nc, tt, ct),
+                                       (before_cc, before_nc, before_tt, before_ct))
+            callers = {caller: _subtract(value, before_callers.get(caller))
+                       for caller, value in callers.items()
+                       if value != before_callers.get(caller)}
+        diff[func] = (cc, nc, tt, ct, callers)
+    return diff
+
+
+class _ActivePhase():
+    """計測中のフェーズ。"""
+
+    def __init__(self, name: str, profile_stats: Dict[Any, Tuple] | None) -> None:
+        self.name = name
+        self.peak_memory_bytes = 0
+        self.profile_stats = profile_stats
+
+
+class PhaseProfiler():
+    """`phase`で囲んだ処理の経過時間、CPU時間、メモリ使用量の最大値を、フェーズ名ごとに集計するクラス。
+
+    `enabled`が`False`の場合は何も計測しないため、計測しない実行でもそのまま`phase`で囲めます。
+    メモリ使用量はtracemallocで計測するため、有効にした場合はメモリの確保が遅くなります。
+
+    フェーズは入れ子にできます。 入れ子のフェーズの計測結果は、外側のフェーズの計測結果にも含まれます。
+    同じイベントループで並行して実行されるフェーズは、経過時間とCPU時間が重複して数えられます。
+    `cprofile`が`True`の場合、cProfileで関数ごとの統計もフェーズごとに集計します。
+    cProfileは同時に1つしか動かせないため、いずれかのフェーズに入っている間は1つのcProfileを動かし続け、
+    フェーズに入った時点と出た時点の統計の差分を、そのフェーズの統計とします。
+
+    Args:
+        enabled (bool, optional): 計測するか。 デフォルトは`True`です。
+        cprofile (bool, optional): cProfileで関数ごとの統計も集計するか。 デフォルトは`False`です。
+    """
+
+    def __init__(self, enabled: bool = True, cprofile: bool = False) -> None:
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.phases: Dict[str, PhaseStats] = {}
+        self.stats: Dict[str, pstats.Stats] = {}
+
+        self._active: List[_ActivePhase] = []
+        self._profile: cProfile.Profile | None = None
+
+    def _update_peaks(self) -> None:
+        """計測中の全てのフェーズに、前回からのメモリ使用量の最大値を反映し、最大値の計測をやり直します。"""
+        _, peak = tracemalloc.get_traced_memory()
+        for active in self._active:
+            active.peak_memory_bytes = max(active.peak_memory_bytes, peak)
+        tracemalloc.reset_peak()
+
+    def _snapshot_profile(self) -> Dict[Any, Tuple] | None:
+        """動かしているcProfileの、現在までの統計を返します。"""
+        if self._profile is None:
+            return None
+        self._profile.create_stats()
+        stats = dict(self._profile.stats)
+        self._profile.enable()
+        return stats
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """囲んだ処理を、`name`のフェーズとして計測します。
+
+        Args:
+            name (str): フェーズ名。
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._update_peaks()
+
+        if self.cprofile and (self._profile is None):
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        active = _ActivePhase(name, self._snapshot_profile())
+
+        self._active.append(active)
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall_seconds = time.perf_counter() - started_wall
+            cpu_seconds = time.process_time() - started_cpu
+            self._update_peaks()
+            self._active.remove(active)
+
+            if active.profile_stats is not None:
+                stats = pstats.Stats(_ProfileSnapshot(
+                    _diff_profile_stats(self._snapshot_profile(), active.profile_stats)))
+                if name in self.stats:
+                    self.stats[name].add(stats)
+                else:
+                    self.stats[name] = stats
+                if not self._active:
+                    self._profile.disable()
+                    self._profile = None
+
+            before = self.phases.get(name, PhaseStats(0, 0.0, 0.0, 0))
+            self.phases[name] = PhaseStats(
+                before.count + 1,
+                before.wall_seconds + wall_seconds,
+                before.cpu_seconds + cpu_seconds,
+                max(before.peak_memory_bytes, active.peak_memory_bytes))
+
+    def report(self) -> Dict[str, Any]:
+        """集計結果を、JSONに変換できる辞書として返します。
+
+        Returns:
+            Dict[str, Any]: フェーズ名ごとの集計結果。
+        """
+        return {name: stats._asdict() for name, stats in self.phases.items()}
+
+    def save(self, path: str | os.PathLike) -> None:
+        """集計結果をJSONで書き込みます。 cProfileの統計は、フェーズごとに`<path>.<フェーズ名>.pstats`に書き込みます。
+        計測していない場合は何もしません。
+
+        Args:
+            path (str | os.PathLike): 書き込むファイルのパス。
+        """
+        if not self.enabled:
+            return
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=4)
+
+        path = pathlib.Path(path)
+        for name, stats in self.stats.items():
+            stats.dump_stats(path.with_name(f"{path.name}.{name}.pstats"))
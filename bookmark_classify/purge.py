@@ -0,0 +1,212 @@
+"""キャッシュから解除するブックマークを選び、まとめて解除してから、一覧のページ単位で確認するモジュール
+
+`bookmark_classify.bookmark_delete`は、解除するたびにブックマークの詳細を取得して確認します。
+`purge_bookmarks`は、解除するブックマークを全て解除してから、それらを含んでいた一覧のページだけを取得し直し、
+1回のリクエストで1ページ(30件)ずつまとめて確認します。
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Set, Tuple
+
+from .backend import BookmarkBackend
+from .bookmark_cache import BookmarkCache
+from .bookmark_classify import (decision_fingerprint, get_api_error, is_ratelimit_error,
+                                should_delete_bookmark)
+from .bookmark_store import BookmarkStore
+from .exceptions import BookmarkDeleteRateLimited, RequestTimedOut
+from .get_bookmarks import iter_bookmarks_pages
+from .illust import Illust
+from .journal import ProgressJournal
+from .metrics import RunMetrics
+from .rate_limiter import RateLimiter
+from .retry_queue import DeadLetter, RetryQueue
+from .tag_rules import TagRules
+from .utils import PreferredTag, Restrict
+
+
+async def find_remaining_bookmarks(
+    api: BookmarkBackend,
+    user_id: int | str,
+    bookmark_cache: BookmarkCache,
+    illust_ids: Iterable[int],
+    restrict: Restrict = "public",
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    rate_limiter: RateLimiter | None = None,
+    metrics: RunMetrics | None = None
+) -> Set[int]:
+    """`illust_ids`のうち、まだブックマークされているものを、キャッシュに保存されていた一覧のページを取得し直して調べます。
+
+    一覧のページは、キャッシュに記録したクエリ(`BookmarkCache.find_page_cursor`)から取得し直します。
+    ブックマークが解除されると後ろのブックマークが前に詰まるため、ページの先頭から元の位置までの件数を取得すれば、
+    解除されずに残っているブックマークは必ず見つかります。
+
+    Args:
+        bookmark_cache (BookmarkCache): `illust_ids`を含む一覧を保存しているキャッシュ。
+        illust_ids (Iterable[int]): 調べるイラストのID。
+        restrict (Restrict, optional): 一覧のプライバシー設定。 デフォルトは`"public"`です。
+        tag (str | None, optional): キャッシュの一覧を取得したときに、絞り込んだタグ。 デフォルトは`None`です。
+        api, user_id, interval_seconds, rate_limiter, metricsについては、
+        `get_bookmarks.get_all_bookmarks_illust`を参照してください。
+
+    Returns:
+        Set[int]: まだブックマークされているイラストのID。
+    """
+    # 取得し直すページの先頭の位置ごとに、調べるイラストの位置をまとめる
+    pages: Dict[int, Tuple[Dict[str, Any] | None, Dict[int, int]]] = {}
+    for illust_id in illust_ids:
+        position = bookmark_cache.get_position(restrict, illust_id)
+        if position is None:
+            continue
+        start, qs = bookmark_cache.find_page_cursor(restrict, position)
+        pages.setdefault(start, (qs, {}))[1][illust_id] = position
+
+    remaining: Set[int] = set()
+    for i, start in enumerate(sorted(pages)):
+        if (0 < i) and (rate_limiter is None):
+            await asyncio.sleep(interval_seconds)
+            if metrics is not None:
+                metrics.on_sleep(interval_seconds)
+
+        qs, positions = pages[start]
+        found: Set[int] = set()
+        needed = max(positions.values()) - start + 1
+        fetched = 0
+        pages_iter = iter_bookmarks_pages(
+            api, user_id, restrict, tag, interval_seconds, rate_limiter, metrics, qs)
+        try:
+            async for page in pages_iter:
+                found.update(illust.id for illust in page.illusts if illust.id in positions)
+                fetched += len(page.illusts)
+                if (needed <= fetched) or (len(found) == len(positions)):
+                    break
+        finally:
+            await pages_iter.aclose()
+        remaining |= found
+
+    return remaining
+
+
+async def purge_bookmarks(
+    api: BookmarkBackend,
+    user_id: int | str,
+    bookmark_cache: BookmarkCache,
+    restrict: Restrict = "public",
+    tag_rules: TagRules | None = None,
+    preferred_tags: PreferredTag = "bookmark",
+    delete_if_unknown: bool = False,
+    tag: str | None = None,
+    interval_seconds: int = 5,
+    on_success: Callable[[int, Illust], Awaitable[None]] | None = None,
+    rate_limiter: RateLimiter | None = None,
+    bookmark_store: BookmarkStore | None = None,
+    journal: ProgressJournal | None = None,
+    retry_queue: RetryQueue | None = None,
+    metrics: RunMetrics | None = None,
+    max_retries: int = 5,
+    backoff_seconds: float = 60
+) -> None:
+    """キャッシュの一覧から、解除するブックマーク(`bookmark_classify.should_delete_bookmark`)を全て選んで解除します。
+
+    解除ごとには確認せず、全て解除してから`find_remaining_bookmarks`でまとめて確認します。
+    期限を過ぎた解除のリクエスト(`exceptions.RequestTimedOut`)も、反映されたかをまとめて確認します。
+    解除が反映されていないブックマークは、レート制限で無視されたものとして、
+    `rate_limiter`に通知して(`rate_limiter`がない場合は`backoff_seconds`秒から倍々に待って)から、もう一度解除します。
+    `max_retries`回やり直しても残っているものは、`retry_queue.dead_letters`に記録します。
+
+    Args:
+        bookmark_cache (BookmarkCache): 全てのページの取得が完了した一覧を保存しているキャッシュ。
+        restrict (Restrict, optional): 解除するブックマークのプライバシー設定。 デフォルトは`"public"`です。
+        tag (str | None, optional): キャッシュの一覧を取得したときに、絞り込んだタグ。 デフォルトは`None`です。
+        max_retries (int, optional): 解除をやり直す回数の上限。 デフォルトは`5`です。
+        backoff_seconds (float, optional): 最初にやり直すまでに待つ時間。 秒単位で指定してください。
+        デフォルトは`60`です。
+        api, user_id, tag_rules, preferred_tags, delete_if_unknown, interval_seconds, on_success,
+        rate_limiter, bookmark_store, journal, retry_queue, metricsについては、
+        `bookmark_classify.bookmarks_classify`を参照してください。
+    """
+    candidates: Dict[int, Illust] = {}
+    fingerprints: Dict[int, str] = {}
+    for illust in bookmark_cache.iter_illusts(restrict):
+        if not should_delete_bookmark(illust, tag_rules, delete_if_unknown):
+            continue
+        fingerprint = decision_fingerprint(illust, tag_rules, preferred_tags, delete_if_unknown)
+        if (journal is not None) and journal.is_done(illust.id, fingerprint):
+            continue
+        candidates[illust.id] = illust
+        fingerprints[illust.id] = fingerprint
+    if not candidates:
+        return
+
+    delete_api = api
+    if metrics is not None:
+        delete_api = metrics.wrap(delete_api)
+    if rate_limiter is not None:
+        delete_api = rate_limiter.wrap(delete_api)
+
+    processed = 0
+    pending = list(candidates)
+    for attempt in range(max_retries + 1):
+        for illust_id in pending:
+            try:
+                json_result = await delete_api.illust_bookmark_delete(illust_id)
+            except RequestTimedOut:
+                # 解除が反映されたかは後でまとめて確認するため、レート制限とは別に扱って次に進む
+                json_result = None
+            if rate_limiter is not None:
+                if json_result is None:
+                    continue
+                # 解除が無視されたかは後でまとめて確認するため、ここでは流量だけを調整する
+                error = get_api_error(json_result)
+                if (error is not None) and is_ratelimit_error(error):
+                    rate_limiter.on_ratelimited()
+                else:
+                    rate_limiter.on_success()
+            else:
+                await asyncio.sleep(interval_seconds)
+                if metrics is not None:
+                    metrics.on_sleep(interval_seconds)
+
+        remaining = await find_remaining_bookmarks(
+            api, user_id, bookmark_cache, pending, restrict, tag,
+            interval_seconds, rate_limiter, metrics)
+
+        for illust_id in pending:
+            if illust_id in remaining:
+                continue
+            if bookmark_store is not None:
+                bookmark_store.delete(illust_id)
+            if journal is not None:
+                journal.record(illust_id, "deleted", fingerprints[illust_id])
+            if metrics is not None:
+                metrics.on_success()
+            if on_success is not None:
+                await on_success(processed, candidates[illust_id])
+            processed += 1
+
+        pending = [illust_id for illust_id in pending if illust_id in remaining]
+        if not pending:
+            break
+
+        # 解除が反映されていないものは、レート制限で無視されたとみなす
+        ratelimited = BookmarkDeleteRateLimited(pending[0])
+        if metrics is not None:
+            metrics.on_ratelimited(ratelimited)
+        if attempt == max_retries:
+            break
+        if rate_limiter is not None:
+            rate_limiter.on_ratelimited()
+        else:
+            wait_seconds = backoff_seconds * 2 ** attempt
+            await asyncio.sleep(wait_seconds)
+            if metrics is not None:
+                metrics.on_sleep(wait_seconds)
+
+    if retry_queue is not None:
+        for illust_id in pending:
+            retry_queue.dead_letters.append(DeadLetter(
+                illust_id, BookmarkDeleteRateLimited.endpoint, max_retries + 1,
+                str(BookmarkDeleteRateLimited(illust_id))))
+
+    if journal is not None:
+        journal.commit()
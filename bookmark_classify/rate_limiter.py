@@ -0,0 +1,255 @@
+"""pixivのAPIへのリクエスト間隔を制御するモジュール"""
+
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any
+
+from pixivpy_async import AppPixivAPI
+
+THROTTLED_ENDPOINTS = frozenset({
+    "user_bookmarks_illust",
+    "illust_bookmark_detail",
+    "illust_bookmark_add",
+    "illust_bookmark_delete",
+    # `backend.BatchBookmarkBackend`のメソッド
+    "list_bookmark_ids",
+    "add_bookmark_tags",
+    "remove_bookmark_tags",
+    "edit_bookmark_restrict",
+    "remove_bookmarks",
+})
+
+
+class RateLimiter(ABC):
+    """レートリミッターの基本クラス。 サブクラスは`acquire`と`expected_rate`を実装してください。
+
+    `acquire`で、APIへのリクエスト1回分の許可を待ちます。
+    処理結果は`on_success`, `on_ratelimited`で通知し、以降の間隔の調整に使います。
+
+    Attributes:
+        waited_seconds (float): `ThrottledAPI`が許可を待った時間の合計。
+    """
+    waited_seconds: float = 0.0
+
+    @abstractmethod
+    async def acquire(self) -> None:
+        """リクエスト1回分の許可が得られるまで待ちます。"""
+        ...
+
+    @property
+    @abstractmethod
+    def expected_rate(self) -> float:
+        """現在の設定で見込まれる、1秒あたりのリクエスト数。"""
+        ...
+
+    def on_success(self) -> None:
+        """処理が成功したことを通知します。"""
+        pass
+
+    def on_ratelimited(self, pause: bool = True) -> None:
+        """レート制限が発生したことを通知します。
+
+        Args:
+            pause (bool, optional): 全てのリクエストを一定時間止めるか。
+            `False`の場合は以降の間隔の調整だけを行い、止めるかどうかは呼び出し側に任せます。 デフォルトは`True`です。
+        """
+        pass
+
+    def save(self) -> None:
+        """状態を保存します。 保存先がない場合は何もしません。"""
+        pass
+
+    def wrap(self, api: AppPixivAPI) -> "ThrottledAPI":
+        """`api`のリクエストを、このレートリミッターで制御するラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            ThrottledAPI: `api`のラッパー。
+        """
+        return ThrottledAPI(api, self)
+
+
+class ThrottledAPI():
+    """`THROTTLED_ENDPOINTS`の呼び出し前に、`RateLimiter.acquire`を待つAppPixivAPIのラッパー。
+    それ以外の属性は、そのまま`api`のものを返します。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        rate_limiter (RateLimiter): リクエストを制御するレートリミッター。
+    """
+
+    def __init__(self, api: AppPixivAPI, rate_limiter: RateLimiter) -> None:
+        self._api = api
+        self.rate_limiter = rate_limiter
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in THROTTLED_ENDPOINTS:
+            return attr
+
+        async def _throttled(*args, **kwargs):
+            started = time.monotonic()
+            await self.rate_limiter.acquire()
+            self.rate_limiter.waited_seconds += time.monotonic() - started
+            return await attr(*args, **kwargs)
+
+        return _throttled
+
+
+class FixedIntervalRateLimiter(RateLimiter):
+    """一定の間隔でリクエストを許可し、レート制限が発生した場合は一定時間止めるレートリミッター。
+
+    Args:
+        interval_seconds (float, optional): リクエストの間隔。 秒単位で指定してください。 デフォルトは`5`です。
+        cooldown_seconds (float, optional): レート制限が発生した場合に止める時間。 秒単位で指定してください。
+        デフォルトは`600`です。
+    """
+
+    def __init__(self, interval_seconds: float = 5, cooldown_seconds: float = 600) -> None:
+        self.interval_seconds = interval_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def expected_rate(self) -> float:
+        return 1 / self.interval_seconds
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            wait = self._next_at - time.monotonic()
+            if 0 < wait:
+                await asyncio.sleep(wait)
+            self._next_at = time.monotonic() + self.interval_seconds
+
+    def on_ratelimited(self, pause: bool = True) -> None:
+        if pause:
+            self._next_at = max(self._next_at, time.monotonic() + self.cooldown_seconds)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """AIMDで流量を調整する、トークンバケット方式のレートリミッター。
+
+    処理が成功する度に`rate`を`increase`ずつ上げ、レート制限が発生した場合は`rate`に`decrease`を掛けて下げます。
+    レート制限が発生した場合は`cooldown_seconds`だけリクエストを止め、その後のリクエストで回復したかを確かめます。
+    連続してレート制限が発生した場合、止める時間は`max_cooldown_seconds`まで倍々に伸びます。
+
+    `state_path`を指定した場合、学習した`rate`とレート制限の解除予定時刻を保存し、次回の起動時に引き継ぎます。
+
+    Args:
+        rate (float, optional): 1秒あたりのリクエスト数の初期値。 デフォルトは`0.5`です。
+        min_rate (float, optional): `rate`の下限。 デフォルトは`0.05`です。
+        max_rate (float, optional): `rate`の上限。 デフォルトは`2.0`です。
+        increase (float, optional): 処理が成功した場合に`rate`に足す値。 デフォルトは`0.01`です。
+        decrease (float, optional): レート制限が発生した場合に`rate`に掛ける値。 デフォルトは`0.5`です。
+        burst (float, optional): バケットに貯められるトークンの数。 デフォルトは`1`です。
+        cooldown_seconds (float, optional): レート制限が発生した場合に止める時間の初期値。 デフォルトは`60`です。
+        max_cooldown_seconds (float, optional): レート制限が発生した場合に止める時間の上限。 デフォルトは`600`です。
+        state_path (str | os.PathLike | None, optional): 状態を保存するファイルのパス。 デフォルトは`None`です。
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.5,
+        min_rate: float = 0.05,
+        max_rate: float = 2.0,
+        increase: float = 0.01,
+        decrease: float = 0.5,
+        burst: float = 1,
+        cooldown_seconds: float = 60,
+        max_cooldown_seconds: float = 600,
+        state_path: str | os.PathLike | None = None
+    ) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.state_path = state_path
+
+        # 保存/復元するため、解除予定時刻はUNIX時間で持つ
+        self.cooldown_until = 0.0
+        self.consecutive_ratelimits = 0
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        if state_path is not None:
+            self.load()
+
+    @property
+    def expected_rate(self) -> float:
+        return self.rate
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                wait = self.cooldown_until - time.time()
+                if 0 < wait:
+                    await asyncio.sleep(wait)
+                    continue
+
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if 1 <= self._tokens:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        self.consecutive_ratelimits = 0
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_ratelimited(self, pause: bool = True) -> None:
+        # 止めている最中に届いた通知は、同じレート制限によるものとして扱う
+        if time.time() < self.cooldown_until:
+            return
+
+        if not pause:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.save()
+            return
+
+        cooldown = min(
+            self.max_cooldown_seconds,
+            self.cooldown_seconds * 2 ** self.consecutive_ratelimits)
+        self.consecutive_ratelimits += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.cooldown_until = time.time() + cooldown
+        self._tokens = 0
+        self.save()
+
+    def load(self) -> None:
+        """`state_path`から状態を読み込みます。 ファイルが読み込めない場合は何もしません。"""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.rate = min(self.max_rate, max(self.min_rate, state.get("rate", self.rate)))
+        self.cooldown_until = state.get("cooldown_until", self.cooldown_until)
+        self.consecutive_ratelimits = state.get(
+            "consecutive_ratelimits", self.consecutive_ratelimits)
+
+    def save(self) -> None:
+        if self.state_path is None:
+            return
+
+        state = {
+            "rate": self.rate,
+            "cooldown_until": self.cooldown_until,
+            "consecutive_ratelimits": self.consecutive_ratelimits
+        }
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,276 @@
+"""レート制限が発生した処理を、APIごとの待ち時間の後にやり直すためのキューのモジュール"""
+
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Any, Dict, List, NamedTuple
+
+from pixivpy_async import AppPixivAPI
+
+from .exceptions import (BookmarkAddFailed, CoolingDown, RateLimited, RequestTimedOut,
+                         TagRejected)
+
+RETRIED_ENDPOINTS = frozenset({
+    "illust_bookmark_detail",
+    "illust_bookmark_add",
+    "illust_bookmark_delete",
+})
+
+
+class RetryEntry(NamedTuple):
+    """やり直しを待っている処理。
+
+    Attributes:
+        ready_at (float): やり直せるようになる時刻。 `time.monotonic`の値です。
+        index (int): アイテムのインデックス。
+        item (Any): 処理するアイテム。
+        attempts (int): これまでにレート制限で失敗した回数。
+        endpoint (str | None): 最後にレート制限が発生したAPIの名前。
+        verify (bool): 書き込みの確認を省略せずにやり直すか。
+    """
+    ready_at: float
+    index: int
+    item: Any
+    attempts: int
+    endpoint: str | None
+    verify: bool
+
+
+class DeadLetter(NamedTuple):
+    """やり直しの回数の上限に達し、諦めた処理。
+
+    Attributes:
+        illust_id (int): イラストのID。
+        endpoint (str | None): 最後にレート制限が発生したAPIの名前。
+        attempts (int): レート制限で失敗した回数。
+        reason (str): 最後に発生した例外のメッセージ。
+    """
+    illust_id: int
+    endpoint: str | None
+    attempts: int
+    reason: str
+
+
+class Rejection(NamedTuple):
+    """pixivに拒否されたため、やり直さずに諦めた処理。
+
+    Attributes:
+        illust_id (int): イラストのID。
+        tags (List[str]): 保存されなかったタグ名のリスト。 分からない場合は空です。
+        reason (str): 発生した例外のメッセージ。
+    """
+    illust_id: int
+    tags: List[str]
+    reason: str
+
+
+class RetryQueue():
+    """レート制限が発生した処理を、APIごとの待ち時間の後にやり直すためのキュー。
+
+    レート制限が発生したAPIは`cooldown_seconds`だけ止め、その間に同じAPIを呼び出した処理は
+    リクエストを送らずに`exceptions.CoolingDown`で失敗させ、待ち時間の後にやり直します。
+    他のAPIだけを使う処理は止めないため、例えばブックマークの追加を止めている間も、解除は進められます。
+    同じAPIで連続してレート制限が発生した場合、待ち時間は`max_cooldown_seconds`まで倍々に伸びます。
+
+    `max_retries`回やり直しても失敗した処理は、`dead_letters`に記録して諦めます。
+    タグが拒否されたなど、やり直しても結果が変わらない処理は、キューに入れずに`rejections`に記録します。
+
+    Args:
+        max_retries (int, optional): 1つの処理をやり直す回数の上限。 デフォルトは`5`です。
+        cooldown_seconds (float, optional): レート制限が発生した場合に、APIを止める時間の初期値。
+        秒単位で指定してください。 デフォルトは`60`です。
+        max_cooldown_seconds (float, optional): APIを止める時間の上限。 秒単位で指定してください。
+        デフォルトは`600`です。
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        cooldown_seconds: float = 60,
+        max_cooldown_seconds: float = 600
+    ) -> None:
+        self.max_retries = max_retries
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.dead_letters: List[DeadLetter] = []
+        self.rejections: List[Rejection] = []
+
+        # APIの名前ごとの、止めている期限と連続してレート制限が発生した回数
+        # どのAPIか分からないレート制限は`None`に記録し、全てのAPIを止める
+        self.cooldown_until: Dict[str | None, float] = {}
+        self.consecutive_ratelimits: Dict[str | None, int] = {}
+
+        # 同じ時刻のエントリーを、追加した順に取り出すためのカウンター
+        self._counter = itertools.count()
+        self._heap: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def cooldown_remaining(self, endpoint: str | None) -> float:
+        """`endpoint`を止めている残りの時間を返します。
+
+        Args:
+            endpoint (str | None): APIの名前。
+
+        Returns:
+            float: 残りの時間。 止めていない場合は`0`です。
+        """
+        until = max(self.cooldown_until.get(endpoint, 0.0), self.cooldown_until.get(None, 0.0))
+        return max(until - time.monotonic(), 0.0)
+
+    def on_ratelimited(self, endpoint: str | None) -> bool:
+        """`endpoint`でレート制限が発生したことを通知し、APIを止めます。
+        既に止めている最中に届いた通知は、同じレート制限によるものとして扱います。
+
+        Args:
+            endpoint (str | None): レート制限が発生したAPIの名前。
+
+        Returns:
+            bool: 新しくAPIを止めた場合は`True`。 既に止めていた場合は`False`です。
+        """
+        now = time.monotonic()
+        if now < self.cooldown_until.get(endpoint, 0.0):
+            return False
+
+        consecutive = self.consecutive_ratelimits.get(endpoint, 0)
+        cooldown = min(self.max_cooldown_seconds, self.cooldown_seconds * 2 ** consecutive)
+        self.consecutive_ratelimits[endpoint] = consecutive + 1
+        self.cooldown_until[endpoint] = now + cooldown
+        return True
+
+    def on_success(self, endpoint: str | None) -> None:
+        """以前にレート制限が発生した処理が、成功したことを通知します。
+
+        Args:
+            endpoint (str | None): 以前にレート制限が発生したAPIの名前。
+        """
+        self.consecutive_ratelimits.pop(endpoint, None)
+
+    def push(
+        self,
+        index: int,
+        item: Any,
+        attempts: int,
+        exception: RateLimited | RequestTimedOut | BookmarkAddFailed,
+        verify: bool = False
+    ) -> bool:
+        """処理を、`exception`が発生したAPIの待ち時間の後にやり直すように追加します。
+        期限を過ぎたリクエスト(`RequestTimedOut`)や、レート制限以外のエラー(`BookmarkAddFailed`)はAPIを止めないため、
+        止めていなければすぐにやり直せます。
+
+        Args:
+            index (int): アイテムのインデックス。
+            item (Any): 処理するアイテム。 `id`(イラストのID)を持つ必要があります。
+            attempts (int): これまでにレート制限もしくはタイムアウトで失敗した回数。 今回の失敗を含みます。
+            exception (RateLimited | RequestTimedOut | BookmarkAddFailed): 発生した例外。
+            verify (bool, optional): 書き込みの確認を省略せずにやり直すか。 デフォルトは`False`です。
+
+        Returns:
+            bool: 追加した場合は`True`。 やり直しの回数の上限に達した場合は`dead_letters`に記録し、`False`を返します。
+        """
+        endpoint = exception.endpoint
+        if self.max_retries < attempts:
+            self.dead_letters.append(DeadLetter(item.id, endpoint, attempts, str(exception)))
+            return False
+
+        ready_at = time.monotonic() + self.cooldown_remaining(endpoint)
+        entry = RetryEntry(ready_at, index, item, attempts, endpoint, verify)
+        heapq.heappush(self._heap, (ready_at, next(self._counter), entry))
+        return True
+
+    def reject(self, item: Any, exception: TagRejected) -> None:
+        """やり直しても結果が変わらない処理を、`rejections`に記録します。
+
+        Args:
+            item (Any): 処理したアイテム。 `id`(イラストのID)を持つ必要があります。
+            exception (TagRejected): 発生した例外。
+        """
+        self.rejections.append(Rejection(item.id, exception.tags, str(exception)))
+
+    def pop_ready(self) -> List[RetryEntry]:
+        """やり直せるようになった処理を、全て取り出します。
+
+        Returns:
+            List[RetryEntry]: やり直せるようになった処理。
+        """
+        now = time.monotonic()
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            ready.append(heapq.heappop(self._heap)[2])
+        return ready
+
+    def wait_seconds(self) -> float | None:
+        """次の処理がやり直せるようになるまでの時間を返します。
+
+        Returns:
+            float | None: 次の処理がやり直せるようになるまでの時間。 キューが空の場合は`None`です。
+        """
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - time.monotonic(), 0.0)
+
+    def save_dead_letters(self, path: str | os.PathLike) -> None:
+        """`dead_letters`をファイルに書き込みます。 記録がない場合は何もしません。
+
+        Args:
+            path (str | os.PathLike): 書き込むファイルのパス。
+        """
+        if not self.dead_letters:
+            return
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([dead_letter._asdict() for dead_letter in self.dead_letters],
+                      f, ensure_ascii=False, indent=4)
+
+    def save_rejections(self, path: str | os.PathLike) -> None:
+        """`rejections`をファイルに書き込みます。 記録がない場合は何もしません。
+
+        Args:
+            path (str | os.PathLike): 書き込むファイルのパス。
+        """
+        if not self.rejections:
+            return
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([rejection._asdict() for rejection in self.rejections],
+                      f, ensure_ascii=False, indent=4)
+
+    def wrap(self, api: AppPixivAPI) -> "CooldownAPI":
+        """`api`の止めているAPIの呼び出しを、リクエストを送らずに失敗させるラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            CooldownAPI: `api`のラッパー。
+        """
+        return CooldownAPI(api, self)
+
+
+class CooldownAPI():
+    """`RetryQueue`が止めているAPIを呼び出した場合に、`exceptions.CoolingDown`を送出するAppPixivAPIのラッパー。
+    それ以外の属性は、そのまま`api`のものを返します。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        retry_queue (RetryQueue): APIを止めているかを管理するキュー。
+    """
+
+    def __init__(self, api: AppPixivAPI, retry_queue: RetryQueue) -> None:
+        self._api = api
+        self.retry_queue = retry_queue
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in RETRIED_ENDPOINTS:
+            return attr
+
+        async def _cooldown(illust_id, *args, **kwargs):
+            if 0 < self.retry_queue.cooldown_remaining(name):
+                raise CoolingDown(illust_id, name)
+            return await attr(illust_id, *args, **kwargs)
+
+        return _cooldown
@@ -0,0 +1,167 @@
+"""数日にわたる実行のために、ログイン状態とHTTPの接続を管理するモジュール"""
+
+import asyncio
+import time
+from typing import Any
+
+import aiohttp
+from pixivpy_async import AppPixivAPI
+
+from .rate_limiter import THROTTLED_ENDPOINTS
+
+# レスポンスに有効期限が含まれない場合に使う、アクセストークンの有効期限(秒)
+DEFAULT_EXPIRES_SECONDS = 3600
+
+
+def create_client_session(
+    limit: int = 8,
+    timeout_seconds: float = 30,
+    keepalive_seconds: float = 60
+) -> aiohttp.ClientSession:
+    """実行中に使い回す、keep-aliveの接続プールを持つセッションを作ります。
+    `AppPixivAPI(client=...)`に渡すと、リクエスト毎の接続の確立を省けます。
+    使い終わったら`close`を呼び出してください。 実行中のイベントループの中で呼び出す必要があります。
+
+    pixivpy_asyncは`client`を指定しない場合、リクエスト毎にセッションを作り直すため、
+    TCPとTLSのハンドシェイクが毎回発生します。
+
+    Args:
+        limit (int, optional): 同じホストへの同時接続数の上限。 デフォルトは`8`です。
+        timeout_seconds (float, optional): 1回のリクエストのタイムアウト。 秒単位で指定してください。
+        デフォルトは`30`です。
+        keepalive_seconds (float, optional): 使っていない接続を残しておく時間。 秒単位で指定してください。
+        デフォルトは`60`です。
+
+    Returns:
+        aiohttp.ClientSession: 作ったセッション。
+    """
+    connector = aiohttp.TCPConnector(
+        limit_per_host=limit,
+        keepalive_timeout=keepalive_seconds,
+        ttl_dns_cache=300)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout_seconds))
+
+
+class TokenManager():
+    """アクセストークンの有効期限を管理し、期限が切れる前に更新するクラス。
+
+    `wrap`で包んだAPIを呼び出した時点で、有効期限まで`refresh_margin_seconds`を切っていれば、
+    裏で更新を始めて、呼び出しは今のトークンのまま続けます。 期限が切れている場合だけ、更新を待ちます。
+    期限の切れたトークンでのリクエストは、レート制限と見分けがつかないため、これを避けるために使います。
+
+    Args:
+        api (AppPixivAPI): ログインするAppPixivAPIのインスタンス。
+        refresh_token (str): リフレッシュトークン。
+        refresh_margin_seconds (float, optional): 有効期限の何秒前に更新するか。 デフォルトは`300`です。
+    """
+
+    def __init__(
+        self,
+        api: AppPixivAPI,
+        refresh_token: str,
+        refresh_margin_seconds: float = 300
+    ) -> None:
+        self.api = api
+        self.refresh_token = refresh_token
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self.last_error: Exception | None = None
+
+        self._refreshing: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def expires_in_seconds(self) -> float:
+        """アクセストークンの有効期限までの残りの時間。"""
+        return self.expires_at - time.monotonic()
+
+    async def login(self) -> None:
+        """リフレッシュトークンでログインし、アクセストークンと有効期限を更新します。
+
+        Raises:
+            Exception: ログインに失敗した場合に、pixivpy_asyncが送出する例外。
+        """
+        async with self._lock:
+            await self._login()
+
+    async def _login(self) -> None:
+        requested_at = time.monotonic()
+        token = await self.api.login(refresh_token=self.refresh_token)
+        expires_in = DEFAULT_EXPIRES_SECONDS
+        try:
+            expires_in = token.response.expires_in or expires_in
+        except AttributeError:
+            pass
+        # リクエストを送った時刻から数え、有効期限を短めに見積もる
+        self.expires_at = requested_at + expires_in
+        # リフレッシュトークンが更新された場合は、新しいものを使う
+        self.refresh_token = self.api.refresh_token or self.refresh_token
+        self.refreshes += 1
+        self.last_error = None
+
+    async def _refresh(self) -> None:
+        try:
+            await self.login()
+        except Exception as e:
+            # 次の呼び出しで、もう一度更新を試みる
+            self.last_error = e
+
+    async def ensure_fresh(self) -> None:
+        """アクセストークンの有効期限が近い場合に、更新します。
+        期限が切れている場合は更新を待ち、それ以外の場合は裏で更新を始めてすぐに戻ります。
+
+        Raises:
+            Exception: 期限が切れているトークンの更新に失敗した場合に、pixivpy_asyncが送出する例外。
+        """
+        remaining = self.expires_in_seconds
+        if self.refresh_margin_seconds < remaining:
+            return
+
+        if 0 < remaining:
+            if (self._refreshing is None) or self._refreshing.done():
+                self._refreshing = asyncio.create_task(self._refresh())
+            return
+
+        # 更新中の場合は終わるまで待ち、同時に呼び出された場合も更新は1回だけ行う
+        async with self._lock:
+            if self.expires_in_seconds <= 0:
+                await self._login()
+
+    def wrap(self, api: AppPixivAPI) -> "AuthenticatedAPI":
+        """`api`の呼び出し前に、アクセストークンの有効期限を確かめるラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            AuthenticatedAPI: `api`のラッパー。
+        """
+        return AuthenticatedAPI(api, self)
+
+
+class AuthenticatedAPI():
+    """`THROTTLED_ENDPOINTS`の呼び出し前に、`TokenManager.ensure_fresh`を待つAppPixivAPIのラッパー。
+    それ以外の属性は、そのまま`api`のものを返します。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        token_manager (TokenManager): アクセストークンを管理するインスタンス。
+    """
+
+    def __init__(self, api: AppPixivAPI, token_manager: TokenManager) -> None:
+        self._api = api
+        self.token_manager = token_manager
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in THROTTLED_ENDPOINTS:
+            return attr
+
+        async def _authenticated(*args, **kwargs):
+            await self.token_manager.ensure_fresh()
+            return await attr(*args, **kwargs)
+
+        return _authenticated
@@ -0,0 +1,63 @@
+"""ブックマーク全体でのタグの出現数を数え、多くのブックマークをまとめられるタグを選ぶためのモジュール"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+
+class TagFrequencyIndex():
+    """ブックマーク全体で、各タグが付いている(付く予定の)ブックマークの数を数えるインデックス。
+
+    まだ編集していないブックマークには、除外対象を取り除いたイラストのタグが付く予定として数えます。
+    編集が反映されたら`update`で通知してください。 予定のタグとの差分だけを数え直すため、
+    ブックマーク全体を数え直す必要はありません。 同じイラストを何度通知しても、数は二重になりません。
+
+    タグは`TAGS_LIMIT`を超えた場合の選択に使い、多くのブックマークに付いているタグほど優先します。
+    ブックマークのタグで絞り込んだ取得(`tag=`)で、まとまった数のブックマークが得られるようになります。
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        # 予定のタグと異なるタグが付いた、イラストのIDとタグ
+        self._tags: Dict[int, Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __getitem__(self, tag: str) -> int:
+        return self.counts[tag]
+
+    def add(self, tags: Iterable[str]) -> None:
+        """まだ編集していない1つのブックマークに付く予定のタグを数えます。
+
+        Args:
+            tags (Iterable[str]): 除外対象を取り除いた、イラストのタグ名のイテラブル。
+        """
+        self.counts.update(set(tags))
+
+    def update(self, illust_id: int, illust_tags: Iterable[str], tags: Iterable[str]) -> None:
+        """ブックマークの編集が反映されたことを通知し、付く予定だったタグとの差分を数え直します。
+
+        Args:
+            illust_id (int): イラストのID。
+            illust_tags (Iterable[str]): `add`で数えた、除外対象を取り除いたイラストのタグ名のイテラブル。
+            tags (Iterable[str]): 編集後のブックマークのタグ名のイテラブル。
+        """
+        before = set(self._tags.get(illust_id, illust_tags))
+        after = set(tags)
+        self.counts.update(after - before)
+        self.counts.subtract(before - after)
+        self._tags[illust_id] = tuple(after)
+
+    def rank(self, tags: List[str], limit: int) -> List[str]:
+        """`tags`から、多くのブックマークに付いているタグを`limit`個選びます。
+        数が同じ場合は、`tags`の前にあるものを優先します。
+
+        Args:
+            tags (List[str]): 候補のタグ名のリスト。 重複を含まない必要があります。
+            limit (int): 選ぶタグの数。
+
+        Returns:
+            List[str]: 選んだタグ名のリスト。
+        """
+        # sortedは安定ソートのため、数が同じタグは元の順番のまま残る
+        return sorted(tags, key=lambda tag: -self.counts[tag])[:limit]
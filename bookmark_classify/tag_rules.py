@@ -0,0 +1,141 @@
+"""タグの評価ルールをまとめたモジュール"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+
+class _Automaton():
+    """複数のパターンのいずれかが文字列に含まれるかを、1回の走査で判定するAho-Corasickオートマトン。"""
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[bool] = [False]
+
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(False)
+                state = next_state
+            self._output[state] = True
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] or \
+                    self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> bool:
+        """`text`に、いずれかのパターンが含まれているかを調べます。
+
+        Args:
+            text (str): 評価する文字列。
+
+        Returns:
+            bool: いずれかのパターンが含まれているか。
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        if output[0]:
+            return True
+
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class TagRules():
+    """設定ファイルの`exclude_tags`, `private_tags`, `delete_tags`を事前にコンパイルしたルール。
+
+    部分一致で評価する`exclude_tags`はAho-Corasickオートマトンに、完全一致で評価する`private_tags`,
+    `delete_tags`はfrozensetに変換します。
+    同じタグ名は多くのイラストで繰り返し現れるため、タグ毎の除外判定はLRUキャッシュで記憶します。
+
+    Args:
+        exclude_tags (List[str] | None, optional): 除外対象のタグのリスト。 部分一致で評価されます。 デフォルトは`None`です。
+        private_tags (List[str] | None, optional): 非公開対象のタグのリスト。 完全一致で評価されます。 デフォルトは`None`です。
+        delete_tags (List[str] | None, optional): 削除対象のタグのリスト。 完全一致で評価されます。 デフォルトは`None`です。
+        cache_size (int, optional): タグ毎の判定結果を記憶する数。 デフォルトは`65536`です。
+    """
+
+    def __init__(
+        self,
+        exclude_tags: List[str] | None = None,
+        private_tags: List[str] | None = None,
+        delete_tags: List[str] | None = None,
+        cache_size: int = 65536
+    ) -> None:
+        self.exclude_tags = tuple(exclude_tags or ())
+        self.private_tags = frozenset(private_tags or ())
+        self.delete_tags = frozenset(delete_tags or ())
+
+        automaton = _Automaton(self.exclude_tags)
+        self._is_excluded = lru_cache(maxsize=cache_size)(automaton.search)
+
+    def is_excluded(self, tag: str) -> bool:
+        """`tag`が`exclude_tags`のいずれかと部分的に一致するかを調べます。
+
+        Args:
+            tag (str): 評価するタグ。
+
+        Returns:
+            bool: `tag`が除外対象か。
+        """
+        if not self.exclude_tags:
+            return False
+        return self._is_excluded(tag)
+
+    def filter_excluded(self, tags: List[str]) -> List[str]:
+        """`tags`から、除外対象のタグを取り除きます。
+
+        Args:
+            tags (List[str]): タグ名のリスト。
+
+        Returns:
+            List[str]: 除外対象のタグを取り除いたタグ名のリスト。
+        """
+        if not self.exclude_tags:
+            return tags
+        return [tag for tag in tags if not self._is_excluded(tag)]
+
+    def is_private(self, tags: Iterable[str]) -> bool:
+        """`tags`に、`private_tags`のいずれかと完全に一致するタグが含まれているかを調べます。
+
+        Args:
+            tags (Iterable[str]): タグ名のリスト。
+
+        Returns:
+            bool: ブックマークを非公開にするべきか。
+        """
+        return not self.private_tags.isdisjoint(tags)
+
+    def is_delete_target(self, tags: Iterable[str]) -> bool:
+        """`tags`に、`delete_tags`のいずれかと完全に一致するタグが含まれているかを調べます。
+
+        Args:
+            tags (Iterable[str]): タグ名のリスト。
+
+        Returns:
+            bool: ブックマークを解除するべきか。
+        """
+        return not self.delete_tags.isdisjoint(tags)
@@ -0,0 +1,106 @@
+"""pixivのAPIへのリクエストに、APIごとの期限を設けるモジュール
+
+pixivpy_asyncの呼び出しには期限がないため、応答のないTCPの接続が1つあるだけで、処理全体が止まり続けます。
+期限を過ぎたリクエストは`exceptions.RequestTimedOut`で失敗させ、呼び出し元でやり直します。
+"""
+
+import asyncio
+from typing import Any, Dict
+
+from pixivpy_async import AppPixivAPI
+
+from .exceptions import RequestTimedOut
+from .rate_limiter import THROTTLED_ENDPOINTS
+
+# APIごとのリクエストの期限(秒)
+# 一覧は1回のレスポンスが大きいため、長めにする
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "user_bookmarks_illust": 60,
+    "illust_bookmark_detail": 30,
+    "illust_bookmark_add": 30,
+    "illust_bookmark_delete": 30,
+}
+
+
+class RequestTimeouts():
+    """APIごとのリクエストの期限。
+
+    `timeouts`に指定しなかったAPIは`DEFAULT_TIMEOUTS`の期限を、
+    それにも含まれないAPIは`default_seconds`を使います。 `0`以下もしくは`None`を指定したAPIには、期限を設けません。
+
+    Args:
+        timeouts (Dict[str, float | None] | None, optional): APIの名前と期限(秒)の辞書。 デフォルトは`None`です。
+        default_seconds (float, optional): 期限を指定していないAPIの期限。 秒単位で指定してください。
+        デフォルトは`30`です。
+    """
+
+    def __init__(
+        self,
+        timeouts: Dict[str, float | None] | None = None,
+        default_seconds: float = 30
+    ) -> None:
+        self.timeouts: Dict[str, float | None] = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.default_seconds = default_seconds
+
+    def get(self, endpoint: str) -> float | None:
+        """`endpoint`のリクエストの期限を返します。
+
+        Args:
+            endpoint (str): APIの名前。
+
+        Returns:
+            float | None: 期限(秒)。 期限を設けない場合は`None`です。
+        """
+        seconds = self.timeouts.get(endpoint, self.default_seconds)
+        if (seconds is None) or (seconds <= 0):
+            return None
+        return seconds
+
+    @property
+    def longest_seconds(self) -> float:
+        """全てのAPIのうち、最も長い期限。 HTTPのセッション全体のタイムアウトを、これより短くしないために使います。"""
+        return max([self.default_seconds] + [
+            seconds for seconds in map(self.get, THROTTLED_ENDPOINTS) if seconds is not None])
+
+    def wrap(self, api: AppPixivAPI) -> "DeadlineAPI":
+        """`api`の呼び出しに期限を設けるラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            DeadlineAPI: `api`のラッパー。
+        """
+        return DeadlineAPI(api, self)
+
+
+class DeadlineAPI():
+    """`THROTTLED_ENDPOINTS`の呼び出しが期限を過ぎた場合に、`exceptions.RequestTimedOut`を送出する
+    AppPixivAPIのラッパー。 それ以外の属性は、そのまま`api`のものを返します。
+
+    HTTPのセッションのタイムアウトによる`asyncio.TimeoutError`も、`exceptions.RequestTimedOut`に置き換えます。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        request_timeouts (RequestTimeouts): APIごとのリクエストの期限。
+    """
+
+    def __init__(self, api: AppPixivAPI, request_timeouts: RequestTimeouts) -> None:
+        self._api = api
+        self.request_timeouts = request_timeouts
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in THROTTLED_ENDPOINTS:
+            return attr
+
+        async def _deadline(*args, **kwargs):
+            timeout_seconds = self.request_timeouts.get(name)
+            try:
+                return await asyncio.wait_for(attr(*args, **kwargs), timeout_seconds)
+            except RequestTimedOut:
+                raise
+            except asyncio.TimeoutError:
+                raise RequestTimedOut(name, timeout_seconds) from None
+
+        return _deadline
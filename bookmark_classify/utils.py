@@ -22,14 +22,18 @@ Example
         restrict_private: Restrict = "private"
 """
 
-from typing import Any, Literal
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Literal, TypeVar
 
-Illust = Any
-IllustTag = Any
 BookmarkTag = Any
 BookmarkDetail = Any
 Restrict = Literal["public", "private"]
-PreferredTag = Literal["illust", "bookmark"]
+PreferredTag = Literal["illust", "bookmark", "frequency"]
+VerifyMode = Literal["always", "sampled", "deferred"]
+PlanAction = Literal["delete", "add", "merge", "skip"]
+BatchAction = Literal["remove", "remove_tags", "add_tags", "edit_restrict"]
+
+T = TypeVar("T")
 
 
 def print_override(string: str) -> None:
@@ -39,3 +43,95 @@ def print_override(string: str) -> None:
         string (str): コンソールに表示する文字列
     """
     print("\r\033[J" + string, end="")
+
+
+async def aiterate(iterable: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    """同期/非同期のどちらのイテラブルも、非同期イテレーターとして扱えるようにします。
+
+    Args:
+        iterable (Iterable[T] | AsyncIterable[T]): イテラブル。
+
+    Yields:
+        T: `iterable`の要素。
+    """
+    if isinstance(iterable, AsyncIterable):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def prefetch(iterable: AsyncIterable[T], size: int = 1) -> AsyncIterator[T]:
+    """`iterable`の次の要素を、バックグラウンドで最大`size`個まで先読みします。
+    先読みした要素はキューに保持されるため、メモリ使用量は`size`に比例します。
+
+    Args:
+        iterable (AsyncIterable[T]): 先読みする非同期イテラブル。
+        size (int, optional): 先読みする要素の最大数。 デフォルトは`1`です。
+
+    Yields:
+        T: `iterable`の要素。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(size, 1))
+    end = object()
+
+    async def _produce():
+        try:
+            async for item in iterable:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((end, e))
+        else:
+            await queue.put((end, None))
+
+    task = asyncio.create_task(_produce())
+    try:
+        while True:
+            item, exception = await queue.get()
+            if item is end:
+                if exception is not None:
+                    raise exception
+                break
+            yield item
+    finally:
+        task.cancel()
+
+
+async def merge(*iterables: Iterable[T] | AsyncIterable[T], size: int = 1) -> AsyncIterator[T]:
+    """複数のイテラブルを並行して読み進め、届いた順に要素を返します。
+    各イテラブルの要素の順番は保たれますが、イテラブル間の順番は保証されません。
+
+    Args:
+        *iterables (Iterable[T] | AsyncIterable[T]): 結合するイテラブル。
+        size (int, optional): 読み進めておく要素の最大数。 デフォルトは`1`です。
+
+    Yields:
+        T: いずれかのイテラブルの要素。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(size, 1))
+    end = object()
+
+    async def _produce(iterable):
+        try:
+            async for item in aiterate(iterable):
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((end, e))
+        else:
+            await queue.put((end, None))
+
+    tasks = [asyncio.create_task(_produce(iterable)) for iterable in iterables]
+    try:
+        remaining = len(tasks)
+        while 0 < remaining:
+            item, exception = await queue.get()
+            if item is end:
+                if exception is not None:
+                    raise exception
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
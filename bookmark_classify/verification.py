@@ -0,0 +1,171 @@
+"""ブックマークの書き込み後の確認を、いつ行うかを決めるモジュール"""
+
+import random
+from typing import List, NamedTuple
+
+from .exceptions import BookmarkAddRateLimited, BookmarkDeleteRateLimited, RateLimited
+from .utils import Restrict, VerifyMode
+
+
+class PendingWrite(NamedTuple):
+    """まだ確認していない、ブックマークへの書き込み。
+
+    Attributes:
+        illust_id (int): イラストのID。
+        tags (List[str] | None): 書き込んだブックマークのタグ名のリスト。 削除の場合は`None`です。
+        restrict (Restrict | None): 書き込んだブックマークのプライバシー設定。 削除の場合は`None`です。
+        checkpoint (int | None): 書き込みを始める前の`VerificationPolicy.checkpoint`の戻り値。
+        デフォルトは`None`です。
+    """
+    illust_id: int
+    tags: List[str] | None
+    restrict: Restrict | None
+    checkpoint: int | None = None
+
+    @property
+    def is_delete(self) -> bool:
+        return self.tags is None
+
+    def exception(self) -> RateLimited:
+        """確認に失敗した場合に扱う例外を返します。"""
+        if self.is_delete:
+            return BookmarkDeleteRateLimited(self.illust_id)
+        return BookmarkAddRateLimited(self.illust_id)
+
+
+class VerificationPolicy():
+    """書き込み後の`illust_bookmark_detail`による確認を、いつ行うかを決めるポリシー。
+
+    `mode`ごとの動作は次の通りです。
+
+    - `"always"`: 全ての書き込みを、直後に確認します。
+    - `"sampled"`: `every_n`回に1回、もしくは`fraction`の確率で、書き込みの直後に確認します。
+    - `"deferred"`: 書き込みの直後には確認せず、`batch_size`件毎にまとめて確認します。
+
+    確認しなかった書き込みは`pending`に溜められます。 確認に成功した場合、それまでの書き込みも成功したものとして扱います。
+    並行して書き込む場合は、書き込みを始める前に`checkpoint`を呼び、その戻り値を`on_verified`に渡してください。
+    確認した書き込みと同時に行われていた書き込みは、成功したものとして扱わずに残します。
+    確認に失敗した場合、呼び出し側は`on_failed`を呼び、`drain`で前回の確認以降の書き込みを取り出して再確認する必要があります。
+    `on_failed`の後は、確認に成功するまで全ての書き込みを直後に確認します。
+
+    Args:
+        mode (VerifyMode, optional): 確認の方法。 デフォルトは`"always"`です。
+        every_n (int, optional): `"sampled"`の場合に、何回に1回確認するか。 デフォルトは`3`です。
+        fraction (float | None, optional): `"sampled"`の場合に、確認する確率。
+        指定した場合、`every_n`は使われません。 デフォルトは`None`です。
+        batch_size (int, optional): `"deferred"`の場合に、何件毎にまとめて確認するか。 デフォルトは`30`です。
+    """
+
+    def __init__(
+        self,
+        mode: VerifyMode = "always",
+        every_n: int = 3,
+        fraction: float | None = None,
+        batch_size: int = 30
+    ) -> None:
+        self.mode = mode
+        self.every_n = max(every_n, 1)
+        self.fraction = fraction
+        self.batch_size = max(batch_size, 1)
+        self.pending: List[PendingWrite] = []
+        self._writes = 0
+        # これまでに確認を省略した書き込みの数。 `pending`は常にこの末尾の部分になる
+        self._deferred = 0
+        # 確認に失敗してから、まだ確認に成功していないか
+        self._recovering = False
+
+    @property
+    def expected_ratio(self) -> float:
+        """書き込みのうち、確認のリクエストが発生する割合の見込み。"""
+        match self.mode:
+            case "sampled":
+                if self.fraction is not None:
+                    return self.fraction
+                return 1 / self.every_n
+            case "deferred":
+                return 1 / self.batch_size
+            case _:
+                return 1.0
+
+    def should_verify(self) -> bool:
+        """次の書き込みを、直後に確認するべきかを返します。
+
+        Returns:
+            bool: 直後に確認するべきか。
+        """
+        self._writes += 1
+        if self._recovering:
+            return True
+        match self.mode:
+            case "sampled":
+                if self.fraction is not None:
+                    return random.random() < self.fraction
+                return self._writes % self.every_n == 0
+            case "deferred":
+                return False
+            case _:
+                return True
+
+    def defer(self, write: PendingWrite) -> None:
+        """確認しなかった書き込みを記録します。
+
+        Args:
+            write (PendingWrite): 確認しなかった書き込み。
+        """
+        self.pending.append(write)
+        self._deferred += 1
+
+    def checkpoint(self) -> int:
+        """書き込みを始める前に呼び、`on_verified`に渡す値を返します。
+
+        Returns:
+            int: これまでに確認を省略した書き込みの数。
+        """
+        return self._deferred
+
+    def on_verified(
+        self,
+        checkpoint: int | None = None,
+        write: PendingWrite | None = None
+    ) -> None:
+        """確認に成功したことを通知します。 それまでの書き込みも成功したものとして扱います。
+
+        Args:
+            checkpoint (int | None, optional): 確認した書き込みを始める前の`checkpoint`の戻り値。
+            指定した場合、それより前に確認を省略した書き込みだけを成功したものとして扱います。
+            `None`の場合は、全ての書き込みを成功したものとして扱います。 デフォルトは`None`です。
+            write (PendingWrite | None, optional): 確認した書き込みが`pending`にある場合に指定します。
+            デフォルトは`None`です。
+        """
+        self._recovering = False
+        if checkpoint is None:
+            self.pending.clear()
+            return
+
+        del self.pending[:max(checkpoint - (self._deferred - len(self.pending)), 0)]
+        if (write is not None) and (write in self.pending):
+            self.pending.remove(write)
+
+    def on_failed(self) -> None:
+        """確認に失敗した、もしくはレート制限が発生したことを通知します。
+        確認に成功するまで、全ての書き込みを直後に確認するようにします。
+        """
+        self._recovering = True
+
+    def should_flush(self) -> bool:
+        """溜まっている書き込みを、まとめて確認するべきかを返します。
+
+        Returns:
+            bool: まとめて確認するべきか。
+        """
+        return self.mode == "deferred" and self.batch_size <= len(self.pending)
+
+    def drain(self) -> List[PendingWrite]:
+        """前回の確認以降の書き込みを取り出します。
+
+        Returns:
+            List[PendingWrite]: 前回の確認以降の書き込み。
+        """
+        pending = self.pending
+        self.pending = []
+        return pending
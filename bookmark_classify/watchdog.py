@@ -0,0 +1,123 @@
+"""APIのレスポンスが届かなくなった処理を見つけて、中断するモジュール
+
+リクエストの期限(`timeouts.RequestTimeouts`)は、期限を設けたAPIの呼び出しだけを見張ります。
+`StallWatchdog`は、どこで止まったかに関わらず、APIのレスポンスが一定の時間届かなければ処理全体を中断し、
+それまでの進捗を保存させます。
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, TypeVar
+
+from pixivpy_async import AppPixivAPI
+
+from .exceptions import ProgressStalled
+from .rate_limiter import THROTTLED_ENDPOINTS
+
+T = TypeVar("T")
+
+
+class StallWatchdog():
+    """APIのレスポンスが`stall_seconds`秒間届かなかった場合に、`run`で実行している処理を中断するクラス。
+
+    `wrap`で包んだAPIのレスポンスが届くたびに、進捗があったとみなします。
+    期限を過ぎたリクエスト(`asyncio.TimeoutError`)は、進捗に数えません。
+    レート制限で止めている間もレスポンスは届かないため、`stall_seconds`は止める時間の上限(600秒)より長くしてください。
+
+    Args:
+        stall_seconds (float, optional): 処理が止まっていると判断するまでの時間。 秒単位で指定してください。
+        デフォルトは`1800`です。
+    """
+
+    def __init__(self, stall_seconds: float = 1800) -> None:
+        self.stall_seconds = stall_seconds
+        self._progressed_at = time.monotonic()
+
+    @property
+    def idle_seconds(self) -> float:
+        """最後に進捗があってからの時間。"""
+        return time.monotonic() - self._progressed_at
+
+    def on_progress(self) -> None:
+        """進捗があったことを通知します。"""
+        self._progressed_at = time.monotonic()
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """`awaitable`を実行し、その結果を返します。
+        実行中に`stall_seconds`秒間進捗がなかった場合は、`awaitable`をキャンセルします。
+
+        Args:
+            awaitable (Awaitable[T]): 実行する処理。
+
+        Raises:
+            ProgressStalled: 進捗がなかったため、処理をキャンセルした場合に発生する例外。
+
+        Returns:
+            T: `awaitable`の結果。
+        """
+        self.on_progress()
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {task}, timeout=max(self.stall_seconds - self.idle_seconds, 0))
+                if done:
+                    return task.result()
+                if self.stall_seconds <= self.idle_seconds:
+                    break
+
+            idle_seconds = self.idle_seconds
+            # キャンセルされた処理が、それまでの進捗を保存し終わるまで待つ
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            raise ProgressStalled(idle_seconds)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def wrap(self, api: AppPixivAPI) -> "WatchedAPI":
+        """`api`のレスポンスを進捗として通知するラッパーを返します。
+
+        Args:
+            api (AppPixivAPI): AppPixivAPIのインスタンス。
+
+        Returns:
+            WatchedAPI: `api`のラッパー。
+        """
+        return WatchedAPI(api, self)
+
+
+class WatchedAPI():
+    """`THROTTLED_ENDPOINTS`のレスポンスが届くたびに、`StallWatchdog.on_progress`を呼び出すAppPixivAPIのラッパー。
+    それ以外の属性は、そのまま`api`のものを返します。
+
+    Args:
+        api (AppPixivAPI): AppPixivAPIのインスタンス。
+        watchdog (StallWatchdog): 進捗の通知先。
+    """
+
+    def __init__(self, api: AppPixivAPI, watchdog: StallWatchdog) -> None:
+        self._api = api
+        self.watchdog = watchdog
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._api, name)
+        if name not in THROTTLED_ENDPOINTS:
+            return attr
+
+        async def _watched(*args, **kwargs):
+            try:
+                result = await attr(*args, **kwargs)
+            except asyncio.TimeoutError:
+                raise
+            except Exception:
+                # エラーでもレスポンスは届いているため、進捗として数える
+                self.watchdog.on_progress()
+                raise
+            self.watchdog.on_progress()
+            return result
+
+        return _watched
@@ -0,0 +1,207 @@
+"""pixivのWebのAJAX APIで、複数のブックマークをまとめて書き換えるモジュール
+
+アプリ版のAPIは、ブックマークのタグの書き換えや解除をイラスト1つずつしか行えませんが、
+WebのAJAX APIは、複数のブックマークへのタグの追加/削除、プライバシー設定の変更、解除を1回のリクエストで行えます。
+
+ログインには、ブラウザでpixivにログインした際のCookie`PHPSESSID`の値を使います。
+"""
+
+import re
+from typing import Any, Dict, List
+
+import aiohttp
+
+from .backend import BookmarkIdPage
+from .consts import RESTRICT_PUBLIC
+from .exceptions import BatchRateLimited, WebAPIError
+from .utils import Restrict
+
+WEB_BASE_URL = "https://www.pixiv.net"
+WEB_USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+# トップページに埋め込まれている、書き込みに必要なCSRFトークン
+CSRF_TOKEN_PATTERN = re.compile(r'\\?"token\\?":\\?"([0-9a-f]+)\\?"')
+# レート制限の場合に、APIがエラーのメッセージとして返す文字列
+RATELIMIT_MESSAGES = ("rate limit",)
+
+
+class PixivWebBackend():
+    """pixivのWebのAJAX APIを使う、`backend.BatchBookmarkBackend`の実装。
+
+    書き込みの前に、トップページからCSRFトークンを取得します。
+    HTTPのステータスが429の場合や、エラーのメッセージがレート制限を示す場合は、`BatchRateLimited`を送出します。
+    それ以外のエラーは、`WebAPIError`を送出します。
+
+    Args:
+        session_id (str): Cookie`PHPSESSID`の値。
+        client (aiohttp.ClientSession | None, optional): リクエストに使うセッション。
+        `None`の場合は、新しいセッションを作り、`close`で閉じます。 デフォルトは`None`です。
+        base_url (str, optional): pixivのURL。 ローカルの代わりのサーバーで試す場合に変更します。
+        デフォルトは`WEB_BASE_URL`です。
+        page_size (int, optional): 一覧を取得する際の、1ページあたりの件数。 デフォルトは`100`です。
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        client: aiohttp.ClientSession | None = None,
+        base_url: str = WEB_BASE_URL,
+        page_size: int = 100
+    ) -> None:
+        self.session_id = session_id
+        self.base_url = base_url.rstrip("/")
+        self.page_size = page_size
+
+        self._client = client
+        self._owns_client = client is None
+        self._csrf_token: str | None = None
+
+    @property
+    def client(self) -> aiohttp.ClientSession:
+        if self._client is None:
+            self._client = aiohttp.ClientSession()
+        return self._client
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Cookie": f"PHPSESSID={self.session_id}",
+            "Referer": f"{self.base_url}/",
+            "User-Agent": WEB_USER_AGENT,
+        }
+
+    async def csrf_token(self) -> str:
+        """書き込みに必要なCSRFトークンを返します。 初回だけ、トップページから取得します。
+
+        Raises:
+            WebAPIError: トークンが見つからなかった場合に発生する例外。 ログインしていない場合などです。
+
+        Returns:
+            str: CSRFトークン。
+        """
+        if self._csrf_token is not None:
+            return self._csrf_token
+
+        async with self.client.get(f"{self.base_url}/", headers=self._headers()) as response:
+            text = await response.text()
+        match = CSRF_TOKEN_PATTERN.search(text)
+        if match is None:
+            raise WebAPIError("csrf_token", response.status, "CSRFトークンが見つかりませんでした。")
+        self._csrf_token = match.group(1)
+        return self._csrf_token
+
+    async def _request(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        params: Dict[str, Any] | None = None,
+        payload: Dict[str, Any] | None = None
+    ) -> Any:
+        """AJAX APIにリクエストし、レスポンスの`body`を返します。"""
+        headers = self._headers()
+        if method != "GET":
+            headers["x-csrf-token"] = await self.csrf_token()
+
+        async with self.client.request(
+                method, f"{self.base_url}{path}",
+                params=params, json=payload, headers=headers) as response:
+            status = response.status
+            try:
+                data = await response.json(content_type=None)
+            except ValueError:
+                data = None
+
+        message = data.get("message") if isinstance(data, dict) else None
+        if (status == 429) or (message and any(
+                text in message.casefold() for text in RATELIMIT_MESSAGES)):
+            raise BatchRateLimited(endpoint)
+        if (400 <= status) or not isinstance(data, dict) or data.get("error"):
+            raise WebAPIError(endpoint, status, message)
+        return data.get("body")
+
+    async def list_bookmark_ids(
+        self,
+        user_id: int | str,
+        restrict: Restrict = "public",
+        tag: str | None = None,
+        offset: int = 0
+    ) -> BookmarkIdPage:
+        """ユーザーのブックマークの一覧を、`offset`の位置から1ページ取得します。
+
+        Args:
+            user_id (int | str): ブックマークを取得するユーザーのID。
+            restrict (Restrict, optional): 取得するブックマークのプライバシー設定。 デフォルトは`"public"`です。
+            tag (str | None, optional): 絞り込むタグ。 デフォルトは`None`です。
+            offset (int, optional): 取得を始める位置。 デフォルトは`0`です。
+
+        Returns:
+            BookmarkIdPage: 1ページ分の、イラストのIDとブックマークのID。
+        """
+        body = await self._request(
+            "list_bookmark_ids", "GET", f"/ajax/user/{user_id}/illusts/bookmarks",
+            params={
+                "tag": tag or "",
+                "offset": offset,
+                "limit": self.page_size,
+                "rest": "show" if restrict == RESTRICT_PUBLIC else "hide",
+            })
+        works = body["works"]
+        bookmark_ids = {}
+        for work in works:
+            bookmark_data = work.get("bookmarkData")
+            if bookmark_data is not None:
+                bookmark_ids[int(work["id"])] = str(bookmark_data["id"])
+
+        next_offset = offset + len(works)
+        if (len(works) < self.page_size) or (body.get("total", 0) <= next_offset):
+            next_offset = None
+        return BookmarkIdPage(bookmark_ids, next_offset)
+
+    async def add_bookmark_tags(self, bookmark_ids: List[str], tags: List[str]) -> None:
+        """ブックマークに`tags`を追加します。 既に付いているタグは残ります。
+
+        Args:
+            bookmark_ids (List[str]): ブックマークのIDのリスト。
+            tags (List[str]): 追加するタグ名のリスト。
+        """
+        await self._request(
+            "add_bookmark_tags", "POST", "/ajax/illusts/bookmarks/add_tags",
+            payload={"tags": tags, "bookmarkIds": bookmark_ids})
+
+    async def remove_bookmark_tags(self, bookmark_ids: List[str], tags: List[str]) -> None:
+        """ブックマークから`tags`を外します。
+
+        Args:
+            bookmark_ids (List[str]): ブックマークのIDのリスト。
+            tags (List[str]): 外すタグ名のリスト。
+        """
+        await self._request(
+            "remove_bookmark_tags", "POST", "/ajax/illusts/bookmarks/remove_tags",
+            payload={"removeTags": tags, "bookmarkIds": bookmark_ids})
+
+    async def edit_bookmark_restrict(self, bookmark_ids: List[str], restrict: Restrict) -> None:
+        """ブックマークのプライバシー設定を、`restrict`に変更します。
+
+        Args:
+            bookmark_ids (List[str]): ブックマークのIDのリスト。
+            restrict (Restrict): 変更後のプライバシー設定。
+        """
+        await self._request(
+            "edit_bookmark_restrict", "POST", "/ajax/illusts/bookmarks/edit_restrict",
+            payload={"bookmarkIds": bookmark_ids, "bookmarkRestrict": restrict})
+
+    async def remove_bookmarks(self, bookmark_ids: List[str]) -> None:
+        """ブックマークを解除します。
+
+        Args:
+            bookmark_ids (List[str]): ブックマークのIDのリスト。
+        """
+        await self._request(
+            "remove_bookmarks", "POST", "/ajax/illusts/bookmarks/remove",
+            payload={"bookmarkIds": bookmark_ids})
+
+    async def close(self) -> None:
+        """このインスタンスが作ったセッションを閉じます。"""
+        if self._owns_client and (self._client is not None):
+            await self._client.close()
+            self._client = None
@@ -2,21 +2,49 @@ import argparse
 import asyncio
 import json
 import sys
-from typing import List
+import time
+from typing import Dict, List
 from datetime import datetime
 import pathlib
 
 from pixivpy_async import AppPixivAPI
-from pixivpy_async.utils import JsonDict
 
-from bookmark_classify import consts, get_bookmarks, bookmark_classify
-from bookmark_classify.utils import print_override
+from bookmark_classify import batch, consts, get_bookmarks, bookmark_classify, plan, purge
+from bookmark_classify.bookmark_cache import BookmarkCache
+from bookmark_classify.bookmark_store import BookmarkStore
+from bookmark_classify.exceptions import ProgressStalled
+from bookmark_classify.illust import ListingContext
+from bookmark_classify.journal import ProgressJournal
+from bookmark_classify.metrics import RunMetrics
+from bookmark_classify.profiling import PhaseProfiler
+from bookmark_classify.rate_limiter import (AdaptiveRateLimiter, FixedIntervalRateLimiter,
+                                            RateLimiter)
+from bookmark_classify.retry_queue import RetryQueue
+from bookmark_classify.session import TokenManager, create_client_session
+from bookmark_classify.tag_frequency import TagFrequencyIndex
+from bookmark_classify.tag_rules import TagRules
+from bookmark_classify.timeouts import RequestTimeouts
+from bookmark_classify.utils import Restrict, merge, prefetch, print_override
+from bookmark_classify.verification import VerificationPolicy
+from bookmark_classify.watchdog import StallWatchdog
+from bookmark_classify.web_backend import PixivWebBackend
 
 config_path = "config.json"
 RESTRICT_ALL = "all"
 
-BOOKMARKS_PUBLIC_PATH = "bookmarks_public.json"
-BOOKMARKS_PRIVATE_PATH = "bookmarks_private.json"
+BOOKMARK_CACHE_PATH = "bookmarks_cache.sqlite3"
+PREFETCH_PAGES = 1
+RATE_LIMITER_STATE_PATH = "rate_limiter.json"
+BOOKMARK_STORE_PATH = "bookmarks.sqlite3"
+PLAN_PATH = "plan.json"
+JOURNAL_PATH = "progress.jsonl"
+DEAD_LETTERS_PATH = "dead_letters.json"
+REJECTIONS_PATH = "rejections.json"
+METRICS_JSON_PATH = "metrics.json"
+METRICS_PROMETHEUS_PATH = "metrics.prom"
+PROFILE_PATH = "profile.json"
+# 処理が止まったために中断した場合に、最初からやり直す回数の上限
+STALL_RESTARTS = 3
 
 parser = argparse.ArgumentParser(description="ブックマークを整理します。")
 parser.add_argument("-r", "--restrict", default=RESTRICT_ALL,
@@ -26,29 +54,88 @@ parser.add_argument("-r", "--restrict", default=RESTRICT_ALL,
                     "デフォルトは`%(default)s`です。")
 parser.add_argument("-ou", "--only-uncategorized", action="store_true",
                     help="未分類のみを対象にするかを指定します。このオプションはフラグです。")
-parser.add_argument("-gb", "--get-bookmarks", action="store_true",
-                    help="キャッシュの有無に関わらず、ブックマークを取得するかを指定します。このオプションはフラグです。")
-parser.add_argument("-cp", "--config-path", default=config_path, type=pathlib.Path,
-                    help="configファイルのパスを指定します。指定しない場合、`%(default)s`から読み込まれます。")
+get_bookmarks_group = parser.add_mutually_exclusive_group()
+get_bookmarks_group.add_argument("-gb", "--get-bookmarks", action="store_true",
+                                 help="キャッシュの有無に関わらず、ブックマークを取得するかを指定します。"
+                                 "このオプションはフラグです。")
+get_bookmarks_group.add_argument("-sy", "--sync", action="store_true",
+                                 help="キャッシュを取得してから追加された新しいブックマークだけを取得し、"
+                                 "それだけを整理するかを指定します。キャッシュにあるブックマークが見つかった時点で"
+                                 "取得をやめます。キャッシュがない場合は、全てのブックマークを取得します。"
+                                 "このオプションはフラグです。")
+parser.add_argument("-cp", "--config-path", default=[config_path], type=pathlib.Path, nargs="+",
+                    help=f"configファイルのパスを指定します。指定しない場合、`{config_path}`から読み込まれます。"
+                    "複数指定した場合、各アカウントを並行して処理します。"
+                    "進捗やキャッシュはconfigファイルと同じディレクトリに保存されるため、"
+                    "configファイルはアカウントごとに別のディレクトリに置いてください。")
+parser.add_argument("-s", "--stream", action=argparse.BooleanOptionalAction, default=None,
+                    help="ブックマークを取得する場合に、取得したページから順に整理するかを指定します。"
+                    "全てのページの取得を待たずに整理を始めます。指定しない場合、"
+                    "キャッシュが読み込めずに取得するときは、順に整理します。"
+                    "`--get-bookmarks`を指定したときと、`preferred_tags`が`\"frequency\"`のときは、"
+                    "全てのページを取得してから整理します。")
+parser.add_argument("-rp", "--reset-progress", action="store_true",
+                    help="進捗を削除し、全てのブックマークを整理し直すかを指定します。このオプションはフラグです。")
+parser.add_argument("-pf", "--profile", nargs="?", const=PROFILE_PATH, default=None,
+                    type=pathlib.Path,
+                    help="configの読み込み、キャッシュの読み込み、取得、整理、保存の各フェーズの"
+                    "経過時間、CPU時間、メモリ使用量の最大値を計測し、指定したファイルにJSONで書き込みます。"
+                    f"ファイルを省略した場合は`{PROFILE_PATH}`に書き込みます。"
+                    "並行して実行されるフェーズは、時間が重複して数えられます。")
+parser.add_argument("-pfs", "--profile-stats", action="store_true",
+                    help="--profileと併せて、cProfileの統計をフェーズごとに`<ファイル>.<フェーズ名>.pstats`に"
+                    "書き込むかを指定します。このオプションはフラグです。")
+
+subparsers = parser.add_subparsers(dest="command",
+                                   help="指定しない場合は、ブックマークを取得しながら整理します。")
+parser_plan = subparsers.add_parser(
+    "plan", help="キャッシュから、整理の計画をネットワークを使わずに立てます。")
+parser_plan.add_argument("-pp", "--plan-path", default=PLAN_PATH, type=pathlib.Path,
+                         help="計画を書き込むファイルのパスを指定します。"
+                         "相対パスの場合は、configファイルと同じディレクトリからのパスです。"
+                         "デフォルトは`%(default)s`です。")
+parser_apply = subparsers.add_parser(
+    "apply", help="`plan`で立てた計画のうち、何もしないもの以外を実行します。")
+parser_apply.add_argument("-pp", "--plan-path", default=PLAN_PATH, type=pathlib.Path,
+                          help="計画を読み込むファイルのパスを指定します。"
+                          "相対パスの場合は、configファイルと同じディレクトリからのパスです。"
+                          "デフォルトは`%(default)s`です。")
+parser_apply.add_argument("-wb", "--web-batch", action="store_true",
+                          help="WebのAPIで、同じタグやプライバシー設定への編集をまとめて書き込むかを指定します。"
+                          "configファイルの`web_session`が必要です。このオプションはフラグです。")
+parser_purge = subparsers.add_parser(
+    "purge", help="キャッシュから、解除するブックマーク(`delete_if_unknown`, `delete_tags`)を全て選んで解除し、"
+    "解除したブックマークを含んでいた一覧のページを取得し直して、まとめて確認します。")
 
 
 class Config():
     def __init__(
         self,
         refresh_token: str,
-        progress_public: int,
-        progress_private: int,
         bookmarks_public: str,
         bookmarks_private: str,
         exclude_tags: List[str],
         private_tags: List[str],
         preferred_tags: str,
         delete_tags: List[str],
-        delete_if_unknown: bool
+        delete_if_unknown: bool,
+        rate_limiter: str | None = None,
+        bookmark_store_ttl: int | None = None,
+        verify_mode: str | None = None,
+        verify_every_n: int | None = None,
+        verify_fraction: float | None = None,
+        verify_batch_size: int | None = None,
+        concurrency: int | None = None,
+        max_retries: int | None = None,
+        metrics_interval: int | None = None,
+        web_session: str | None = None,
+        request_timeouts: Dict[str, float | None] | None = None,
+        stall_seconds: int | None = None,
+        # 進捗はジャーナルに記録するため使わない。 以前のconfigファイルを読み込めるように残している
+        progress_public: int | None = None,
+        progress_private: int | None = None
     ) -> None:
         self.refresh_token = refresh_token or ""
-        self.progress_public = progress_public or -1
-        self.progress_private = progress_private or -1
         self.bookmarks_public = bookmarks_public
         self.bookmarks_private = bookmarks_private
         self.exclude_tags = exclude_tags
@@ -56,150 +143,751 @@ class Config():
         self.preferred_tags = preferred_tags or "bookmark"
         self.delete_tags = delete_tags
         self.delete_if_unknown = delete_if_unknown or False
-
-        if self.progress_public < 0:
-            self.progress_public = -1
-        if self.progress_private < 0:
-            self.progress_private = -1
+        self.rate_limiter = rate_limiter or "adaptive"
+        self.bookmark_store_ttl = 604800 if bookmark_store_ttl is None else bookmark_store_ttl
+        self.verify_mode = verify_mode or "always"
+        self.verify_every_n = verify_every_n or 3
+        self.verify_fraction = verify_fraction
+        self.verify_batch_size = verify_batch_size or 30
+        self.concurrency = concurrency or 4
+        self.max_retries = 5 if max_retries is None else max_retries
+        self.metrics_interval = 60 if metrics_interval is None else metrics_interval
+        self.web_session = web_session
+        self.request_timeouts = request_timeouts
+        self.stall_seconds = 1800 if stall_seconds is None else stall_seconds
 
     @staticmethod
-    def from_jsonfile() -> "Config":
-        with open(config_path, "r", encoding="utf-8") as f:
+    def from_jsonfile(path: pathlib.Path | str = config_path) -> "Config":
+        with open(path, "r", encoding="utf-8") as f:
             config: "Config" = json.load(f, object_hook=lambda x: Config(**x))
-            return config
+        # 読み込んだファイルのパスは、configファイルには書き込まない
+        config.path = pathlib.Path(path)
+        return config
 
     def to_jsonfile(self) -> None:
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(self.__dict__, f, ensure_ascii=False, indent=4)
+        values = {key: value for key, value in self.__dict__.items() if key != "path"}
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(values, f, ensure_ascii=False, indent=4)
+
+    @property
+    def name(self) -> str:
+        return str(self.path)
+
+    @property
+    def directory(self) -> pathlib.Path:
+        # 実行時に作るファイルは、アカウントごとにconfigファイルと同じディレクトリに保存する
+        return self.path.parent
+
+    def create_rate_limiter(self) -> RateLimiter:
+        if self.rate_limiter == "fixed":
+            return FixedIntervalRateLimiter(interval_seconds=2)
+        state_path = self.directory / RATE_LIMITER_STATE_PATH
+        return AdaptiveRateLimiter(state_path=state_path)
+
+    def get_bookmarks_cache_path(self, restrict: Restrict) -> str | None:
+        if restrict == consts.RESTRICT_PRIVATE:
+            return self.bookmarks_private
+        return self.bookmarks_public
+
+    def set_bookmarks_cache_path(self, restrict: Restrict, cache_path: str | None) -> None:
+        if restrict == consts.RESTRICT_PRIVATE:
+            self.bookmarks_private = cache_path
+        else:
+            self.bookmarks_public = cache_path
+
+    def create_bookmark_cache(self) -> BookmarkCache:
+        return BookmarkCache(self.directory / BOOKMARK_CACHE_PATH)
+
+    def create_bookmark_store(self) -> BookmarkStore | None:
+        if self.bookmark_store_ttl <= 0:
+            return None
+        store_path = self.directory / BOOKMARK_STORE_PATH
+        return BookmarkStore(store_path, self.bookmark_store_ttl)
+
+    def create_verification(self) -> VerificationPolicy:
+        return VerificationPolicy(
+            self.verify_mode,
+            self.verify_every_n,
+            self.verify_fraction,
+            self.verify_batch_size)
+
+    def create_journal(self) -> ProgressJournal:
+        journal_path = self.directory / JOURNAL_PATH
+        return ProgressJournal(journal_path)
+
+    def create_retry_queue(self) -> RetryQueue:
+        return RetryQueue(self.max_retries)
+
+    def create_request_timeouts(self) -> RequestTimeouts:
+        return RequestTimeouts(self.request_timeouts)
 
+    def create_watchdog(self) -> StallWatchdog | None:
+        if self.stall_seconds <= 0:
+            return None
+        return StallWatchdog(self.stall_seconds)
 
-async def classify(api: AppPixivAPI, config: Config, args):
+    def create_tag_index(self) -> TagFrequencyIndex | None:
+        if self.preferred_tags != "frequency":
+            return None
+        return TagFrequencyIndex()
+
+    def create_metrics(
+        self,
+        rate_limiter: RateLimiter,
+        total: int | None = None
+    ) -> RunMetrics | None:
+        if self.metrics_interval <= 0:
+            return None
+        return RunMetrics(
+            total,
+            rate_limiter,
+            self.directory / METRICS_JSON_PATH,
+            self.directory / METRICS_PROMETHEUS_PATH,
+            self.metrics_interval)
+
+
+class ProgressBoard():
+    """複数のアカウントの進捗を、1行にまとめて表示するクラス。
+    アカウントが1つの場合は、そのアカウントの進捗だけを表示します。
+    """
+
+    def __init__(self, names: List[str]) -> None:
+        self.lines: Dict[str, str] = {name: "" for name in names}
+
+    def update(self, name: str, text: str) -> None:
+        if text.endswith("\n"):
+            # 改行で終わるメッセージは残しておくため、まとめずに表示する
+            print_override(text if len(self.lines) == 1 else f"[{name}] {text}")
+            return
+
+        self.lines[name] = text
+        if len(self.lines) == 1:
+            print_override(text)
+            return
+        print_override(" | ".join(f"[{key}] {line}" for key, line in self.lines.items() if line))
+
+
+def save_dead_letters(config: Config, retry_queue: RetryQueue, board: ProgressBoard):
+    if not retry_queue.dead_letters:
+        return
+    dead_letters_path = config.directory / DEAD_LETTERS_PATH
+    retry_queue.save_dead_letters(dead_letters_path)
+    board.update(
+        config.name,
+        f"{len(retry_queue.dead_letters)}件のイラストは、やり直しの回数の上限に達したため諦めました。"
+        f" 詳細は{dead_letters_path}を確認してください。\n")
+
+
+def save_rejections(config: Config, retry_queue: RetryQueue, board: ProgressBoard):
+    if not retry_queue.rejections:
+        return
+    rejections_path = config.directory / REJECTIONS_PATH
+    retry_queue.save_rejections(rejections_path)
+    board.update(
+        config.name,
+        f"{len(retry_queue.rejections)}件のイラストは、タグがpixivに拒否されたためやり直しませんでした。"
+        f" 詳細は{rejections_path}を確認してください。\n")
+
+
+def open_bookmarks_cache(config: Config, bookmark_cache: BookmarkCache, restrict: Restrict) -> bool:
+    """`restrict`のブックマークのキャッシュが使えるかを返します。
+    以前の形式のJSONのキャッシュは、SQLiteのキャッシュに移してから使います。"""
+    cache_path = config.get_bookmarks_cache_path(restrict)
+    if not cache_path:
+        return False
+    if str(cache_path).endswith(".json"):
+        bookmark_cache.import_json(restrict, cache_path)
+        config.set_bookmarks_cache_path(restrict, str(bookmark_cache.path))
+        config.to_jsonfile()
+    return bookmark_cache.is_complete(restrict)
+
+
+async def classify(
+    api: AppPixivAPI,
+    config: Config,
+    args,
+    board: ProgressBoard | None = None,
+    profiler: PhaseProfiler | None = None
+):
+    if board is None:
+        board = ProgressBoard([config.name])
+    if profiler is None:
+        profiler = PhaseProfiler(enabled=False)
+
+    def log(text):
+        board.update(config.name, text)
 
     if args.only_uncategorized:
-        bookmark_tag = "未分類"
+        bookmark_tag = consts.UNCATEGORIZED_TAG
     else:
         bookmark_tag = None
 
-    async def _classify(restrict):
-        if restrict == consts.RESTRICT_PRIVATE:
-            cache_path = config.bookmarks_private
-            new_cache_path = BOOKMARKS_PRIVATE_PATH
-            progress = config.progress_private
-        else:
-            cache_path = config.bookmarks_public
-            new_cache_path = BOOKMARKS_PUBLIC_PATH
-            progress = config.progress_public
-
-        if not args.get_bookmarks and cache_path:
+    tag_rules = TagRules(config.exclude_tags, config.private_tags, config.delete_tags)
+    rate_limiter = config.create_rate_limiter()
+    bookmark_store = config.create_bookmark_store()
+    verification = config.create_verification()
+    journal = config.create_journal()
+    retry_queue = config.create_retry_queue()
+    metrics = config.create_metrics(rate_limiter)
+    tag_index = config.create_tag_index()
+    bookmark_cache = config.create_bookmark_cache()
+
+    if args.reset_progress:
+        journal.reset()
+
+    # 指定しない場合は、取得を待たずに整理を始める
+    # 全てのブックマークでタグの出現数を数えてから整理する場合と、明示的に取得し直す場合は、取得を待つ
+    stream = args.stream
+    if stream is None:
+        stream = (not args.get_bookmarks) and (tag_index is None)
+
+    processed = 0
+
+    async def on_success(index, illust):
+        nonlocal processed
+        processed += 1
+        log(f"進捗: {processed}")
+
+    async def on_ratelimited(index, illust, ratelimited):
+        journal.commit()
+        t_now = datetime.now().time()
+        log(f"{ratelimited} date: {t_now}")
+
+    async def _illusts(restrict):
+        """`restrict`のブックマークを、キャッシュもしくはAPIから読み込んでyieldする関数。"""
+        should_get_bookmarks = True
+        if not args.get_bookmarks:
+            log("ブックマークのキャッシュを読み込み中です...")
             try:
-                print_override("ブックマークのキャッシュを読み込み中です...")
-                with open(cache_path, "r", encoding="utf-8") as f:
-                    bookmarks = json.load(f, object_hook=JsonDict)
-                    should_get_bookmarks = False
+                with profiler.phase("cache_load"):
+                    cached = open_bookmarks_cache(config, bookmark_cache, restrict)
             except Exception:
-                should_get_bookmarks = True
-            else:
-                print_override("ブックマークのキャッシュを読み込みました。")
-        else:
-            should_get_bookmarks = True
-
+                cached = False
+            if cached:
+                should_get_bookmarks = False
+                log("ブックマークのキャッシュを読み込みました。")
+
+        if not should_get_bookmarks and args.sync:
+            async for illust in _illusts_sync(restrict):
+                yield illust
+            return
+
+        if should_get_bookmarks and stream:
+            async for illust in _illusts_stream(restrict):
+                yield illust
+            return
+
+        listing = None
         if should_get_bookmarks:
-            if args.get_bookmarks:
-                print_override("--get-bookmarksフラグが有効なため、ブックマークを取得しています...")
+            resumed = bookmark_cache.load_cursor(restrict) is not None
+            if not resumed:
+                # キャッシュを今回の取得だけで作るため、一覧の条件から分かるブックマークの状態を使える
+                listing = ListingContext(restrict, bookmark_tag, time.time())
+
+            if resumed:
+                log("前回中断したページから、ブックマークの取得を再開しています...")
+            elif args.get_bookmarks:
+                log("--get-bookmarksフラグが有効なため、ブックマークを取得しています...")
             else:
-                print_override("ブックマークのキャッシュが読み込めなかったため、取得しています...")
-            bookmarks = await get_bookmarks.get_all_bookmarks_illust(
+                log("ブックマークのキャッシュが読み込めなかったため、取得しています...")
+            with profiler.phase("fetch"):
+                # 取得したページはすぐにキャッシュに追記し、中断した場合は次回そのページから再開する
+                async for _ in get_bookmarks.fetch_bookmarks_to_cache(
+                        api,
+                        api.user_id,
+                        bookmark_cache,
+                        restrict, bookmark_tag,
+                        rate_limiter=rate_limiter,
+                        metrics=metrics):
+                    pass
+            with profiler.phase("save"):
+                config.set_bookmarks_cache_path(restrict, str(bookmark_cache.path))
+                config.to_jsonfile()
+
+        if metrics is not None:
+            metrics.total = (metrics.total or 0) + bookmark_cache.count(restrict)
+        if tag_index is not None:
+            bookmark_classify.index_bookmark_tags(
+                tag_index,
+                bookmark_cache.iter_illusts(restrict, reverse=True),
+                tag_rules,
+                config.delete_if_unknown)
+
+        log("ブックマークを取得しました。")
+
+        # 一覧全体は読み込まず、古いブックマークから少しずつ読み込む
+        for illust in bookmark_cache.iter_illusts(restrict, reverse=True, listing=listing):
+            yield illust
+
+    async def _illusts_sync(restrict):
+        log("--syncフラグが有効なため、新しいブックマークを取得しています...")
+        with profiler.phase("fetch"):
+            illusts = await get_bookmarks.sync_bookmarks(
                 api,
                 api.user_id,
-                restrict, bookmark_tag)
-            with open(new_cache_path, "w", encoding="utf-8") as f:
-                json.dump(bookmarks, f, ensure_ascii=False, indent=4)
-
-            if restrict == consts.RESTRICT_PRIVATE:
-                config.bookmarks_private = new_cache_path
-                config.progress_private = -1
-            else:
-                config.bookmarks_public = new_cache_path
-                config.progress_public = -1
-
-        bookmarks.reverse()
-        bookmarks = bookmarks[progress + 1:]
-
+                bookmark_cache,
+                restrict, bookmark_tag,
+                rate_limiter=rate_limiter,
+                metrics=metrics)
+        illusts.reverse()
+
+        if metrics is not None:
+            metrics.total = (metrics.total or 0) + len(illusts)
+        # タグの出現数は、新しいブックマークを含むキャッシュ全体で数える
+        if tag_index is not None:
+            bookmark_classify.index_bookmark_tags(
+                tag_index,
+                bookmark_cache.iter_illusts(restrict, reverse=True),
+                tag_rules,
+                config.delete_if_unknown)
+
+        log(f"新しいブックマークを{len(illusts)}件取得しました。")
+
+        for illust in illusts:
+            yield illust
+
+    async def _illusts_stream(restrict):
+        log("ブックマークを取得しながら整理しています...")
+
+        # 書き込みが終わるまでは、キャッシュとして読み込まない
+        config.set_bookmarks_cache_path(restrict, None)
         config.to_jsonfile()
-        print_override("ブックマークを取得しました。")
 
-        bookmarks_len = len(bookmarks)
+        # 中断した取得を再開する場合は、中断する前に取得したブックマークから整理する
+        if bookmark_cache.load_cursor(restrict) is not None:
+            log("前回中断したページから、ブックマークの取得を再開しています...")
+            for illust in bookmark_cache.iter_illusts(restrict):
+                if tag_index is not None:
+                    bookmark_classify.index_bookmark_tags(
+                        tag_index, (illust,), tag_rules, config.delete_if_unknown)
+                yield illust
 
-        async def on_success(index, _):
-            if restrict == consts.RESTRICT_PRIVATE:
-                config.progress_private = progress + 1 + index
-            else:
-                config.progress_public = progress + 1 + index
-            print_override(f"進捗: {restrict} - {index + 1} / {bookmarks_len}")
-
-        async def on_ratelimited(index, illust, ratelimited):
-            config.to_jsonfile()
-            t_now = datetime.now().time()
-            print_override(f"{ratelimited} date: {t_now}")
-            await asyncio.sleep(600)
-
-        await bookmark_classify.bookmarks_classify(
+        pages = get_bookmarks.fetch_bookmarks_to_cache(
             api,
-            bookmarks,
-            config.exclude_tags,
-            config.private_tags,
-            config.preferred_tags,
-            config.delete_tags,
-            config.delete_if_unknown,
-            on_success=on_success,
-            on_ratelimited=on_ratelimited
-            )
-
+            api.user_id,
+            bookmark_cache,
+            restrict, bookmark_tag,
+            rate_limiter=rate_limiter,
+            metrics=metrics)
+
+        async for page in prefetch(pages, PREFETCH_PAGES):
+            # 全体を待たずに整理するため、タグの出現数は取得した分だけを数える
+            if tag_index is not None:
+                bookmark_classify.index_bookmark_tags(
+                    tag_index, page, tag_rules, config.delete_if_unknown)
+            for illust in page:
+                yield illust
+
+        config.set_bookmarks_cache_path(restrict, str(bookmark_cache.path))
         config.to_jsonfile()
-        print_override(f"進捗: {restrict} - 終了")
 
-    if args.restrict in (RESTRICT_ALL, consts.RESTRICT_PUBLIC):
-        await _classify(consts.RESTRICT_PUBLIC)
-    if args.restrict in (RESTRICT_ALL, consts.RESTRICT_PRIVATE):
-        await _classify(consts.RESTRICT_PRIVATE)
+    restricts = [restrict for restrict in (consts.RESTRICT_PUBLIC, consts.RESTRICT_PRIVATE)
+                 if args.restrict in (RESTRICT_ALL, restrict)]
 
-    config.to_jsonfile()
-    print_override("ブックマークの整理が終了しました。")
+    try:
+        # 公開/非公開のブックマークを並行して読み込み、同じレートリミッターの下で整理する
+        # 読み込みも整理と並行して進むため、整理のフェーズにはキャッシュの読み込みと取得も含まれる
+        with profiler.phase("classify"):
+            await bookmark_classify.bookmarks_classify(
+                api,
+                merge(*(_illusts(restrict) for restrict in restricts)),
+                tag_rules,
+                config.preferred_tags,
+                config.delete_if_unknown,
+                on_success=on_success,
+                on_ratelimited=on_ratelimited,
+                rate_limiter=rate_limiter,
+                bookmark_store=bookmark_store,
+                verification=verification,
+                journal=journal,
+                concurrency=config.concurrency,
+                retry_queue=retry_queue,
+                metrics=metrics,
+                tag_index=tag_index
+                )
+    finally:
+        # 中断された場合も、溜まっている進捗を書き込む
+        with profiler.phase("save"):
+            journal.close()
+            if metrics is not None:
+                metrics.write()
+            save_dead_letters(config, retry_queue, board)
+            save_rejections(config, retry_queue, board)
+            rate_limiter.save()
+            if bookmark_store is not None:
+                bookmark_store.close()
+            bookmark_cache.close()
+
+    log("ブックマークの整理が終了しました。")
+
+
+def make_plan(config: Config, args, profiler: PhaseProfiler | None = None):
+    if profiler is None:
+        profiler = PhaseProfiler(enabled=False)
+    tag_rules = TagRules(config.exclude_tags, config.private_tags, config.delete_tags)
+    bookmark_store = config.create_bookmark_store()
+    verification = config.create_verification()
+    rate_limiter = config.create_rate_limiter()
+    tag_index = config.create_tag_index()
+    bookmark_cache = config.create_bookmark_cache()
+
+    restricts = []
+    for restrict in (consts.RESTRICT_PUBLIC, consts.RESTRICT_PRIVATE):
+        if args.restrict not in (RESTRICT_ALL, restrict):
+            continue
+        print_override(f"{restrict}のブックマークのキャッシュを読み込み中です...")
+        with profiler.phase("cache_load"):
+            if not open_bookmarks_cache(config, bookmark_cache, restrict):
+                print_override(f"{restrict}のブックマークのキャッシュがないため、スキップします。\n")
+                continue
+        restricts.append(restrict)
+
+    entries = []
+    with profiler.phase("classify"):
+        # 計画を立てる前に、全てのブックマークでのタグの出現数を数えておく
+        if tag_index is not None:
+            for restrict in restricts:
+                bookmark_classify.index_bookmark_tags(
+                    tag_index,
+                    bookmark_cache.iter_illusts(restrict, reverse=True),
+                    tag_rules,
+                    config.delete_if_unknown)
+
+        for restrict in restricts:
+            print_override(f"{restrict}の計画を立てています...")
+            entries.extend(plan.plan_bookmarks(
+                bookmark_cache.iter_illusts(restrict, reverse=True),
+                tag_rules,
+                config.preferred_tags,
+                config.delete_if_unknown,
+                bookmark_store,
+                tag_index))
+
+    if bookmark_store is not None:
+        bookmark_store.close()
+    bookmark_cache.close()
+
+    # 同じ判定のまま処理済みのイラストは、実行してもスキップされる
+    journal = None if args.reset_progress else config.create_journal()
+    summary = plan.summarize_plan(entries, verification.expected_ratio, journal)
+    if journal is not None:
+        journal.close()
+    plan_path = config.directory / args.plan_path
+    with profiler.phase("save"):
+        plan.save_plan(plan_path, entries, summary)
+
+    eta_hours = summary["requests"] / rate_limiter.expected_rate / 3600
+    print_override(
+        f"計画を{plan_path}に書き込みました。\n"
+        f"解除: {summary['delete']}\n"
+        f"編集(取得済みの状態から): {summary['add']}\n"
+        f"編集(状態を取得してから): {summary['merge']}\n"
+        f"何もしない: {summary['skip']}\n"
+        f"処理済み: {summary['done']}\n"
+        f"リクエスト数の見込み: {summary['requests']}\n"
+        f"所要時間の見込み: {eta_hours:.1f}時間\n")
+
+
+async def apply(
+    api: AppPixivAPI,
+    config: Config,
+    args,
+    board: ProgressBoard | None = None,
+    profiler: PhaseProfiler | None = None,
+    watchdog: StallWatchdog | None = None
+):
+    if board is None:
+        board = ProgressBoard([config.name])
+    if profiler is None:
+        profiler = PhaseProfiler(enabled=False)
+
+    def log(text):
+        board.update(config.name, text)
+
+    web_backend = None
+    if args.web_batch:
+        if not config.web_session:
+            log("--web-batchを指定する場合は、configファイルの`web_session`を設定してください。")
+            return
+        web_backend = PixivWebBackend(config.web_session)
+        if watchdog is not None:
+            # WebのAPIのレスポンスも、進捗として数える
+            web_backend = watchdog.wrap(web_backend)
+
+    rate_limiter = config.create_rate_limiter()
+    bookmark_store = config.create_bookmark_store()
+    verification = config.create_verification()
+    journal = config.create_journal()
+    retry_queue = config.create_retry_queue()
+
+    if args.reset_progress:
+        journal.reset()
+
+    with profiler.phase("cache_load"):
+        entries = plan.load_plan(config.directory / args.plan_path)
+    entries_len = len(entries)
+    metrics = config.create_metrics(rate_limiter, entries_len)
+    tag_index = config.create_tag_index()
+    if tag_index is not None:
+        # 計画にはイラストのタグが残っていないため、書き込む予定のタグから数える
+        for entry in entries:
+            if entry.action != "delete":
+                tag_index.add(entry.tags)
+
+    async def on_success(index, _):
+        log(f"進捗: {index + 1} / {entries_len}")
+
+    async def on_ratelimited(index, entry, ratelimited):
+        journal.commit()
+        t_now = datetime.now().time()
+        log(f"{ratelimited} date: {t_now}")
 
+    try:
+        with profiler.phase("classify"):
+            if web_backend is not None:
+                await batch.apply_plan_batched(
+                    api,
+                    web_backend,
+                    api.user_id,
+                    entries,
+                    config.preferred_tags,
+                    on_success=on_success,
+                    rate_limiter=rate_limiter,
+                    bookmark_store=bookmark_store,
+                    journal=journal,
+                    retry_queue=retry_queue,
+                    metrics=metrics,
+                    tag_index=tag_index,
+                    max_retries=config.max_retries
+                )
+            else:
+                await plan.apply_plan(
+                    api,
+                    entries,
+                    config.preferred_tags,
+                    on_success=on_success,
+                    on_ratelimited=on_ratelimited,
+                    rate_limiter=rate_limiter,
+                    bookmark_store=bookmark_store,
+                    verification=verification,
+                    journal=journal,
+                    concurrency=config.concurrency,
+                    retry_queue=retry_queue,
+                    metrics=metrics,
+                    tag_index=tag_index
+                )
+    finally:
+        with profiler.phase("save"):
+            if web_backend is not None:
+                await web_backend.close()
+            journal.close()
+            if metrics is not None:
+                metrics.write()
+            save_dead_letters(config, retry_queue, board)
+            save_rejections(config, retry_queue, board)
+            rate_limiter.save()
+            if bookmark_store is not None:
+                bookmark_store.close()
+    log("計画の実行が終了しました。")
+
+
+async def purge_bookmarks(
+    api: AppPixivAPI,
+    config: Config,
+    args,
+    board: ProgressBoard | None = None,
+    profiler: PhaseProfiler | None = None
+):
+    if board is None:
+        board = ProgressBoard([config.name])
+    if profiler is None:
+        profiler = PhaseProfiler(enabled=False)
+
+    def log(text):
+        board.update(config.name, text)
+
+    if not config.delete_if_unknown and not config.delete_tags:
+        log("解除するブックマークの条件(`delete_if_unknown`, `delete_tags`)が設定されていません。\n")
+        return
+
+    # キャッシュを取得したときと同じ条件で、一覧のページを取得し直す
+    bookmark_tag = consts.UNCATEGORIZED_TAG if args.only_uncategorized else None
+
+    tag_rules = TagRules(config.exclude_tags, config.private_tags, config.delete_tags)
+    rate_limiter = config.create_rate_limiter()
+    bookmark_store = config.create_bookmark_store()
+    journal = config.create_journal()
+    retry_queue = config.create_retry_queue()
+    metrics = config.create_metrics(rate_limiter)
+    bookmark_cache = config.create_bookmark_cache()
+
+    if args.reset_progress:
+        journal.reset()
+
+    processed = 0
+
+    async def on_success(index, illust):
+        nonlocal processed
+        processed += 1
+        log(f"解除: {processed}")
+
+    restricts = [restrict for restrict in (consts.RESTRICT_PUBLIC, consts.RESTRICT_PRIVATE)
+                 if args.restrict in (RESTRICT_ALL, restrict)]
 
-async def _login(api: AppPixivAPI, config: Config):
     try:
-        await api.login(refresh_token=config.refresh_token)
+        with profiler.phase("classify"):
+            for restrict in restricts:
+                with profiler.phase("cache_load"):
+                    if not open_bookmarks_cache(config, bookmark_cache, restrict):
+                        log(f"{restrict}のブックマークのキャッシュがないため、スキップします。\n")
+                        continue
+                log(f"{restrict}のブックマークを解除しています...")
+                await purge.purge_bookmarks(
+                    api,
+                    api.user_id,
+                    bookmark_cache,
+                    restrict,
+                    tag_rules,
+                    config.preferred_tags,
+                    config.delete_if_unknown,
+                    bookmark_tag,
+                    on_success=on_success,
+                    rate_limiter=rate_limiter,
+                    bookmark_store=bookmark_store,
+                    journal=journal,
+                    retry_queue=retry_queue,
+                    metrics=metrics,
+                    max_retries=config.max_retries
+                )
+    finally:
+        with profiler.phase("save"):
+            journal.close()
+            if metrics is not None:
+                metrics.write()
+            save_dead_letters(config, retry_queue, board)
+            rate_limiter.save()
+            if bookmark_store is not None:
+                bookmark_store.close()
+            bookmark_cache.close()
+    log("ブックマークの解除が終了しました。")
+
+
+async def _login(token_manager: TokenManager, config: Config, board: ProgressBoard) -> bool:
+    try:
+        await token_manager.login()
     except Exception as e:
-        print_override("ログインできませんでした。リフレッシュトークンが正しいか確認してください。")
-        print("\n例外情報を以下に示します。:")
-        print(e)
-        sys.exit(1)
-
+        # 他のアカウントの処理は止めずに、このアカウントだけを諦める
+        board.update(
+            config.name,
+            "ログインできませんでした。リフレッシュトークンが正しいか確認してください。"
+            f" 例外情報: {e}")
+        return False
+    return True
+
+
+async def _run_command(
+    config: Config,
+    args,
+    board: ProgressBoard,
+    profiler: PhaseProfiler,
+    watchdog: StallWatchdog | None
+) -> bool:
+    request_timeouts = config.create_request_timeouts()
+    # 実行中は同じ接続プールを使い回し、リクエスト毎の接続の確立を省く
+    # セッション全体のタイムアウトは、APIごとの期限より先に切れないようにする
+    client = create_client_session(
+        limit=config.concurrency, timeout_seconds=request_timeouts.longest_seconds)
+    try:
+        api = AppPixivAPI(client=client)
+        token_manager = TokenManager(api, config.refresh_token)
+        board.update(config.name, "ログイン中...")
+        if not await _login(token_manager, config, board):
+            return False
+        board.update(config.name, "ログインが完了しました。")
+
+        # 応答のない接続で止まり続けないように、リクエストにAPIごとの期限を設ける
+        # アクセストークンは、有効期限が切れる前に処理を止めずに更新する
+        api = token_manager.wrap(request_timeouts.wrap(api))
+        if watchdog is not None:
+            api = watchdog.wrap(api)
+        if args.command == "apply":
+            command = apply(api, config, args, board, profiler, watchdog)
+        elif args.command == "purge":
+            command = purge_bookmarks(api, config, args, board, profiler)
+        else:
+            command = classify(api, config, args, board, profiler)
 
-async def _main(api: AppPixivAPI, config: Config, args):
-    print_override("ログイン中...")
-    await _login(api, config)
-    print_override("ログインが完了しました。")
-    await asyncio.gather(classify(api, config, args))
+        if watchdog is None:
+            await command
+        else:
+            await watchdog.run(command)
+    finally:
+        await client.close()
+    return True
+
+
+async def _run_account(
+    config: Config,
+    args,
+    board: ProgressBoard,
+    profiler: PhaseProfiler
+) -> bool:
+    for restarts in range(STALL_RESTARTS + 1):
+        try:
+            return await _run_command(config, args, board, profiler, config.create_watchdog())
+        except ProgressStalled as e:
+            if STALL_RESTARTS <= restarts:
+                board.update(config.name, f"{e} やり直しの回数の上限に達したため、中断しました。")
+                return False
+            board.update(config.name, f"{e} ログインからやり直します...")
+            # 中断するまでの進捗とキャッシュは保存されているため、やり直す場合は消さずに続きから取得する
+            # 取得し直していた場合は、最初の実行と同じく全てのページを取得してから整理する
+            args = argparse.Namespace(**{
+                **vars(args), "reset_progress": False, "get_bookmarks": False,
+                "stream": False if args.get_bookmarks else args.stream})
+        except Exception as e:
+            # 他のアカウントの処理は止めずに、このアカウントだけを諦める
+            board.update(config.name, f"エラーが発生したため、中断しました。 例外情報: {e!r}")
+            return False
+
+
+async def _main(configs: List[Config], args, profiler: PhaseProfiler):
+    # 各アカウントは、それぞれのレートリミッターと進捗を持ち、同じイベントループで並行して処理する
+    board = ProgressBoard([config.name for config in configs])
+    results = await asyncio.gather(
+        *(_run_account(config, args, board, profiler) for config in configs))
+    if not all(results):
+        # 中断したアカウントがある場合は、他のアカウントの処理が終わってから失敗として終了する
+        sys.exit(1)
 
 
 def main(args):
-    if args.config_path:
-        global config_path
-        config_path = args.config_path
-
+    configs: List[Config] = []
+    profiler = PhaseProfiler(enabled=args.profile is not None, cprofile=args.profile_stats)
     try:
         print("config.jsonを読み込んでいます...", end="")
-        config = Config.from_jsonfile()
-        asyncio.run(_main(AppPixivAPI(), config, args))
+        with profiler.phase("config_load"):
+            configs = [Config.from_jsonfile(path) for path in args.config_path]
+        directories = [config.directory.resolve() for config in configs]
+        if len(set(directories)) < len(directories):
+            print_override("複数のconfigファイルが同じディレクトリにあります。"
+                           "進捗やキャッシュが混ざるため、アカウントごとに別のディレクトリに置いてください。\n")
+            sys.exit(1)
+
+        if args.command == "plan":
+            for config in configs:
+                make_plan(config, args, profiler)
+            return
+        asyncio.run(_main(configs, args, profiler))
     except KeyboardInterrupt:
-        config.to_jsonfile()
-        print(
-            "\n進捗を保存し、処理を中断しました\n進捗:\n"
-            f"公開 - {config.progress_public + 1}\n"
-            f"非公開- {config.progress_private + 1}")
+        with profiler.phase("save"):
+            for config in configs:
+                config.to_jsonfile()
+        print("\n進捗を保存し、処理を中断しました")
         sys.exit(0)
+    finally:
+        # 中断された場合も、それまでの計測結果を書き込む
+        profiler.save(args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+"""テストで使う、pixivの代わり(`benchmarks`)を使った準備をまとめたモジュール"""
+
+import asyncio
+
+from benchmarks.fake_api import FakeAppPixivAPI, SyntheticAccount
+from bookmark_classify.bookmark_classify import bookmarks_classify
+from bookmark_classify.get_bookmarks import fetch_bookmarks_to_cache, get_all_bookmarks_illust
+
+__all__ = ["FakeAppPixivAPI", "SyntheticAccount", "list_illusts", "fetch_to_cache", "classify"]
+
+
+def list_illusts(api, restrict="public"):
+    """`api`のアカウントのブックマークを、間隔を空けずに全て取得する。"""
+    return asyncio.run(get_all_bookmarks_illust(api, api.user_id, restrict, interval_seconds=0))
+
+
+def fetch_to_cache(api, bookmark_cache, pages=None):
+    """ブックマークをキャッシュに取得する。 `pages`を指定した場合は、そのページ数を取得した時点で中断する。"""
+
+    async def _fetch():
+        fetched = 0
+        fetcher = fetch_bookmarks_to_cache(api, api.user_id, bookmark_cache, interval_seconds=0)
+        try:
+            async for _ in fetcher:
+                fetched += 1
+                if fetched == pages:
+                    break
+        finally:
+            await fetcher.aclose()
+
+    asyncio.run(_fetch())
+
+
+def classify(api, tag_rules=None, **kwargs):
+    """ブックマークを全て取得してから、間隔を空けずに整理する。 取得したイラストの一覧を返す。"""
+    illusts = list_illusts(api)
+    asyncio.run(bookmarks_classify(api, illusts, tag_rules, interval_seconds=0, **kwargs))
+    return illusts
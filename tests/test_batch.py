@@ -0,0 +1,183 @@
+import asyncio
+
+from benchmarks.fake_web import FakeWebServer
+from bookmark_classify.batch import apply_plan_batched
+from bookmark_classify.journal import ProgressJournal
+from bookmark_classify.plan import PlanEntry
+from bookmark_classify.retry_queue import RetryQueue
+from bookmark_classify.web_backend import PixivWebBackend
+from tests.fakes import FakeAppPixivAPI, SyntheticAccount
+
+WRITE_METHODS = frozenset({
+    "add_bookmark_tags", "remove_bookmark_tags", "edit_bookmark_restrict", "remove_bookmarks"})
+
+
+class RecordingBackend():
+    """書き込みのリクエストを、送った順番に記録する`PixivWebBackend`のラッパー。"""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.requests = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name not in WRITE_METHODS:
+            return attr
+
+        async def _recorded(bookmark_ids, *args):
+            self.requests.append((name, len(bookmark_ids)))
+            return await attr(bookmark_ids, *args)
+
+        return _recorded
+
+
+async def _apply(account, entries, journal=None, server_options=None, **kwargs):
+    server = FakeWebServer(account, **(server_options or {}))
+    backend = PixivWebBackend(server.session_id, base_url=await server.start())
+    recorder = RecordingBackend(backend)
+    retry_queue = RetryQueue()
+    try:
+        await apply_plan_batched(
+            FakeAppPixivAPI(account), recorder, account.user_id, entries,
+            journal=journal, retry_queue=retry_queue, **kwargs)
+    finally:
+        await backend.close()
+        await server.close()
+    return server, recorder, retry_queue
+
+
+def _untagged_account(bookmarks):
+    return SyntheticAccount(bookmarks, private_fraction=0, tagged_fraction=0, seed=7)
+
+
+def test_edits_are_grouped_by_shared_tags():
+    """共通するタグはタグごとに、1回のリクエストにまとめること。"""
+    account = _untagged_account(6)
+    entries = [PlanEntry(illust_id, "add", ["a", "b"] if illust_id <= 3 else ["a", "c"], "public")
+               for illust_id in range(1, 7)]
+    server, recorder, _ = asyncio.run(_apply(account, entries))
+
+    # ("a",), ("b",), ("c",)の3回にまとまる
+    assert recorder.requests == [("add_bookmark_tags", 6), ("add_bookmark_tags", 3),
+                                 ("add_bookmark_tags", 3)]
+    assert server.calls["add_tags"] == 3
+    for entry in entries:
+        assert set(account.bookmarks[entry.id].tags) == set(entry.tags)
+
+    # リクエストは`batch_size`件ずつに分ける
+    account = _untagged_account(6)
+    _, recorder, _ = asyncio.run(_apply(account, entries, batch_size=4))
+    assert [count for _, count in recorder.requests] == [4, 2, 3, 3]
+
+
+def test_rejected_batch_is_bisected_until_blocked_bookmark_is_found(tmp_path):
+    account = _untagged_account(8)
+    entries = [PlanEntry(illust_id, "add", ["a"], "public") for illust_id in range(1, 9)]
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    server, recorder, retry_queue = asyncio.run(_apply(
+        account, entries, journal, server_options={"blocked_illust_ids": [3]}))
+    journal.close()
+
+    # 8件 -> 4件 -> 2件 -> 1件と分けて送り直し、拒否されたブックマークだけを諦める
+    assert [count for _, count in recorder.requests] == [8, 4, 2, 2, 1, 1, 4]
+    assert server.calls["add_tags"] == len(recorder.requests)
+    assert [rejection.illust_id for rejection in retry_queue.rejections] == [3]
+    assert retry_queue.rejections[0].tags == ["a"]
+    assert account.bookmarks[3].tags == ()
+    assert all(account.bookmarks[illust_id].tags == ("a",)
+               for illust_id in range(1, 9) if illust_id != 3)
+    assert journal.outcomes[3] == "rejected"
+    assert journal.outcomes[4] == "add"
+
+
+def test_bookmarks_removed_after_planning_are_skipped(tmp_path):
+    account = _untagged_account(6)
+    entries = [PlanEntry(1, "add", ["a"], "public"),
+               PlanEntry(2, "delete", [], None),
+               PlanEntry(3, "add", ["a"], "public"),
+               PlanEntry(4, "delete", [], None)]
+    # 計画を立てた後に、ブラウザなどで解除されたブックマーク
+    del account.bookmarks[3]
+    del account.bookmarks[4]
+
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    _, recorder, retry_queue = asyncio.run(_apply(account, entries, journal))
+    journal.close()
+
+    assert recorder.requests == [("remove_bookmarks", 1), ("add_bookmark_tags", 1)]
+    assert journal.outcomes == {1: "add", 2: "delete", 3: "missing", 4: "delete"}
+    assert retry_queue.rejections == []
+    assert 2 not in account.bookmarks
+    assert account.bookmarks[1].tags == ("a",)
+
+
+def test_tags_are_removed_before_added():
+    """ブックマークのタグの数の上限を超えないように、外すタグを追加するタグより先に送ること。"""
+    account = SyntheticAccount(5, private_fraction=0, tagged_fraction=1, seed=8)
+    entries = [PlanEntry(illust_id, "add", [f"new{illust_id}", "shared"], "private")
+               for illust_id in account.bookmarks]
+    _, recorder, _ = asyncio.run(_apply(account, entries))
+
+    actions = [name for name, _ in recorder.requests]
+    assert "remove_bookmark_tags" in actions
+    assert actions == sorted(actions, key=[
+        "remove_bookmark_tags", "add_bookmark_tags", "edit_bookmark_restrict"].index)
+    assert actions.count("edit_bookmark_restrict") == 1
+    for entry in entries:
+        bookmark = account.bookmarks[entry.id]
+        assert set(bookmark.tags) == set(entry.tags)
+        assert bookmark.restrict == "private"
+
+
+def test_rejected_bookmark_keeps_tags_before_editing():
+    """外すタグと追加するタグを送った後に拒否された場合は、送った編集を取り消して編集前に戻すこと。"""
+    account = SyntheticAccount(3, private_fraction=0, tagged_fraction=1, seed=8)
+    before = dict(account.bookmarks)
+    entries = [PlanEntry(1, "add", ["a", "b"], "private"),
+               PlanEntry(2, "add", ["a", "b"], "private"),
+               PlanEntry(3, "add", ["a"], "private")]
+    _, recorder, retry_queue = asyncio.run(_apply(
+        account, entries, server_options={"rejected_tags": ["b"]}))
+
+    assert [(rejection.illust_id, rejection.tags) for rejection in retry_queue.rejections] == \
+        [(1, ["b"]), (2, ["b"])]
+    # 拒否されたブックマークごとに、追加した("a",)を外し、外したタグを付け直す
+    assert recorder.requests[3:] == [
+        ("add_bookmark_tags", 3), ("add_bookmark_tags", 2),
+        ("add_bookmark_tags", 1), ("remove_bookmark_tags", 1), ("add_bookmark_tags", 1),
+        ("add_bookmark_tags", 1), ("remove_bookmark_tags", 1), ("add_bookmark_tags", 1),
+        ("edit_bookmark_restrict", 1)]
+    for illust_id in (1, 2):
+        assert set(account.bookmarks[illust_id].tags) == set(before[illust_id].tags)
+        assert account.bookmarks[illust_id].restrict == "public"
+    assert account.bookmarks[3].tags == ("a",)
+    assert account.bookmarks[3].restrict == "private"
+
+
+def test_tags_added_to_same_bookmarks_share_request():
+    """同じブックマークの組に追加するタグと、ブックマークごとに送る必要があるタグを、それぞれ1回にまとめること。"""
+    account = _untagged_account(6)
+    entries = [PlanEntry(illust_id, "add",
+                         ["series", "work"] if illust_id <= 3 else ["series", f"only{illust_id}"],
+                         "public")
+               for illust_id in range(1, 7)]
+    _, recorder, _ = asyncio.run(_apply(account, entries))
+
+    # ("series", "work")と、ブックマークごとの("only4", "series"), ("only5", "series"), ...
+    assert recorder.requests == [("add_bookmark_tags", 3), ("add_bookmark_tags", 1),
+                                 ("add_bookmark_tags", 1), ("add_bookmark_tags", 1)]
+    for entry in entries:
+        assert set(account.bookmarks[entry.id].tags) == set(entry.tags)
+
+
+def test_rate_limited_requests_are_retried():
+    account = _untagged_account(10)
+    entries = [PlanEntry(illust_id, "add", [f"tag{illust_id}"], "public")
+               for illust_id in range(1, 11)]
+    server, _, retry_queue = asyncio.run(_apply(
+        account, entries,
+        server_options={"limit_requests": 3, "penalty_seconds": 0.05}, backoff_seconds=0.01))
+
+    assert server.limited_seconds > 0
+    assert retry_queue.rejections == []
+    assert all(account.bookmarks[entry.id].tags == tuple(entry.tags) for entry in entries)
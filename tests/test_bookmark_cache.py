@@ -0,0 +1,113 @@
+import asyncio
+import copy
+
+from benchmarks.fake_api import PAGE_SIZE
+from bookmark_classify.bookmark_cache import BookmarkCache
+from bookmark_classify.get_bookmarks import sync_bookmarks
+from tests.fakes import FakeAppPixivAPI, SyntheticAccount, fetch_to_cache
+
+
+def _cached_ids(bookmark_cache):
+    return [illust.id for illust in bookmark_cache.iter_illusts("public")]
+
+
+def _build_cache(tmp_path, account, new_bookmarks):
+    """新しい`new_bookmarks`件のブックマークを除いた一覧を、キャッシュに取得する。"""
+    old_account = copy.deepcopy(account)
+    for illust_id in sorted(old_account.bookmarks, reverse=True)[:new_bookmarks]:
+        del old_account.bookmarks[illust_id]
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    fetch_to_cache(FakeAppPixivAPI(old_account), bookmark_cache)
+    assert bookmark_cache.is_complete("public")
+    return bookmark_cache
+
+
+def test_sync_prepends_only_new_bookmarks(tmp_path):
+    account = SyntheticAccount(100, private_fraction=0, seed=5)
+    bookmark_cache = _build_cache(tmp_path, account, 10)
+
+    api = FakeAppPixivAPI(account)
+    new_illusts = asyncio.run(
+        sync_bookmarks(api, account.user_id, bookmark_cache, interval_seconds=0))
+    assert [illust.id for illust in new_illusts] == list(range(100, 90, -1))
+    # キャッシュにあるイラストが見つかったページで、取得をやめる
+    assert api.calls["user_bookmarks_illust"] == 1
+
+    assert _cached_ids(bookmark_cache) == list(range(100, 0, -1))
+    assert bookmark_cache.get_position("public", 100) < bookmark_cache.get_position("public", 1)
+    bookmark_cache.close()
+
+
+def test_sync_spanning_several_pages(tmp_path):
+    account = SyntheticAccount(100, private_fraction=0, seed=5)
+    bookmark_cache = _build_cache(tmp_path, account, PAGE_SIZE + 5)
+
+    api = FakeAppPixivAPI(account)
+    new_illusts = asyncio.run(
+        sync_bookmarks(api, account.user_id, bookmark_cache, interval_seconds=0))
+    assert len(new_illusts) == PAGE_SIZE + 5
+    assert api.calls["user_bookmarks_illust"] == 2
+    assert _cached_ids(bookmark_cache) == list(range(100, 0, -1))
+    bookmark_cache.close()
+
+
+def test_sync_without_new_bookmarks(tmp_path):
+    account = SyntheticAccount(50, private_fraction=0, seed=5)
+    bookmark_cache = _build_cache(tmp_path, account, 0)
+
+    api = FakeAppPixivAPI(account)
+    new_illusts = asyncio.run(
+        sync_bookmarks(api, account.user_id, bookmark_cache, interval_seconds=0))
+    assert new_illusts == []
+    assert bookmark_cache.count("public") == 50
+    bookmark_cache.close()
+
+
+def test_interrupted_fetch_resumes_from_cursor(tmp_path):
+    account = SyntheticAccount(100, private_fraction=0, seed=6)
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    fetch_to_cache(FakeAppPixivAPI(account), bookmark_cache, pages=2)
+    assert not bookmark_cache.is_complete("public")
+    assert bookmark_cache.count("public") == 2 * PAGE_SIZE
+    assert bookmark_cache.load_cursor("public") is not None
+    bookmark_cache.close()
+
+    # 別のインスタンスで読み込んでも、中断したページから再開する
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    api = FakeAppPixivAPI(account)
+    fetch_to_cache(api, bookmark_cache)
+    assert api.calls["user_bookmarks_illust"] == 2
+    assert bookmark_cache.is_complete("public")
+    assert bookmark_cache.load_cursor("public") is None
+    assert _cached_ids(bookmark_cache) == list(range(100, 0, -1))
+
+    # 完了した後の取得は、キャッシュを空にしてから最初のページから行う
+    api = FakeAppPixivAPI(account)
+    fetch_to_cache(api, bookmark_cache)
+    assert api.calls["user_bookmarks_illust"] == 4
+    assert _cached_ids(bookmark_cache) == list(range(100, 0, -1))
+    bookmark_cache.close()
+
+
+def test_page_cursor_refetches_page_after_deletion(tmp_path):
+    """記録したクエリで取得し直したページは、解除されたブックマークを除いて同じ位置から始まること。"""
+    account = SyntheticAccount(100, private_fraction=0, seed=6)
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    fetch_to_cache(FakeAppPixivAPI(account), bookmark_cache)
+
+    position = bookmark_cache.get_position("public", 50)
+    start, qs = bookmark_cache.find_page_cursor("public", position)
+    assert start == PAGE_SIZE
+    cached = [illust.id for illust in bookmark_cache.iter_illusts("public", start)][:PAGE_SIZE]
+
+    # 前のページのブックマークを解除しても、ページの先頭は変わらない
+    del account.bookmarks[95]
+    del account.bookmarks[50]
+    api = FakeAppPixivAPI(account)
+    json_result = asyncio.run(api.user_bookmarks_illust(**qs))
+    assert [illust.id for illust in json_result.illusts] == \
+        [illust_id for illust_id in cached if illust_id != 50] + [100 - 2 * PAGE_SIZE]
+
+    # 最初のページは、クエリなしで先頭から取得する
+    assert bookmark_cache.find_page_cursor("public", 0) == (0, None)
+    bookmark_cache.close()
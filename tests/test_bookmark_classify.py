@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from bookmark_classify.bookmark_classify import bookmark_add
+from bookmark_classify.exceptions import BookmarkAddFailed, BookmarkAddRateLimited, TagRejected
+
+
+class _ErrorAPI():
+    """ブックマークの追加に、常に`message`のエラーを返すAPI。"""
+
+    def __init__(self, message):
+        self.message = message
+
+    async def illust_bookmark_add(self, illust_id, **kwargs):
+        return {"error": {"user_message": "", "message": self.message, "reason": ""}}
+
+
+@pytest.mark.parametrize("message, exception", [
+    ("Rate Limit", BookmarkAddRateLimited),
+    ("Invalid tag: a/b", TagRejected),
+    ("タグに使用できない文字が含まれています", TagRejected),
+    # タグに触れていても、検証のエラーではないものはやり直す
+    ("Failed to update tags. Please try again later.", BookmarkAddFailed),
+    ("タグの更新に失敗しました。しばらくしてからもう一度お試しください。", BookmarkAddFailed),
+    ("Error occurred at the OAuth process.", BookmarkAddFailed),
+])
+def test_add_error_is_classified_by_known_messages(message, exception):
+    with pytest.raises(exception):
+        asyncio.run(bookmark_add(_ErrorAPI(message), 1, ["tag"], "public"))
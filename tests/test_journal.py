@@ -0,0 +1,176 @@
+import asyncio
+
+from bookmark_classify import plan
+from bookmark_classify.bookmark_classify import decision_fingerprint
+from bookmark_classify.journal import ProgressJournal
+from bookmark_classify.tag_rules import TagRules
+from tests.fakes import FakeAppPixivAPI, SyntheticAccount, classify
+
+
+def test_replays_committed_records(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path, commit_every=2)
+    journal.record(1, "classified")
+    journal.record(2, "deleted")
+    journal.record(3)
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert len(journal) == 3
+    assert journal.outcomes == {1: "classified", 2: "deleted", 3: "done"}
+    assert 2 in journal
+    assert journal.is_done(3)
+    assert not journal.is_done(4)
+    journal.close()
+
+
+def test_uncommitted_records_are_lost_on_crash(tmp_path):
+    """まとめて書き込む前に強制終了された場合、失われるのは最後の書き込み以降の記録だけであること。"""
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path, commit_every=2, commit_seconds=3600)
+    journal.record(1)
+    journal.record(2)
+    journal.record(3)
+    # `close`を呼ばずに、別のインスタンスで読み込む
+    replayed = ProgressJournal(path)
+    assert set(replayed.outcomes) == {1, 2}
+    replayed.close()
+    journal.close()
+
+
+def test_ignores_truncated_last_line(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text('{"id": 1, "outcome": "done"}\n{"id": 2, "outc', encoding="utf-8")
+    journal = ProgressJournal(path)
+    assert journal.outcomes == {1: "done"}
+    journal.close()
+
+
+def test_later_records_override_earlier_ones(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path)
+    journal.record(1, "rejected")
+    journal.record(1, "classified")
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert journal.outcomes == {1: "classified"}
+    journal.close()
+
+
+def test_reset_removes_every_record(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path)
+    journal.record(1)
+    journal.commit()
+    journal.reset()
+    journal.record(2)
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert journal.outcomes == {2: "done"}
+    journal.close()
+
+
+def test_fingerprint_invalidates_only_changed_decisions(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path)
+    journal.record(1, "classified", "aaaa")
+    journal.record(2, "classified", "bbbb")
+    # 指紋を記録していない以前の形式の記録
+    journal.record(3, "classified")
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert journal.is_done(1, "aaaa")
+    assert not journal.is_done(2, "cccc")
+    assert journal.is_done(2)
+    # 指紋を記録していないイラストは、指紋に関わらず処理済みとして扱う
+    assert journal.is_done(3, "dddd")
+    journal.close()
+
+
+def test_record_without_fingerprint_clears_previous_one(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path)
+    journal.record(1, "classified", "aaaa")
+    journal.record(1, "classified")
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert journal.fingerprints == {}
+    assert journal.is_done(1, "bbbb")
+    journal.close()
+
+
+def test_rule_change_reprocesses_only_affected_illusts(tmp_path):
+    """設定を変更した後の実行では、判定が変わったイラストだけを処理し直すこと。"""
+    account = SyntheticAccount(80, private_fraction=0, unknown_fraction=0, seed=4)
+    path = tmp_path / "progress.jsonl"
+
+    def _run(tag_rules):
+        api = FakeAppPixivAPI(account)
+        journal = ProgressJournal(path)
+        illusts = classify(api, tag_rules, journal=journal)
+        journal.close()
+        return illusts, api
+
+    illusts, _ = _run(TagRules(["users"]))
+    new_rules = TagRules(["users"], private_tags=["tag1"])
+    changed = {illust.id: decision_fingerprint(illust, new_rules) for illust in illusts
+               if decision_fingerprint(illust, TagRules(["users"]))
+               != decision_fingerprint(illust, new_rules)}
+    assert 0 < len(changed) < len(illusts)
+
+    # 判定が変わったイラストだけ、編集前の状態を取得し直して書き込み、確認する
+    _, api = _run(new_rules)
+    assert api.calls["illust_bookmark_detail"] == 2 * len(changed)
+    assert api.calls["illust_bookmark_add"] == len(changed)
+    # タグが揃っているブックマークも、プライバシー設定は書き換える
+    assert all(account.bookmarks[illust_id].restrict == "private" for illust_id in changed)
+    journal = ProgressJournal(path)
+    assert all(journal.is_done(illust_id, fingerprint)
+               for illust_id, fingerprint in changed.items())
+    journal.close()
+
+    # 設定を変えずに実行した場合は、何も処理し直さない
+    _, api = _run(new_rules)
+    assert api.calls["illust_bookmark_detail"] == 0
+    assert api.calls["illust_bookmark_add"] == 0
+
+
+def test_apply_plan_skips_only_illusts_classified_with_same_decision(tmp_path):
+    """整理した後に計画を実行した場合は、判定が変わったイラストだけを実行すること。"""
+    account = SyntheticAccount(80, private_fraction=0, unknown_fraction=0, seed=4)
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path)
+    illusts = classify(FakeAppPixivAPI(account), TagRules(["users"]), journal=journal)
+    journal.close()
+
+    def _apply(tag_rules):
+        # 計画はファイルを経由しても、判定の指紋を保つ
+        plan_path = tmp_path / "plan.json"
+        plan.save_plan(plan_path, plan.plan_bookmarks(illusts, tag_rules))
+        entries = plan.load_plan(plan_path)
+        journal = ProgressJournal(path)
+        summary = plan.summarize_plan(entries, journal=journal)
+        api = FakeAppPixivAPI(account)
+        asyncio.run(plan.apply_plan(api, entries, interval_seconds=0, journal=journal))
+        journal.close()
+        return summary, api
+
+    summary, api = _apply(TagRules(["users"]))
+    assert summary["done"] == len(illusts)
+    assert summary["requests"] == 0
+    assert api.calls["illust_bookmark_detail"] == 0
+    assert api.calls["illust_bookmark_add"] == 0
+
+    new_rules = TagRules(["users"], private_tags=["tag1"])
+    changed = {illust.id for illust in illusts
+               if decision_fingerprint(illust, TagRules(["users"]))
+               != decision_fingerprint(illust, new_rules)}
+    summary, api = _apply(new_rules)
+    assert summary["merge"] == len(changed)
+    assert summary["done"] == len(illusts) - len(changed)
+    assert api.calls["illust_bookmark_add"] == len(changed)
+    assert all(account.bookmarks[illust_id].restrict == "private" for illust_id in changed)
@@ -0,0 +1,53 @@
+import json
+import pstats
+import tracemalloc
+
+import pytest
+
+from bookmark_classify.profiling import PhaseProfiler
+
+
+def _allocate(size):
+    return bytearray(size)
+
+
+def _work():
+    return sum(range(1000))
+
+
+@pytest.fixture(autouse=True)
+def stop_tracemalloc():
+    """計測で始めたtracemallocを止め、他のテストのメモリの確保を遅くしない。"""
+    yield
+    tracemalloc.stop()
+
+
+def test_nested_phase_has_own_profile_and_peak_memory(tmp_path):
+    """入れ子のフェーズも、そのフェーズだけの関数ごとの統計とメモリ使用量の最大値を記録すること。"""
+    profiler = PhaseProfiler(cprofile=True)
+    with profiler.phase("outer"):
+        data = _allocate(8 * 1024 * 1024)
+        del data
+        with profiler.phase("inner"):
+            _work()
+        with profiler.phase("inner"):
+            _work()
+
+    path = tmp_path / "profile.json"
+    profiler.save(path)
+    report = json.loads(path.read_text(encoding="utf-8"))
+    assert report["inner"]["count"] == 2
+    assert report["inner"]["peak_memory_bytes"] < 8 * 1024 * 1024
+    assert 8 * 1024 * 1024 <= report["outer"]["peak_memory_bytes"]
+
+    def _calls(name):
+        stats = pstats.Stats(str(tmp_path / f"profile.json.{name}.pstats"))
+        return {func[2]: stats.stats[func][1] for func in stats.stats}
+
+    # 入れ子のフェーズの統計は外側のフェーズにも含まれ、入れ子のフェーズには外側だけの処理は含まれない
+    inner = _calls("inner")
+    outer = _calls("outer")
+    assert inner["_work"] == 2
+    assert "_allocate" not in inner
+    assert outer["_work"] == 2
+    assert outer["_allocate"] == 1
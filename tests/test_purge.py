@@ -0,0 +1,145 @@
+import asyncio
+
+from bookmark_classify.bookmark_cache import BookmarkCache
+from bookmark_classify.bookmark_classify import decision_fingerprint
+from bookmark_classify.exceptions import BookmarkDeleteRateLimited
+from bookmark_classify.journal import ProgressJournal
+from bookmark_classify.purge import find_remaining_bookmarks, purge_bookmarks
+from bookmark_classify.retry_queue import RetryQueue
+from tests.fakes import FakeAppPixivAPI, SyntheticAccount, fetch_to_cache, list_illusts
+
+UNKNOWN_IDS = [27, 35, 72, 74, 78, 82, 86, 97]
+
+
+def _account():
+    # `UNKNOWN_IDS`の8件が、閲覧できないイラストになる
+    account = SyntheticAccount(100, private_fraction=0, unknown_fraction=0.1, seed=1)
+    assert sorted(i for i, bookmark in account.bookmarks.items() if bookmark.unknown) == UNKNOWN_IDS
+    return account
+
+
+def _build_cache(tmp_path, account):
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    fetch_to_cache(FakeAppPixivAPI(account), bookmark_cache)
+    return bookmark_cache
+
+
+def _find(account, bookmark_cache, illust_ids):
+    api = FakeAppPixivAPI(account)
+    remaining = asyncio.run(find_remaining_bookmarks(
+        api, account.user_id, bookmark_cache, illust_ids, interval_seconds=0))
+    return remaining, api.calls["user_bookmarks_illust"]
+
+
+def test_find_remaining_fetches_only_pages_up_to_original_position(tmp_path):
+    """解除されたブックマークの分だけ前に詰まるため、ページの先頭から元の位置までを取得すれば足りること。"""
+    account = _account()
+    bookmark_cache = _build_cache(tmp_path, account)
+    # IDの降順に並ぶため、ID`k`の位置は`100 - k`になる
+    assert bookmark_cache.get_position("public", 50) == 50
+
+    # 前のページと、同じページの前の方のブックマークを解除する
+    for illust_id in [95, 70, 69, 60]:
+        del account.bookmarks[illust_id]
+    remaining, calls = _find(account, bookmark_cache, [60, 50, 45])
+    assert remaining == {50, 45}
+    assert calls == 1
+
+    # ページの最後のブックマークは、前が全て解除されていても見つかる
+    for illust_id in range(68, 41, -1):
+        account.bookmarks.pop(illust_id, None)
+    remaining, calls = _find(account, bookmark_cache, [50, 41])
+    assert remaining == {41}
+    assert calls == 1
+
+    # 別々のページのブックマークは、ページごとに取得する
+    remaining, calls = _find(account, bookmark_cache, [41, 5])
+    assert remaining == {41, 5}
+    assert calls == 2
+    bookmark_cache.close()
+
+
+def test_find_remaining_without_page_cursors(tmp_path):
+    """クエリを記録していないキャッシュでは、一覧の先頭から取得すること。"""
+    account = _account()
+    bookmark_cache = BookmarkCache(tmp_path / "bookmarks.sqlite3")
+    bookmark_cache.append("public", list_illusts(FakeAppPixivAPI(account)))
+    bookmark_cache.finish("public")
+    assert bookmark_cache.find_page_cursor("public", 50) == (0, None)
+
+    for illust_id in range(100, 90, -1):
+        del account.bookmarks[illust_id]
+    remaining, calls = _find(account, bookmark_cache, [95, 50])
+    assert remaining == {50}
+    assert calls == 2
+    bookmark_cache.close()
+
+
+def test_purge_records_deleted_bookmarks_with_fingerprint(tmp_path):
+    account = _account()
+    bookmark_cache = _build_cache(tmp_path, account)
+    illusts = {illust.id: illust for illust in bookmark_cache.iter_illusts("public")}
+
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    api = FakeAppPixivAPI(account)
+    asyncio.run(purge_bookmarks(
+        api, account.user_id, bookmark_cache, delete_if_unknown=True, interval_seconds=0,
+        journal=journal))
+    journal.close()
+
+    assert api.calls["illust_bookmark_delete"] == len(UNKNOWN_IDS)
+    assert not set(UNKNOWN_IDS) & set(account.bookmarks)
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    assert journal.outcomes == dict.fromkeys(UNKNOWN_IDS, "deleted")
+    assert journal.fingerprints == {
+        illust_id: decision_fingerprint(illusts[illust_id], delete_if_unknown=True)
+        for illust_id in UNKNOWN_IDS}
+
+    # 判定が変わっていなければ、次の実行では解除し直さない
+    api = FakeAppPixivAPI(account)
+    asyncio.run(purge_bookmarks(
+        api, account.user_id, bookmark_cache, delete_if_unknown=True, interval_seconds=0,
+        journal=journal))
+    journal.close()
+    assert api.calls["illust_bookmark_delete"] == 0
+    bookmark_cache.close()
+
+
+def test_purge_retries_deletes_ignored_by_rate_limits(tmp_path):
+    account = _account()
+    bookmark_cache = _build_cache(tmp_path, account)
+
+    api = FakeAppPixivAPI(account, limit_requests=5, penalty_seconds=0.02)
+    retry_queue = RetryQueue()
+    asyncio.run(purge_bookmarks(
+        api, account.user_id, bookmark_cache, delete_if_unknown=True, interval_seconds=0,
+        retry_queue=retry_queue, backoff_seconds=0.05))
+
+    # 無視された解除は、一覧で残っていることを確認してから解除し直す
+    assert api.ignored_writes > 0
+    assert api.calls["illust_bookmark_delete"] == len(UNKNOWN_IDS) + api.ignored_writes
+    assert not set(UNKNOWN_IDS) & set(account.bookmarks)
+    assert retry_queue.dead_letters == []
+    bookmark_cache.close()
+
+
+def test_purge_gives_up_after_max_retries(tmp_path):
+    account = _account()
+    bookmark_cache = _build_cache(tmp_path, account)
+
+    # 全ての解除が無視される
+    api = FakeAppPixivAPI(account, limit_requests=0)
+    retry_queue = RetryQueue()
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    asyncio.run(purge_bookmarks(
+        api, account.user_id, bookmark_cache, delete_if_unknown=True, interval_seconds=0,
+        journal=journal, retry_queue=retry_queue, max_retries=2, backoff_seconds=0))
+    journal.close()
+
+    assert api.calls["illust_bookmark_delete"] == 3 * len(UNKNOWN_IDS)
+    assert set(UNKNOWN_IDS) <= set(account.bookmarks)
+    assert sorted(dead_letter.illust_id for dead_letter in retry_queue.dead_letters) == UNKNOWN_IDS
+    assert all((dead_letter.endpoint, dead_letter.attempts) ==
+               (BookmarkDeleteRateLimited.endpoint, 3) for dead_letter in retry_queue.dead_letters)
+    assert journal.outcomes == {}
+    bookmark_cache.close()
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from bookmark_classify.exceptions import (BookmarkAddRateLimited, BookmarkDeleteRateLimited,
+                                          CoolingDown, RequestTimedOut, TagRejected)
+from bookmark_classify.retry_queue import DeadLetter, RetryQueue
+
+
+def _item(illust_id):
+    return SimpleNamespace(id=illust_id)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """`time.monotonic`を、テストから進められる時計に置き換える。"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr("bookmark_classify.retry_queue.time.monotonic", lambda: now.value)
+    return now
+
+
+def test_cooldown_doubles_up_to_max(clock):
+    queue = RetryQueue(cooldown_seconds=10, max_cooldown_seconds=35)
+    endpoint = BookmarkAddRateLimited.endpoint
+    cooldowns = []
+    for _ in range(4):
+        assert queue.on_ratelimited(endpoint)
+        cooldowns.append(queue.cooldown_remaining(endpoint))
+        clock.value += cooldowns[-1]
+    assert cooldowns == [10, 20, 35, 35]
+
+    # 成功した後は、初期値に戻る
+    queue.on_success(endpoint)
+    assert queue.on_ratelimited(endpoint)
+    assert queue.cooldown_remaining(endpoint) == 10
+
+
+def test_ratelimit_during_cooldown_is_not_counted_twice(clock):
+    """止めている最中に届いたレート制限は、同じレート制限として扱うこと。"""
+    queue = RetryQueue(cooldown_seconds=10)
+    endpoint = BookmarkAddRateLimited.endpoint
+    assert queue.on_ratelimited(endpoint)
+    clock.value += 5
+    assert not queue.on_ratelimited(endpoint)
+    assert queue.cooldown_remaining(endpoint) == 5
+
+
+def test_cooldown_stops_only_ratelimited_endpoint(clock):
+    queue = RetryQueue(cooldown_seconds=10)
+    queue.on_ratelimited(BookmarkAddRateLimited.endpoint)
+    assert queue.cooldown_remaining(BookmarkDeleteRateLimited.endpoint) == 0
+
+    # どのAPIか分からないレート制限は、全てのAPIを止める
+    queue.on_ratelimited(None)
+    assert queue.cooldown_remaining(BookmarkDeleteRateLimited.endpoint) == 10
+
+
+def test_pop_ready_waits_for_cooldown(clock):
+    queue = RetryQueue(cooldown_seconds=10)
+    queue.on_ratelimited(BookmarkAddRateLimited.endpoint)
+    assert queue.push(0, _item(1), 1, BookmarkAddRateLimited(1))
+    # 止めていないAPIの処理は、すぐにやり直せる
+    assert queue.push(1, _item(2), 1, BookmarkDeleteRateLimited(2))
+    assert queue.push(2, _item(3), 1, RequestTimedOut(BookmarkDeleteRateLimited.endpoint, 30))
+
+    assert [entry.item.id for entry in queue.pop_ready()] == [2, 3]
+    assert queue.wait_seconds() == 10
+    assert queue.pop_ready() == []
+
+    clock.value += 10
+    entries = queue.pop_ready()
+    assert [(entry.item.id, entry.endpoint) for entry in entries] == \
+        [(1, BookmarkAddRateLimited.endpoint)]
+    assert len(queue) == 0
+    assert queue.wait_seconds() is None
+
+
+def test_push_after_max_retries_records_dead_letter(clock, tmp_path):
+    queue = RetryQueue(max_retries=2)
+    for attempts in range(1, 3):
+        assert queue.push(0, _item(1), attempts, BookmarkAddRateLimited(1))
+    assert not queue.push(0, _item(1), 3, BookmarkAddRateLimited(1))
+    assert queue.dead_letters == [
+        DeadLetter(1, BookmarkAddRateLimited.endpoint, 3, str(BookmarkAddRateLimited(1)))]
+    assert len(queue) == 2
+
+    path = tmp_path / "dead_letters.json"
+    queue.save_dead_letters(path)
+    saved = json.loads(path.read_text(encoding="utf-8"))
+    assert saved == [queue.dead_letters[0]._asdict()]
+
+
+def test_reject_is_not_retried(tmp_path):
+    queue = RetryQueue()
+    queue.reject(_item(1), TagRejected(1, ["tag"]))
+    assert len(queue) == 0
+    assert [(rejection.illust_id, rejection.tags) for rejection in queue.rejections] == \
+        [(1, ["tag"])]
+
+    # 記録がない場合は、ファイルを作らない
+    path = tmp_path / "dead_letters.json"
+    queue.save_dead_letters(path)
+    assert not path.exists()
+
+
+def test_cooldown_api_fails_without_request(clock):
+    class _API():
+        def __init__(self):
+            self.calls = []
+
+        async def illust_bookmark_add(self, illust_id, **kwargs):
+            self.calls.append(illust_id)
+
+        async def illust_bookmark_delete(self, illust_id):
+            self.calls.append(illust_id)
+
+    api = _API()
+    queue = RetryQueue(cooldown_seconds=10)
+    wrapped = queue.wrap(api)
+    queue.on_ratelimited(BookmarkAddRateLimited.endpoint)
+
+    with pytest.raises(CoolingDown) as excinfo:
+        asyncio.run(wrapped.illust_bookmark_add(1, restrict="public"))
+    assert excinfo.value.endpoint == BookmarkAddRateLimited.endpoint
+    asyncio.run(wrapped.illust_bookmark_delete(2))
+    assert api.calls == [2]
+
+    clock.value += 10
+    asyncio.run(wrapped.illust_bookmark_add(1, restrict="public"))
+    assert api.calls == [2, 1]
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from bookmark_classify.tag_rules import TagRules
+
+
+def naive_is_excluded(tag, exclude_tags):
+    """コンパイルする前の実装と同じ、単純な部分一致の判定。"""
+    return any(exclude_tag in tag for exclude_tag in exclude_tags)
+
+
+@pytest.mark.parametrize("exclude_tags, tag", [
+    (["users"], "オリジナル10000users"),
+    (["users"], "原神5000users入り"),
+    (["users"], "user"),
+    (["he", "she", "his", "hers"], "ushers"),
+    (["abcd", "bc"], "abce"),
+    (["aab"], "aaab"),
+    (["寒いタグ芸"], "寒いタグ"),
+    (["R-18"], "R-18G"),
+    ([], "tag"),
+])
+def test_is_excluded_matches_substring(exclude_tags, tag):
+    """Aho-Corasickオートマトンの判定が、単純な部分一致と一致すること。"""
+    rules = TagRules(exclude_tags)
+    assert rules.is_excluded(tag) == naive_is_excluded(tag, exclude_tags)
+
+
+def test_is_excluded_matches_substring_randomly():
+    """重なり合うパターンを含む、ランダムなタグでも単純な部分一致と一致すること。"""
+    rng = random.Random(0)
+    alphabet = "abc"
+    for _ in range(200):
+        exclude_tags = ["".join(rng.choices(alphabet, k=rng.randint(1, 4)))
+                        for _ in range(rng.randint(1, 5))]
+        rules = TagRules(exclude_tags)
+        for _ in range(20):
+            tag = "".join(rng.choices(alphabet, k=rng.randint(0, 10)))
+            assert rules.is_excluded(tag) == naive_is_excluded(tag, exclude_tags), \
+                (exclude_tags, tag)
+
+
+def test_empty_pattern_excludes_every_tag():
+    """空文字列のパターンは、単純な部分一致と同じく全てのタグに一致すること。"""
+    rules = TagRules([""])
+    assert rules.is_excluded("tag")
+    assert rules.filter_excluded(["a", "b"]) == []
+
+
+def test_filter_excluded_keeps_order():
+    rules = TagRules(["users"])
+    tags = ["オリジナル", "10000users入り", "風景", "5000users"]
+    assert rules.filter_excluded(tags) == ["オリジナル", "風景"]
+
+
+def test_private_and_delete_tags_match_exactly():
+    """`private_tags`と`delete_tags`は、部分一致ではなく完全一致で評価すること。"""
+    rules = TagRules(private_tags=["R-18"], delete_tags=["地雷タグ"])
+    assert rules.is_private(["R-18", "オリジナル"])
+    assert not rules.is_private(["R-18G"])
+    assert rules.is_delete_target(["地雷タグ"])
+    assert not rules.is_delete_target(["地雷タグ2"])
@@ -0,0 +1,144 @@
+import copy
+
+import pytest
+
+from bookmark_classify.exceptions import (BookmarkAddRateLimited, BookmarkDeleteRateLimited,
+                                          RequestTimedOut)
+from bookmark_classify.journal import ProgressJournal
+from bookmark_classify.retry_queue import RetryQueue
+from bookmark_classify.tag_rules import TagRules
+from bookmark_classify.verification import PendingWrite, VerificationPolicy
+from tests.fakes import FakeAppPixivAPI, SyntheticAccount, classify
+
+
+def test_always_verifies_every_write():
+    policy = VerificationPolicy("always")
+    assert all(policy.should_verify() for _ in range(10))
+    assert not policy.should_flush()
+
+
+def test_sampled_verifies_every_n_writes():
+    policy = VerificationPolicy("sampled", every_n=3)
+    assert [policy.should_verify() for _ in range(6)] == [False, False, True] * 2
+    assert policy.expected_ratio == pytest.approx(1 / 3)
+
+
+def test_sampled_fraction_bounds():
+    assert not any(VerificationPolicy("sampled", fraction=0.0).should_verify() for _ in range(50))
+    assert all(VerificationPolicy("sampled", fraction=1.0).should_verify() for _ in range(50))
+
+
+def test_deferred_flushes_every_batch_size_writes():
+    policy = VerificationPolicy("deferred", batch_size=3)
+    for illust_id in range(2):
+        assert not policy.should_verify()
+        policy.defer(PendingWrite(illust_id, ["tag"], "public"))
+        assert not policy.should_flush()
+
+    policy.defer(PendingWrite(2, None, None))
+    assert policy.should_flush()
+
+    # 最後の書き込みの確認に成功すれば、それまでの書き込みも成功したものとして扱う
+    policy.on_verified()
+    assert policy.pending == []
+    assert not policy.should_flush()
+
+
+def test_on_verified_keeps_writes_started_after_checkpoint():
+    """確認した書き込みと同時に行われていた書き込みは、成功したものとして扱わずに残すこと。"""
+    policy = VerificationPolicy("deferred")
+    first = PendingWrite(1, ["a"], "public", policy.checkpoint())
+    policy.defer(first)
+    checkpoint = policy.checkpoint()
+    second = PendingWrite(2, ["b"], "public", checkpoint)
+    policy.defer(second)
+    concurrent = PendingWrite(3, ["c"], "public", policy.checkpoint())
+    policy.defer(concurrent)
+
+    policy.on_verified(checkpoint, second)
+    assert policy.pending == [concurrent]
+
+
+def test_failure_verifies_every_write_until_recovered():
+    policy = VerificationPolicy("deferred", batch_size=2)
+    policy.defer(PendingWrite(1, ["a"], "public"))
+    policy.defer(PendingWrite(2, None, None))
+
+    policy.on_failed()
+    drained = policy.drain()
+    assert [write.illust_id for write in drained] == [1, 2]
+    assert isinstance(drained[0].exception(), BookmarkAddRateLimited)
+    assert isinstance(drained[1].exception(), BookmarkDeleteRateLimited)
+    assert policy.pending == []
+    assert policy.should_verify()
+    assert policy.should_verify()
+
+    policy.on_verified()
+    assert not policy.should_verify()
+
+
+def _classify(api, verification=None):
+    retry_queue = RetryQueue(50, cooldown_seconds=0.01, max_cooldown_seconds=0.05)
+    classify(api, TagRules(["users"], ["R-18"]), delete_if_unknown=True,
+             verification=verification, retry_queue=retry_queue)
+    return retry_queue
+
+
+@pytest.mark.parametrize("verification", [
+    VerificationPolicy("always"),
+    VerificationPolicy("sampled", every_n=3),
+    VerificationPolicy("deferred", batch_size=5),
+])
+def test_writes_ignored_by_rate_limits_are_redone(verification):
+    """確認を省略した書き込みがレート制限で無視されても、後の確認で検出してやり直すこと。"""
+    base = SyntheticAccount(120, private_fraction=0, unknown_fraction=0.05, seed=1)
+    expected = copy.deepcopy(base)
+    _classify(FakeAppPixivAPI(expected))
+
+    account = copy.deepcopy(base)
+    api = FakeAppPixivAPI(account, limit_requests=15, window_seconds=1, penalty_seconds=0.02)
+    retry_queue = _classify(api, verification)
+
+    assert api.ignored_writes > 0
+    assert retry_queue.dead_letters == []
+    assert account.bookmarks == expected.bookmarks
+
+
+class _VerificationTimeoutAPI():
+    """書き込んだ後のブックマークの詳細の取得だけが、常に期限を過ぎる`FakeAppPixivAPI`のラッパー。"""
+
+    def __init__(self, api):
+        self._api = api
+        self.written = set()
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    async def illust_bookmark_add(self, illust_id, **kwargs):
+        self.written.add(illust_id)
+        return await self._api.illust_bookmark_add(illust_id, **kwargs)
+
+    async def illust_bookmark_detail(self, illust_id):
+        if illust_id in self.written:
+            raise RequestTimedOut("illust_bookmark_detail", 30)
+        return await self._api.illust_bookmark_detail(illust_id)
+
+
+def test_unverifiable_writes_are_given_up(tmp_path):
+    """最後の確認が期限を過ぎ続ける場合は、上限の回数で確認していない書き込みを諦めること。"""
+    account = SyntheticAccount(10, private_fraction=0, unknown_fraction=0, seed=1)
+    api = _VerificationTimeoutAPI(FakeAppPixivAPI(account))
+    retry_queue = RetryQueue(2)
+    journal = ProgressJournal(tmp_path / "progress.jsonl")
+    classify(api, TagRules(["users"]), verification=VerificationPolicy("deferred", batch_size=100),
+             retry_queue=retry_queue, journal=journal)
+    journal.close()
+
+    assert api.written
+    assert api.calls["illust_bookmark_add"] == len(api.written)
+    assert sorted(dead_letter.illust_id for dead_letter in retry_queue.dead_letters) == \
+        sorted(api.written)
+    assert all(dead_letter.endpoint == "illust_bookmark_detail"
+               for dead_letter in retry_queue.dead_letters)
+    # 確認できなかった書き込みは、処理済みとして記録しない
+    assert not any(illust_id in journal for illust_id in api.written)